@@ -0,0 +1,188 @@
+import os
+import json
+import math
+import time
+import platform
+import tempfile
+from collections import defaultdict
+import torch
+from torch import nn
+
+from data import DatasetSubset
+from profiling import NullProfiler
+from distributed import NullWriter
+
+AUTOTUNE_CACHE = os.path.join("cache", "autotune.json")
+
+
+def host_key() -> str:
+    """Identifies the machine the configuration is tuned for (the host name, the number of cores and the torch version)."""
+    return "{}-{}cpu-torch{}".format(platform.node(), os.cpu_count(), torch.__version__)
+
+def _powers_of_two(maximum: int, start: int = 1) -> list:
+    values = [start] + [2 ** i for i in range(maximum.bit_length()) if start < 2 ** i <= maximum]
+    return sorted(set(values + [maximum]))
+
+class LimitedStream(torch.utils.data.IterableDataset):
+    """The first `size` data points of a streaming dataset (divided over the workers), which still provides the dataset
+    specific methods (e.g. `attribute_counts`)."""
+    def __init__(self, dataset: torch.utils.data.IterableDataset, size: int):
+        self.dataset = dataset
+        self.size = size
+
+    def __getattr__(self, name: str):
+        # Guard against recursion while the object is unpickled in a worker, before `dataset` is set
+        if name == "dataset" or name.startswith("__"):
+            raise AttributeError(name)
+        return getattr(self.dataset, name)
+
+    def __len__(self) -> int:
+        return min(self.size, len(self.dataset))
+
+    def __iter__(self):
+        worker = torch.utils.data.get_worker_info()
+        size = math.ceil(self.size / worker.num_workers) if worker else self.size
+        for i, sample in enumerate(self.dataset):
+            if i == size:
+                return
+            yield sample
+
+def load_cache(path: str) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def save_cache(path: str, cache: dict):
+    # Written to a temporary file first, such that runs that are started at the same time never read a partial file
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(cache, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+class StepTimer(NullProfiler):
+    """Profiler for `train_model` that records the time at the end of every training step, per pass ("group" or "joint")."""
+    def __init__(self, device: torch.device):
+        self._synchronize = device.type == "cuda"
+        self.times = defaultdict(list)
+
+    def end_step(self, prefix: str, step: int):
+        if self._synchronize:
+            torch.cuda.synchronize()
+        self.times[prefix].append(time.perf_counter())
+
+
+def time_configuration(model: nn.Module, train_set: torch.utils.data.Dataset, collate_fn, device: torch.device,
+                       num_workers: int, num_threads: int, pin_memory: bool, prefetch_factor: int, batch_size: int,
+                       steps: int, warmup: int, training: dict) -> float:
+    """Returns the training throughput (samples/s, over all passes) of `train_model` with data from a data loader with
+    the given settings: an epoch on `warmup + steps` batches of the training set, with both passes (the group specific
+    and the joint pass) and the optimizer steps of a real run. The first `warmup` steps of every pass (starting the
+    workers, lazy initializations) are not timed.
+
+    Args:
+        training (dict): the arguments of `train_model` that set the work of a step ("optimizer", "lr_f", "lr_g",
+            "lr_j", "lmbda", "d_tilde_condition" and "fused_backward").
+    """
+    # Imported here, since train_model imports this module
+    from train_model import train_model
+
+    if warmup < 1:
+        raise ValueError("At least one warmup step is needed to time the steps after it")
+    torch.set_num_threads(num_threads)
+    size = (warmup + steps) * batch_size
+    if isinstance(train_set, torch.utils.data.IterableDataset):
+        train_set = LimitedStream(train_set, size)
+        loader_kwargs = {}
+    else:
+        if len(train_set) < size:
+            raise ValueError("The training set is smaller than {} batches of {}".format(warmup + steps, batch_size))
+        indices = torch.randperm(len(train_set))[:size].tolist()
+        train_set, loader_kwargs = DatasetSubset(train_set, indices), {"shuffle": True}
+    # The prefetch factor is only valid with worker processes
+    if num_workers:
+        loader_kwargs["prefetch_factor"] = prefetch_factor
+    loader = torch.utils.data.DataLoader(train_set, batch_size=batch_size, num_workers=num_workers, pin_memory=pin_memory,
+                                         collate_fn=collate_fn, drop_last=True, **loader_kwargs)
+
+    timer = StepTimer(device)
+    with tempfile.TemporaryDirectory() as directory:
+        # The final model is saved in the temporary directory (an absolute checkpoint name is not put under runs/)
+        train_model(model, loader, None, epochs=1, checkpoint_name=os.path.join(directory, "autotune.pt"), device=device,
+                    progress_bar=True, writer=NullWriter(), profiler=timer, **training)
+    duration = 0.0
+    for times in timer.times.values():
+        if len(times) < warmup + steps:
+            raise ValueError("The training set is smaller than {} batches of {}".format(warmup + steps, batch_size))
+        duration += times[warmup + steps - 1] - times[warmup - 1]
+    # Every pass processes `steps` timed batches
+    return steps * batch_size * len(timer.times) / duration
+
+
+def tune(key: str, model: nn.Module, train_set: torch.utils.data.Dataset, collate_fn, device: torch.device,
+         num_workers: int, batch_sizes: list, training: dict, steps: int = 10, warmup: int = 3,
+         cache_path: str = AUTOTUNE_CACHE) -> dict:
+    """Finds the fastest number of data loader workers, intra-op threads, pinned memory and prefetch factor, and
+    batch size for training on this machine, with short timed trials of `train_model`. The settings are tuned one after the other
+    (threads, workers, pinned memory and prefetching, batch size), each with the best values found so far for the
+    others, which takes far fewer trials than all combinations. The result is cached per host and `key`, so later
+    runs with the same key use it without trials.
+
+    Args:
+        key (str): identifies what is trained (e.g. the dataset and featurizer settings).
+        model (nn.Module): a model to time the training steps with (its weights are changed).
+        train_set (torch.utils.data.Dataset): the training set.
+        collate_fn: the collate function of the data loader.
+        device (torch.device): the device to train on.
+        num_workers (int): the number of workers to start from.
+        batch_sizes (list): the batch sizes to try (the first one is used while tuning the other settings).
+        training (dict): the arguments of `train_model` of the run (see `time_configuration`).
+        steps (int): the number of timed training steps per pass of a trial.
+        warmup (int): the number of untimed training steps before them in every pass.
+        cache_path (str): the json file with the tuned configurations of every host.
+
+    Returns:
+        dict: the "num_workers", "num_threads", "pin_memory", "prefetch_factor" and "batch_size" to use, and the
+            throughput they reached ("samples_per_s").
+    """
+    cache = load_cache(cache_path)
+    key = "{}_batch{}".format(key, "-".join(str(batch_size) for batch_size in batch_sizes))
+    if key in cache.get(host_key(), {}):
+        print("Using the autotuned configuration of {} from {}".format(key, cache_path))
+        return cache[host_key()][key]
+
+    cores = os.cpu_count()
+    candidates = {
+        "num_threads": _powers_of_two(cores),
+        "num_workers": _powers_of_two(cores, start=0),
+        # Pinned memory only speeds up copies to a GPU
+        "pin_memory": [False, True] if device.type == "cuda" else [False],
+        "prefetch_factor": [2, 4, 8],
+        "batch_size": batch_sizes,
+    }
+    best = {"num_workers": num_workers, "num_threads": torch.get_num_threads(), "pin_memory": False,
+            "prefetch_factor": 2, "batch_size": batch_sizes[0]}
+    best_throughput = 0.0
+    model.train()
+    for setting, values in candidates.items():
+        # Without workers there is nothing to prefetch
+        if setting == "prefetch_factor" and best["num_workers"] == 0:
+            continue
+        for value in values:
+            configuration = dict(best, **{setting: value})
+            if configuration == best and best_throughput:
+                continue
+            throughput = time_configuration(model, train_set, collate_fn, device, steps=steps, warmup=warmup, training=training,
+                                            **configuration)
+            print("Autotune {}: {:.1f} samples/s".format(", ".join("{}={}".format(k, v) for k, v in configuration.items()), throughput))
+            if throughput > best_throughput:
+                best, best_throughput = configuration, throughput
+    best["samples_per_s"] = best_throughput
+
+    # Reread the cache, since other runs may have added to it in the meantime
+    cache = load_cache(cache_path)
+    cache.setdefault(host_key(), {})[key] = best
+    save_cache(cache_path, cache)
+    return best
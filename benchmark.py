@@ -0,0 +1,517 @@
+import os
+import sys
+import json
+import time
+import statistics
+import subprocess
+import platform
+import argparse
+import tempfile
+import torch
+from torch import nn
+
+from model import FairClassifier
+from data import get_train_validation_set, DatasetSubset, SyntheticTabularDataset, SyntheticImageDataset, SyntheticTextDataset
+from train_model import train_model, test_model, bert_collate, parse_resolution_schedule
+from evaluation import evalutaion_statistics
+from sample_cache import SharedSampleCache, ALIGNMENT
+from distributed import launch, wrap, barrier, get_world_size, is_main_process, NullWriter
+
+
+def saved_activation_bytes(fn) -> tuple:
+    """Runs `fn` and counts the bytes of the tensors autograd saves for the backward pass during it.
+
+    Returns:
+        tuple: the output of `fn` and the amount of saved bytes.
+    """
+    seen, total = set(), [0]
+
+    def pack(tensor):
+        key = (tensor.data_ptr(), tensor.nelement(), tensor.dtype)
+        if key not in seen:
+            seen.add(key)
+            total[0] += tensor.nelement() * tensor.element_size()
+        return tensor
+
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+        output = fn()
+    return output, total[0]
+
+
+def benchmark_checkpointing(dataset: str, batch_sizes: list, segments: list, steps: int, device: torch.device) -> list:
+    """Measures the activation memory and the throughput of a joint training step of the image featurizers with
+    and without activation checkpointing.
+
+    Args:
+        dataset (str): the dataset whose featurizer to benchmark (celeba or chexpert).
+        batch_sizes (list): the batch sizes to measure.
+        segments (list): the numbers of checkpoint segments to measure (0 is always measured as the baseline).
+        steps (int): the number of timed steps per setting.
+        device (torch.device): the device to run on.
+
+    Returns:
+        list: a dictionary with the measurements per setting.
+    """
+    model = FairClassifier(dataset, pretrained=False).to(device).train()
+    loss_module = nn.BCELoss()
+    results = []
+    for batch_size in batch_sizes:
+        x = torch.randn(batch_size, 3, 224, 224, device=device)
+        t = torch.randint(0, 2, (batch_size,), device=device).float()
+        d = torch.randint(0, 2, (batch_size,), device=device)
+        d_tilde = torch.randint(0, 2, (batch_size,), device=device)
+
+        for nr_segments in sorted(set([0] + segments)):
+            model.featurizer.checkpoint_segments = nr_segments
+
+            def step():
+                (pred_joint, pred_group_spe, pred_group_agn), saved = saved_activation_bytes(lambda: model(x, d, d_tilde))
+                loss = loss_module(pred_group_agn, t) - loss_module(pred_group_spe, t) + loss_module(pred_joint, t)
+                model.zero_grad()
+                loss.backward()
+                return saved
+
+            # Warm up once, such that allocations and lazy initializations are not timed
+            saved = step()
+            if device.type == "cuda":
+                torch.cuda.synchronize()
+                torch.cuda.reset_peak_memory_stats()
+            start = time.perf_counter()
+            for _ in range(steps):
+                step()
+            if device.type == "cuda":
+                torch.cuda.synchronize()
+            duration = time.perf_counter() - start
+
+            result = {"dataset": dataset, "batch_size": batch_size, "segments": nr_segments,
+                      "saved_activations_mb": saved / 2**20, "samples_per_s": steps * batch_size / duration}
+            if device.type == "cuda":
+                result["peak_memory_mb"] = torch.cuda.max_memory_allocated() / 2**20
+            print(", ".join("{}: {:.2f}".format(k, v) if isinstance(v, float) else "{}: {}".format(k, v) for k, v in result.items()))
+            results.append(result)
+    return results
+
+
+def _scaling_worker(dataset: str, dataset_root: str, batch_size: int, steps: int, lmbda: float, result_file: str):
+    """Trains one epoch of `steps` batches per process on a part of the training set, within the process group."""
+    world_size = get_world_size()
+    train_set, _ = get_train_validation_set(dataset, root=dataset_root)
+    train_set = DatasetSubset(train_set, range(min(len(train_set), steps * batch_size * world_size)))
+    sampler = torch.utils.data.DistributedSampler(train_set, shuffle=True, seed=0, drop_last=True)
+    train_loader = torch.utils.data.DataLoader(train_set, batch_size=batch_size, sampler=sampler, drop_last=True,
+                                               collate_fn=bert_collate if dataset == "civil" else None)
+    model = wrap(FairClassifier(dataset, nr_attr_values=train_set.nr_attr_values(), pretrained=False))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        barrier()
+        start = time.perf_counter()
+        train_model(model, train_loader, None, "adam", 1e-3, 1e-3, 1e-3, lmbda, 1, os.path.join(tmp, "model.pt"),
+                    torch.device("cpu"), True, NullWriter(), fused_backward=True)
+        barrier()
+        duration = time.perf_counter() - start
+
+    if is_main_process():
+        passes = 2 if lmbda else 1
+        samples = passes * len(train_loader) * batch_size * world_size
+        with open(result_file, 'w') as f:
+            json.dump({"processes": world_size, "threads_per_process": torch.get_num_threads(),
+                       "seconds": duration, "samples_per_s": samples / duration}, f)
+
+
+def benchmark_scaling(dataset: str, dataset_root: str, processes: list, batch_size: int, steps: int, lmbda: float) -> list:
+    """Measures the training throughput of data parallel training for an increasing number of processes.
+
+    Args:
+        dataset (str): the dataset to train on.
+        dataset_root (str): the root of the data folders.
+        processes (list): the numbers of processes to measure.
+        batch_size (int): the batch size per process.
+        steps (int): the number of batches per process per pass.
+        lmbda (float): the lambda to train with (0 skips the group specific pass).
+
+    Returns:
+        list: a dictionary with the measurements per number of processes.
+    """
+    results = []
+    for world_size in processes:
+        with tempfile.TemporaryDirectory() as tmp:
+            result_file = os.path.join(tmp, "result.json")
+            launch(_scaling_worker, world_size, {"dataset": dataset, "dataset_root": dataset_root, "batch_size": batch_size,
+                                                 "steps": steps, "lmbda": lmbda, "result_file": result_file})
+            with open(result_file) as f:
+                result = json.load(f)
+        result["speedup"] = result["samples_per_s"] / results[0]["samples_per_s"] if results else 1.0
+        result["efficiency"] = result["speedup"] * processes[0] / world_size
+        print(", ".join("{}: {:.2f}".format(k, v) if isinstance(v, float) else "{}: {}".format(k, v) for k, v in result.items()))
+        results.append(result)
+    return results
+
+
+# The synthetic dataset and the featurizer of every modality, and the dataset sizes the suite measures by default
+SUITE_MODALITIES = {
+    "tabular": (SyntheticTabularDataset, "adult"),
+    "image": (SyntheticImageDataset, "celeba"),
+    "text": (SyntheticTextDataset, "civil"),
+}
+SUITE_SIZES = {"tabular": [1024, 8192, 32768], "image": [64, 256], "text": [256, 1024]}
+SUITE_STAGES = ["loading", "training", "testing", "statistics"]
+
+
+def _timed(fn) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def benchmark_suite(modalities: list, sizes: list, stages: list, batch_size: int, num_workers: int, imbalance: float,
+                    lmbda: float, seed: int, device: torch.device) -> list:
+    """Measures the throughput (samples/s) of data loading, a training epoch, `test_model` and `evalutaion_statistics`
+    on synthetic data of every modality, for several dataset sizes. No real data is needed.
+
+    Args:
+        modalities (list): the modalities to measure (tabular, image and/or text).
+        sizes (list): the dataset sizes to measure, the defaults of the modality (`SUITE_SIZES`) if empty.
+        stages (list): the stages to measure (`SUITE_STAGES`).
+        batch_size (int): the batch size of the data loaders.
+        num_workers (int): the number of data loading workers.
+        imbalance (float): the fraction of the data in group 0.
+        lmbda (float): the lambda to train with (0 skips the group specific pass).
+        seed (int): the seed of the synthetic data and the model.
+        device (torch.device): the device to run on.
+
+    Returns:
+        list: a dictionary with the measurements per modality and size.
+    """
+    results = []
+    for modality in modalities:
+        dataset_cls, featurizer = SUITE_MODALITIES[modality]
+        collate_fn = bert_collate if modality == "text" else None
+        for size in sizes or SUITE_SIZES[modality]:
+            dataset = dataset_cls(size, imbalance, seed=seed)
+            loader = torch.utils.data.DataLoader(dataset, batch_size=batch_size, num_workers=num_workers)
+            result = {"modality": modality, "size": size, "batch_size": batch_size, "num_workers": num_workers}
+
+            if "loading" in stages:
+                duration = _timed(lambda: [None for _ in loader])
+                result["loading_samples_per_s"] = size / duration
+
+            if "training" in stages or "testing" in stages:
+                torch.manual_seed(seed)
+                # The throughput does not depend on the weights, so the pretrained weights are not needed
+                model = FairClassifier(featurizer, nr_attr_values=dataset.nr_attr_values(), pretrained=False).to(device)
+                if collate_fn:
+                    loader = torch.utils.data.DataLoader(dataset, batch_size=batch_size, num_workers=num_workers,
+                                                         collate_fn=collate_fn)
+
+            if "training" in stages:
+                train_loader = torch.utils.data.DataLoader(dataset, batch_size=batch_size, num_workers=num_workers,
+                                                           shuffle=True, drop_last=True, collate_fn=collate_fn)
+                with tempfile.TemporaryDirectory() as tmp:
+                    duration = _timed(lambda: train_model(model, train_loader, None, "adam", 1e-3, 1e-3, 1e-3, lmbda, 1,
+                                                          os.path.join(tmp, "model.pt"), device, True, NullWriter()))
+                passes = 2 if lmbda else 1
+                result["training_samples_per_s"] = passes * len(train_loader) * batch_size / duration
+
+            if "testing" in stages:
+                duration = _timed(lambda: test_model(model, loader, device, seed, True))
+                result["testing_samples_per_s"] = size / duration
+
+            if "statistics" in stages:
+                # Predictions that are right more often than not, such that the curves look like those of a trained model
+                generator = torch.Generator().manual_seed(seed)
+                targets = dataset.targets.unsqueeze(dim=-1)
+                predictions = (torch.rand(size, 1, generator=generator) * 0.8 + 0.6 * targets - 0.2).clamp(0.01, 0.99)
+                duration = _timed(lambda: evalutaion_statistics(predictions, targets, dataset.attributes.float()))
+                result["statistics_samples_per_s"] = size / duration
+
+            print(", ".join("{}: {:.2f}".format(k, v) if isinstance(v, float) else "{}: {}".format(k, v) for k, v in result.items()))
+            results.append(result)
+    return results
+
+
+def benchmark_single_channel(batch_size: int, size: int, num_workers: int, steps: int, device: torch.device) -> list:
+    """Compares the CheXpert pipeline with the grayscale images repeated as three channels to the single channel
+    pipeline, on synthetic grayscale images: the bytes per sample, the data loading throughput (through the worker
+    processes), and the throughput of a joint training step. The single channel model is converted from the three
+    channel model, and the largest difference between their features is reported as well.
+
+    Args:
+        batch_size (int): the batch size.
+        size (int): the number of images to load.
+        num_workers (int): the number of data loading workers.
+        steps (int): the number of timed training steps.
+        device (torch.device): the device to run on.
+
+    Returns:
+        list: a dictionary with the measurements of the three and the single channel pipeline.
+    """
+    torch.manual_seed(0)
+    models = {3: FairClassifier("chexpert", pretrained=False).to(device)}
+    models[1] = FairClassifier("chexpert", pretrained=False, single_channel=True).to(device)
+    models[1].load_state_dict(models[3].state_dict())
+
+    x = SyntheticImageDataset(batch_size, grayscale=True, single_channel=True)[0][0].unsqueeze(0).to(device)
+    with torch.no_grad():
+        features = {channels: model.eval().featurizer(x.repeat(1, channels, 1, 1)) for channels, model in models.items()}
+    difference = (features[3] - features[1]).abs().max().item()
+    print("Largest difference between the features of the three and the single channel model: {:.2e}".format(difference))
+
+    loss_module = nn.BCELoss()
+    results = []
+    for channels in [3, 1]:
+        dataset = SyntheticImageDataset(size, grayscale=True, single_channel=channels == 1)
+        loader = torch.utils.data.DataLoader(dataset, batch_size=batch_size, num_workers=num_workers)
+        result = {"channels": channels, "bytes_per_sample": dataset[0][0].nelement() * dataset[0][0].element_size(),
+                  "loading_samples_per_s": size / _timed(lambda: [None for _ in loader])}
+
+        model = models[channels].train()
+        x, t, d = next(iter(loader))
+        x, t, d = x[:batch_size].to(device), t[:batch_size].to(device), d[:batch_size].to(device)
+
+        def step():
+            pred_joint, pred_group_spe, pred_group_agn = model(x, d, d)
+            loss = loss_module(pred_group_agn, t) - loss_module(pred_group_spe, t) + loss_module(pred_joint, t)
+            model.zero_grad()
+            loss.backward()
+            if device.type == "cuda":
+                torch.cuda.synchronize()
+
+        # Warm up once, such that allocations and lazy initializations are not timed
+        step()
+        result["training_samples_per_s"] = steps * len(x) / _timed(lambda: [step() for _ in range(steps)])
+        result["max_feature_difference"] = difference
+        print(", ".join("{}: {:.2f}".format(k, v) if isinstance(v, float) else "{}: {}".format(k, v) for k, v in result.items()))
+        results.append(result)
+    return results
+
+
+def benchmark_progressive(schedule: str, epochs: int, size: int, batch_size: int, num_workers: int, lmbda: float, seed: int,
+                          device: torch.device, dataset: str = "celeba", backbone: str = "") -> list:
+    """Compares training with a progressive resizing schedule to training at the full resolution throughout, on
+    synthetic images: the wall-clock time of training, and the accuracy, AUC and ABC on a synthetic test set at the
+    full resolution.
+
+    Args:
+        schedule (str): the resolution schedule (see `train_model.parse_resolution_schedule`).
+        epochs (int): the number of epochs of both runs.
+        size (int): the number of training (and test) images.
+        batch_size (int): the batch size at the full resolution.
+        num_workers (int): the number of data loading workers.
+        lmbda (float): the lambda to train with.
+        seed (int): the seed of the synthetic data and the model.
+        device (torch.device): the device to run on.
+        dataset (str): the featurizer to train (celeba or chexpert).
+        backbone (str): a small backbone instead (see `featurizers.STUDENT_BACKBONES`), to keep the runs short on a CPU.
+
+    Returns:
+        list: a dictionary with the measurements of the fixed resolution and the progressive run.
+    """
+    test_set = SyntheticImageDataset(size, seed=seed + 1)
+    test_loader = torch.utils.data.DataLoader(test_set, batch_size=batch_size, num_workers=num_workers)
+    results = []
+    for name, stages in [("fixed", None), ("progressive", parse_resolution_schedule(schedule, epochs, batch_size))]:
+        torch.manual_seed(seed)
+        train_set = SyntheticImageDataset(size, seed=seed)
+        train_loader = torch.utils.data.DataLoader(train_set, batch_size=batch_size, shuffle=True, num_workers=num_workers, drop_last=True)
+        model = FairClassifier(dataset, nr_attr_values=train_set.nr_attr_values(), pretrained=False, backbone=backbone).to(device)
+        with tempfile.TemporaryDirectory() as tmp:
+            start = time.perf_counter()
+            model = train_model(model, train_loader, None, "adam", 1e-3, 1e-3, 1e-3, lmbda, epochs, os.path.join(tmp, "model.pt"),
+                                device, True, NullWriter(), resolution_schedule=stages)
+            duration = time.perf_counter() - start
+        acc, auc, abc, _, _ = test_model(model, test_loader, device, seed, True)
+        result = {"run": name, "schedule": schedule if stages else "", "train_seconds": duration, "acc": acc, "auc": auc, "abc": abc}
+        result["speedup"] = results[0]["train_seconds"] / duration if results else 1.0
+        print(", ".join("{}: {:.4f}".format(k, v) if isinstance(v, float) else "{}: {}".format(k, v) for k, v in result.items()))
+        results.append(result)
+    return results
+
+
+def benchmark_sample_cache(workers: list, fraction: float, size: int, image_size: int, batch_size: int, passes: int,
+                           seed: int) -> list:
+    """Measures the data loading throughput and the hit rate of the shared sample cache with 1 up to N data loader
+    workers, compared to loading without the cache, on synthetic images (generated from noise, which costs compute
+    like decoding and resizing does). The first pass fills the cache and is not measured, the other shuffled
+    passes are.
+
+    Args:
+        workers (list): the numbers of data loader workers to measure.
+        fraction (float): the fraction of the samples that fits in the cache.
+        size (int): the number of images.
+        image_size (int): the height and width of the images.
+        batch_size (int): the batch size of the data loader.
+        passes (int): the number of passes over the data, including the first one.
+        seed (int): the seed of the synthetic data and of the shuffling.
+
+    Returns:
+        list: a dictionary with the measurements per number of workers, with and without the cache.
+    """
+    results = []
+    for num_workers in workers:
+        for cached in [False, True]:
+            dataset = SyntheticImageDataset(size, seed=seed, image_size=image_size)
+            if cached:
+                sample = dataset[0]
+                sample_bytes = sum(tensor.nelement() * tensor.element_size() + ALIGNMENT for tensor in sample)
+                dataset = SharedSampleCache(dataset, int(fraction * size) * sample_bytes)
+            loader = torch.utils.data.DataLoader(dataset, batch_size=batch_size, shuffle=True, num_workers=num_workers,
+                                                 generator=torch.Generator().manual_seed(seed))
+            [None for _ in loader]
+            if cached:
+                dataset.statistics(reset=True)
+
+            duration = _timed(lambda: [None for _ in range(passes - 1) for _ in loader])
+            result = {"num_workers": num_workers, "cache": cached, "samples_per_s": (passes - 1) * size / duration}
+            if cached:
+                statistics = dataset.statistics()
+                result.update(hit_rate=statistics["hit_rate"], entries=statistics["entries"], evictions=statistics["evictions"])
+            print(", ".join("{}: {:.2f}".format(k, v) if isinstance(v, float) else "{}: {}".format(k, v) for k, v in result.items()))
+            results.append(result)
+    return results
+
+
+# The entry points of the Adult train and evaluation path, and the heavy dependencies they should not import
+STARTUP_COMMANDS = {
+    "import train_model": "import train_model",
+    "import evaluation": "import evaluation",
+    "adult model and data": "import train_model; train_model.FairClassifier('adult'); train_model.get_test_set",
+}
+HEAVY_MODULES = ["matplotlib", "sklearn", "torchvision", "tensorboard", "transformers", "PIL"]
+
+
+def benchmark_startup(repeats: int) -> list:
+    """Measures the startup time of the Adult train and evaluation entry points in fresh interpreters, and which
+    of the heavy dependencies they import.
+
+    Args:
+        repeats (int): the number of fresh interpreters to start per entry point.
+
+    Returns:
+        list: a dictionary with the measurements per entry point.
+    """
+    results = []
+    for name, command in STARTUP_COMMANDS.items():
+        script = command + "; import sys; print(','.join(m for m in {} if m in sys.modules))".format(HEAVY_MODULES)
+        durations = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            output = subprocess.run([sys.executable, "-c", script], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                    check=True, capture_output=True, text=True).stdout
+            durations.append(time.perf_counter() - start)
+        result = {"command": name, "median_s": statistics.median(durations), "min_s": min(durations),
+                  "heavy_modules": output.strip().splitlines()[-1] if output.strip() else ""}
+        print(", ".join("{}: {:.2f}".format(k, v) if isinstance(v, float) else "{}: {}".format(k, v) for k, v in result.items()))
+        results.append(result)
+    return results
+
+
+def save_results(results: list, output: str, benchmark: str):
+    """Writes the benchmark results together with some information on the host to a json file."""
+    report = {"benchmark": benchmark, "date": time.strftime("%Y-%m-%d %H:%M:%S"), "host": platform.node(),
+              "processor": platform.processor(), "cpu_count": os.cpu_count(), "torch": torch.__version__,
+              "threads": torch.get_num_threads(), "results": results}
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print("Results written to", output)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--output', default="", type=str,
+                        help='A json file to write the results to.')
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    # Activation checkpointing memory/throughput report
+    checkpointing = subparsers.add_parser("checkpointing", help="Memory and throughput of activation checkpointing.")
+    checkpointing.add_argument('--dataset', default="celeba", type=str, choices=["celeba", "chexpert"])
+    checkpointing.add_argument('--batch_sizes', default=[16, 32, 64], type=int, nargs="+")
+    checkpointing.add_argument('--segments', default=[2, 4, 8], type=int, nargs="+")
+    checkpointing.add_argument('--steps', default=3, type=int)
+
+    # Data parallel scaling
+    scaling = subparsers.add_parser("scaling", help="Training throughput for 1 up to N data parallel processes.")
+    scaling.add_argument('--dataset', default="adult", type=str)
+    scaling.add_argument('--dataset_root', default="data", type=str)
+    scaling.add_argument('--processes', default=[2**i for i in range((os.cpu_count() or 1).bit_length())], type=int, nargs="+")
+    scaling.add_argument('--batch_size', default=32, type=int)
+    scaling.add_argument('--steps', default=50, type=int)
+    scaling.add_argument('--lmbda', default=0.7, type=float)
+
+    # Throughput per stage on synthetic data
+    suite = subparsers.add_parser("suite", help="Throughput of data loading, training, testing and the evaluation \
+                                  statistics on synthetic data, for several dataset sizes.")
+    suite.add_argument('--modalities', default=["tabular", "image"], type=str, nargs="+", choices=list(SUITE_MODALITIES))
+    suite.add_argument('--sizes', default=[], type=int, nargs="+",
+                       help="The dataset sizes to measure (by default depends on the modality).")
+    suite.add_argument('--stages', default=SUITE_STAGES, type=str, nargs="+", choices=SUITE_STAGES)
+    suite.add_argument('--batch_size', default=32, type=int)
+    suite.add_argument('--num_workers', default=0, type=int)
+    suite.add_argument('--imbalance', default=0.7, type=float,
+                       help="The fraction of the synthetic data in group 0.")
+    suite.add_argument('--lmbda', default=0.7, type=float)
+    suite.add_argument('--seed', default=0, type=int)
+
+    # Single channel CheXpert images
+    channels = subparsers.add_parser("channels", help="Data loading and training throughput of single channel CheXpert \
+                                     images compared to images repeated as three channels (on synthetic images).")
+    channels.add_argument('--batch_size', default=16, type=int)
+    channels.add_argument('--size', default=256, type=int,
+                          help="The number of images to load.")
+    channels.add_argument('--num_workers', default=2, type=int)
+    channels.add_argument('--steps', default=3, type=int)
+
+    # Progressive resizing
+    progressive = subparsers.add_parser("progressive", help="Training time and test metrics of a progressive resizing schedule \
+                                        compared to the full resolution throughout (on synthetic images).")
+    progressive.add_argument('--schedule', default="128:2,176:2,224", type=str)
+    progressive.add_argument('--epochs', default=6, type=int)
+    progressive.add_argument('--size', default=256, type=int,
+                             help="The number of training (and test) images.")
+    progressive.add_argument('--batch_size', default=16, type=int)
+    progressive.add_argument('--num_workers', default=2, type=int)
+    progressive.add_argument('--lmbda', default=0.7, type=float)
+    progressive.add_argument('--seed', default=0, type=int)
+    progressive.add_argument('--dataset', default="celeba", type=str, choices=["celeba", "chexpert"])
+    progressive.add_argument('--backbone', default="", type=str,
+                             help="Train a small backbone (e.g. resnet18) instead of the backbone of the dataset.")
+
+    # Shared sample cache
+    cache = subparsers.add_parser("sample_cache", help="Data loading throughput and hit rate of the shared sample cache \
+                                  with 1 up to N workers, compared to no cache (on synthetic images).")
+    cache.add_argument('--workers', default=[1, 2, 4], type=int, nargs="+")
+    cache.add_argument('--fraction', default=0.5, type=float,
+                       help="The fraction of the images that fits in the cache.")
+    cache.add_argument('--size', default=512, type=int,
+                       help="The number of images.")
+    cache.add_argument('--image_size', default=224, type=int)
+    cache.add_argument('--batch_size', default=32, type=int)
+    cache.add_argument('--passes', default=4, type=int)
+    cache.add_argument('--seed', default=0, type=int)
+
+    # Startup time of the entry points
+    startup = subparsers.add_parser("startup", help="Startup time of the Adult train and evaluation entry points.")
+    startup.add_argument('--repeats', default=5, type=int)
+
+    args = parser.parse_args()
+    device = torch.device("cuda:0") if torch.cuda.is_available() else torch.device("cpu")
+
+    if args.benchmark == "checkpointing":
+        results = benchmark_checkpointing(args.dataset, args.batch_sizes, args.segments, args.steps, device)
+    elif args.benchmark == "scaling":
+        results = benchmark_scaling(args.dataset, args.dataset_root, args.processes, args.batch_size, args.steps, args.lmbda)
+    elif args.benchmark == "channels":
+        results = benchmark_single_channel(args.batch_size, args.size, args.num_workers, args.steps, device)
+    elif args.benchmark == "progressive":
+        results = benchmark_progressive(args.schedule, args.epochs, args.size, args.batch_size, args.num_workers, args.lmbda,
+                                        args.seed, device, args.dataset, args.backbone)
+    elif args.benchmark == "sample_cache":
+        results = benchmark_sample_cache(args.workers, args.fraction, args.size, args.image_size, args.batch_size, args.passes,
+                                         args.seed)
+    elif args.benchmark == "startup":
+        results = benchmark_startup(args.repeats)
+    elif args.benchmark == "suite":
+        results = benchmark_suite(args.modalities, args.sizes, args.stages, args.batch_size, args.num_workers, args.imbalance,
+                                  args.lmbda, args.seed, device)
+
+    if args.output:
+        save_results(results, args.output, args.benchmark)
@@ -0,0 +1,69 @@
+import os
+import json
+import random
+import hashlib
+import torch
+import numpy as np
+
+TRAINING_STATE_FILENAME = "training_state.pt"
+BEST_MODEL_FILENAME = "best.pt"
+WARM_START_FILENAME = "warm_start.pt"
+
+
+def training_state_path(checkpoint_name: str) -> str:
+    """The training state is stored next to the TensorBoard logs of the run."""
+    return os.path.join("runs", checkpoint_name[:-3], TRAINING_STATE_FILENAME)
+
+def best_model_path(checkpoint_name: str) -> str:
+    """The best model on the validation set so far is stored next to the TensorBoard logs of the run. It only 
+    becomes the final model (`runs/<checkpoint_name>`) when the training is finished."""
+    return os.path.join("runs", checkpoint_name[:-3], BEST_MODEL_FILENAME)
+
+def warm_start_name(config: dict) -> str:
+    """Returns the name of the base model of a warm started run, which is the same for all runs with the same
+    configuration (apart from lambda) that can be forked from it."""
+    digest = hashlib.sha1(json.dumps(config, sort_keys=True, default=str).encode()).hexdigest()[:10]
+    return "{}_{}ep_seed{}_{}".format(config["data"], config["warm_start_epochs"], config["seed"], digest)
+
+def warm_start_path(name: str) -> str:
+    """The snapshot of a base model (model and optimizer states) is stored in runs/warm_start/<name>."""
+    return os.path.join("runs", "warm_start", name, WARM_START_FILENAME)
+
+def checkpoint_fingerprint(path: str) -> str:
+    """Identifies the version of a checkpoint file by its size and modification time, such that anything that is
+    cached for a checkpoint is recomputed when it is retrained or overwritten."""
+    stat = os.stat(path)
+    return hashlib.sha1("{} {}".format(stat.st_size, stat.st_mtime_ns).encode()).hexdigest()[:10]
+
+def get_rng_state() -> dict:
+    """Returns the states of all random number generators, stored as tensors and plain python objects only
+    (such that the training state can also be loaded with `weights_only` loading)."""
+    np_state = np.random.get_state()
+    state = {
+        "torch": torch.get_rng_state(),
+        "numpy": (np_state[0], torch.from_numpy(np_state[1].astype(np.int64)), *np_state[2:]),
+        "random": random.getstate(),
+    }
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    return state
+
+def set_rng_state(state: dict):
+    """Restores the random number generator states returned by `get_rng_state`."""
+    torch.set_rng_state(state["torch"])
+    np_state = state["numpy"]
+    np.random.set_state((np_state[0], np_state[1].numpy().astype(np.uint32), *np_state[2:]))
+    random.setstate(state["random"])
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+def save_training_state(path: str, state: dict):
+    """Saves the training state atomically: it is first written to a temporary file, which then replaces the
+    previous state. A run that is killed while saving therefore always leaves a complete state behind."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    torch.save(state, tmp_path)
+    os.replace(tmp_path, path)
+
+def load_training_state(path: str) -> dict:
+    return torch.load(path, map_location="cpu")
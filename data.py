@@ -1,18 +1,67 @@
 import os
 import torch
+import numpy as np
 import pandas as pd
 import torch.utils.data as data
 
-from PIL import Image
-from torchvision import transforms
-
 # Editing these global variables has a very high chance of breaking the data
 ADULT_CONTINOUS = ['age', 'education-num', 'capital-gain', 'capital-loss', 'hours-per-week']
+# The size the CelebA and CheXpert images are resized to, as the backbones were pretrained on
+IMAGE_RESOLUTION = 224
+
+def count_attributes(attributes, nr_attr_values: int, targets=None) -> torch.Tensor:
+    """Counts the number of data points per attribute value, for the sampling of d_tilde.
+
+    Args:
+        attributes: the attribute value (0 up to `nr_attr_values`) of every data point.
+        nr_attr_values (int): the number of possible attribute values.
+        targets: the binary targets of the data points, to count the attribute values per target.
+
+    Returns:
+        torch.Tensor: the counts with shape (nr_attr_values,), or (2, nr_attr_values) if the targets are given.
+    """
+    attributes = torch.as_tensor(np.asarray(attributes).reshape(-1).astype(np.int64))
+    if targets is None:
+        return torch.bincount(attributes, minlength=nr_attr_values).float()
+    targets = torch.as_tensor(np.asarray(targets).reshape(-1).astype(np.int64))
+    return torch.bincount(targets * nr_attr_values + attributes, minlength=2 * nr_attr_values).float().view(2, nr_attr_values)
+
+def parse_attributes(attribute, default: str) -> list:
+    """Returns the attribute columns in `attribute`, a comma separated string (e.g. "sex,race") or a list of
+    columns, or the default column of the dataset if it is empty."""
+    if not attribute:
+        return [default]
+    columns = attribute.split(",") if isinstance(attribute, str) else attribute
+    return [column.strip() for column in columns]
+
+def attribute_columns(dataset: data.Dataset) -> list:
+    """Returns the attribute columns of a dataset, of which the combinations of values are its groups."""
+    attribute = dataset.attribute
+    return list(attribute['columns']) if isinstance(attribute, dict) else parse_attributes(attribute, "")
+
+def encode_attributes(values, nr_values: list) -> np.ndarray:
+    """Encodes the combination of the values of one or more attributes as a single group, such that every
+    intersectional group gets its own group specific model. The first attribute varies slowest, e.g. with sex (2
+    values) and race (5 values) group 7 is sex 1 and race 2.
+
+    Args:
+        values: the value (0 up to the number of values) of every attribute, with shape (n, nr_attributes).
+        nr_values (list): the number of values of every attribute.
+
+    Returns:
+        np.ndarray: the group of every data point, from 0 up to the product of `nr_values`.
+    """
+    values = np.asarray(values, dtype=np.int64).reshape(-1, len(nr_values))
+    return np.ravel_multi_index(tuple(values.T), nr_values)
+
+def encode_binary_attributes(table: pd.DataFrame, columns: list) -> np.ndarray:
+    """Encodes the combination of binary attribute columns (with 1 as the positive value) as a single group."""
+    return encode_attributes((table[columns] == 1).to_numpy(), [2] * len(columns))
 
 class AdultDataset(data.Dataset):
     # TODO add docstrings
     # TODO improve comments
-    def __init__(self, root='data', split="train", attribute='sex'):
+    def __init__(self, root='data', split="train", attribute='sex', compact=False):
         datapath = os.path.join(root, "adult")
 
         # Read data and skip first line of test data
@@ -22,8 +71,18 @@ class AdultDataset(data.Dataset):
         if split=='train':
             table = self.add_bias(table)
         
-        self.attribute = attribute
-        self._attributes = table[attribute]
+        # One or more attribute columns, of which the combinations are the groups. The values of the columns are
+        # taken from the training data, such that all splits encode the groups in the same way.
+        self.attribute_columns = parse_attributes(attribute, 'sex')
+        self.attribute = ",".join(self.attribute_columns)
+        train_values = pd.read_csv(os.path.join(datapath, "adult.data"), usecols=self.attribute_columns)
+        self._attr_values = [np.sort(train_values[column].unique()) for column in self.attribute_columns]
+        indices = []
+        for column, values in zip(self.attribute_columns, self._attr_values):
+            if not table[column].isin(values).all():
+                raise ValueError("The {} split has values of {} that are not in the training data".format(split, column))
+            indices.append(np.searchsorted(values, table[column]))
+        self._attributes = encode_attributes(np.stack(indices, axis=1), [len(values) for values in self._attr_values])
 
         self._labels = table["income-per-year"]
         del table["income-per-year"]
@@ -31,6 +90,7 @@ class AdultDataset(data.Dataset):
         table = self._normalize_con(table, ADULT_CONTINOUS)
         # table = self._normalize_min_max(table, ADULT_CONTINOUS)
         self._table = table
+        self._compact = self._compact_table(table) if compact else None
 
         # Find the ratio for the attribute to be able to sample from this distribution
         probs = self._attr_ratio()
@@ -41,21 +101,22 @@ class AdultDataset(data.Dataset):
         return table.drop(index=drop_rows)
 
     def _attr_ratio(self) -> torch.Tensor:
-        """Finds the ratio in which the attribute occurs in the data set, such that we can later
+        """Finds the ratio in which the groups occur in the data set, such that we can later
         sample from this distribution. 
 
-        Args:
-            table (pd.DataFrame): the table from which to obtain the attribute ratio.
-
         Returns:
-            torch.Tensor: a tensor with probabilities for the self.attribute['values'] in the same order.
+            torch.Tensor: a tensor with probabilities for the groups 0 up to `nr_attr_values`.
         """
-        counts = self._attributes.value_counts()
-        return torch.Tensor(counts / sum(counts))
+        counts = self.attribute_counts()
+        return counts / counts.sum()
 
     def sample_d(self, size: tuple) -> torch.Tensor:
         return self._attr_dist.sample(size).squeeze()
 
+    def attribute_counts(self, by_target: bool = False) -> torch.Tensor:
+        """Returns the number of data points per attribute value (per target value if `by_target` is set)."""
+        return count_attributes(self._attributes, self.nr_attr_values(), self._labels if by_target else None)
+
     def _onehot_cat(self, table: pd.DataFrame, categories: list) -> pd.DataFrame:
         """One hot encodes the columns of the table for which the names are in categories
 
@@ -87,6 +148,27 @@ class AdultDataset(data.Dataset):
             table[column] /= table[column].var()
         return table
 
+    def _compact_table(self, table: pd.DataFrame) -> np.ndarray:
+        """Converts the table to a compact representation, in which each row holds the column indices of its 
+        non-zero features followed by their values (padded with the indices of zero features). Since all but the
+        continuous features are one hot encoded, this is a lot smaller than the dense rows, and it is the input
+        of the `AdultEmbeddingBagFeaturizer`.
+
+        Args:
+            table (pd.DataFrame): the table containing the data.
+
+        Returns:
+            np.ndarray: an array with for each row the column indices and values, as floats.
+        """
+        dense = table.to_numpy(dtype=np.float32)
+        nonzero = dense != 0
+        width = max(int(nonzero.sum(axis=1).max()), 1)
+
+        # A stable sort moves the non-zero columns to the front of every row, in their original order
+        indices = np.argsort(~nonzero, axis=1, kind='stable')[:, :width]
+        values = np.take_along_axis(dense, indices, axis=1)
+        return np.concatenate([indices.astype(np.float32), values], axis=1)
+
     def _normalize_min_max(self, table: pd.DataFrame, categories: list) -> pd.DataFrame:
         """Normalizes the columns of a table to have zero mean and unit variance.
 
@@ -113,12 +195,12 @@ class AdultDataset(data.Dataset):
         return self[0][0].shape
 
     def nr_attr_values(self) -> int:
-        """Returns the number of possible values for the attribute of this dataset.
+        """Returns the number of groups, the number of combinations of the values of the attributes.
 
         Returns:
-            int: the number of attributes
+            int: the number of groups
         """
-        return len(self._attributes.unique())
+        return int(np.prod([len(values) for values in self._attr_values]))
 
     def __len__(self) -> int:
         """Returns the amount of datapoints in this data object."""
@@ -133,58 +215,66 @@ class AdultDataset(data.Dataset):
         Returns:
             tuple: The x value includes all one hot encoded and continous data except for the target 
         value, and the column that contains the non-one hot encoded attribute (since this is only used as a map for d). The t 
-        value is binary (whether this person earns more than 50K). The d value is a value that indicates the element number in
-        the self.attribute['values'] list. This determines the mapping for the group specific model later on.
+        value is binary (whether this person earns more than 50K). The d value is the group of the combination of the attribute
+        values (see `encode_attributes`). This determines the mapping for the group specific model later on.
         """
-        x = self._table.iloc[i]
+        x = torch.from_numpy(self._compact[i]) if self._compact is not None else torch.Tensor(self._table.iloc[i])
         t = self._labels.iloc[i]
-        d = self._attributes.iloc[i]
-        return torch.Tensor(x), torch.Tensor([t]).squeeze(), torch.Tensor([d])
+        d = self._attributes[i]
+        return x, torch.Tensor([t]).squeeze(), torch.Tensor([d])
 
 
 class CheXpertDataset(data.Dataset):
     # TODO add docstring
     # TODO improve comments
-    def __init__(self, root, split="train"):
+    def __init__(self, root, split="train", attribute="Support Devices", single_channel=False):
         self._datapath = os.path.join(root, "chexpert")
         assert os.path.exists(self._datapath), "CheXpert dataset not found! Did you run `get_data.sh`?"
-        self.attribute = {'column' : 'Support Devices', 'values' : [0, 1]}
+        self.attribute = {'columns' : parse_attributes(attribute, 'Support Devices'), 'values' : [0, 1]}
         self.target = {'column' : "Pleural Effusion", 'values' : [0 ,1]}
         
         # Read the csv file, and 
         self._filename = "train.csv" if split == "train" else "valid.csv"
         self._table = pd.read_csv(os.path.join(self._datapath, "CheXpert-v1.0-small", self._filename))
 
-        # Remove rows with -1's for the attribute value and target value (to make flags binary)
-        self._table = self._table[ self._table[self.attribute['column']].isin(self.attribute['values']) == True ]
+        # Remove rows with -1's for the attribute values and target value (to make flags binary)
+        self._table = self._table[ self._table[self.attribute['columns']].isin(self.attribute['values']).all(axis=1) ]
         self._table = self._table[ self._table[self.target['column']].isin(self.target['values']) == True ]
+        self._attributes = encode_binary_attributes(self._table, self.attribute['columns'])
+        self._single_channel = single_channel
         
         # Find the ratio for the attribute to be able to sample from this distribution
-        probs = self._attr_ratio(self._table)
+        probs = self._attr_ratio()
         self._attr_dist = torch.distributions.Categorical(probs=probs)
 
+        self.set_resolution(IMAGE_RESOLUTION)
+
+    def set_resolution(self, size: int):
+        """Sets the size the images are resized to (see `train_model.parse_resolution_schedule`)."""
+        from torchvision import transforms
         self._transform = transforms.Compose([
-                               transforms.Resize((224,224)),
+                               transforms.Resize((size, size)),
                                transforms.ToTensor(),
                                transforms.Normalize((0.5), (0.5))])
 
-    def _attr_ratio(self, table: pd.DataFrame) -> torch.Tensor:
-        """Finds the ratio in which the attribute occurs in the data set, such that we can later
+    def _attr_ratio(self) -> torch.Tensor:
+        """Finds the ratio in which the groups occur in the data set, such that we can later
         sample from this distribution. 
 
-        Args:
-            table (pd.DataFrame): the table from which to obtain the attribute ratio.
-
         Returns:
-            torch.Tensor: a tensor with probabilities for the self.attribute['values'] in the same order.
+            torch.Tensor: a tensor with probabilities for the groups 0 up to `nr_attr_values`.
         """
-        counts = table[self.attribute['column']].value_counts()
-        ratios = torch.Tensor([counts[attr_val] for attr_val in self.attribute['values']])
-        return ratios / sum(ratios)
+        counts = self.attribute_counts()
+        return counts / counts.sum()
 
     def sample_d(self, size: tuple) -> torch.Tensor:
         return self._attr_dist.sample(size)
 
+    def attribute_counts(self, by_target: bool = False) -> torch.Tensor:
+        """Returns the number of data points per attribute value (per target value if `by_target` is set)."""
+        targets = self._table[self.target['column']] == 1 if by_target else None
+        return count_attributes(self._attributes, self.nr_attr_values(), targets)
+
     def datapoint_shape(self) -> torch.Tensor:
         """Return the amount of elements in each x value
 
@@ -194,12 +284,12 @@ class CheXpertDataset(data.Dataset):
         return self[0][0].shape
 
     def nr_attr_values(self) -> int:
-        """Returns the number of possible values for the attribute of this dataset.
+        """Returns the number of groups, the number of combinations of the values of the attributes.
 
         Returns:
-            int: the number of attributes
+            int: the number of groups
         """
-        return len(self.attribute['values'])
+        return len(self.attribute['values']) ** len(self.attribute['columns'])
     
     def __len__(self):
         return len(self._table)
@@ -210,14 +300,18 @@ class CheXpertDataset(data.Dataset):
 
         # Get the image
         filename = df.iloc[i]['Path']
+        from PIL import Image
         img = Image.open(os.path.join(self._datapath, filename))
-        x = self._transform(img).repeat(3,1,1)
+        # The grayscale image is repeated as RGB channels, unless the featurizer takes a single channel
+        x = self._transform(img)
+        if not self._single_channel:
+            x = x.repeat(3,1,1)
         t = torch.Tensor([int(df.iloc[i]['Pleural Effusion'] == 1)])
-        d = torch.Tensor([int(df.iloc[i][self.attribute['column']] == 1)])
+        d = torch.Tensor([self._attributes[i]])
         return x, t.squeeze(), d.squeeze()
 
 class CelebADataset(data.Dataset):
-    def __init__(self, root, split="train"):
+    def __init__(self, root, split="train", attribute="Male"):
         self._datapath = os.path.join(root, "celeba")
         assert os.path.exists(self._datapath), "CelebA dataset not found! Did you run 'get_data.sh'?"
 
@@ -227,7 +321,7 @@ class CelebADataset(data.Dataset):
         self.anno_table = pd.read_csv(os.path.join(self._datapath, self.anno_filename), sep=r"\s+", header = 1)
 
         # Split the dataset into a train, validation and test dataset.
-        self.attribute = {'column' : 'Male', 'values' : [-1, 1]}
+        self.attribute = {'columns' : parse_attributes(attribute, 'Male'), 'values' : [-1, 1]}
 
         if split == "train":
             self.split_table = self.split_table[self.split_table.partition == 0]
@@ -238,32 +332,39 @@ class CelebADataset(data.Dataset):
 
         index_list = list(self.split_table.index.values)
         self.anno_table = self.anno_table.iloc[index_list]
+        self._attributes = encode_binary_attributes(self.anno_table, self.attribute['columns'])
 
-        probs = self._attr_ratio(self.anno_table)
+        probs = self._attr_ratio()
         self._attr_dist = torch.distributions.Categorical(probs=probs)
 
+        self.set_resolution(IMAGE_RESOLUTION)
+
+    def set_resolution(self, size: int):
+        """Sets the size the images are resized to (see `train_model.parse_resolution_schedule`)."""
+        from torchvision import transforms
         self.transform = transforms.Compose([
-                               transforms.Resize((224,224)),
+                               transforms.Resize((size, size)),
                                transforms.ToTensor(),
                                transforms.Normalize((0.5, 0.5, 0.5), (0.5, 0.5, 0.5))])
 
-    def _attr_ratio(self, table: pd.DataFrame) -> torch.Tensor:
-        """Finds the ratio in which the attribute occurs in the data set, such that we can later
+    def _attr_ratio(self) -> torch.Tensor:
+        """Finds the ratio in which the groups occur in the data set, such that we can later
         sample from this distribution. 
 
-        Args:
-            table (pd.DataFrame): the table from which to obtain the attribute ratio.
-
         Returns:
-            torch.Tensor: a tensor with probabilities for the self.attribute['values'] in the same order.
+            torch.Tensor: a tensor with probabilities for the groups 0 up to `nr_attr_values`.
         """
-        counts = table[self.attribute['column']].value_counts()
-        ratios = torch.Tensor([counts[attr_val] for attr_val in self.attribute['values']])
-        return ratios / sum(ratios) 
+        counts = self.attribute_counts()
+        return counts / counts.sum() 
 
     def sample_d(self, size: tuple) -> torch.Tensor:
         return self._attr_dist.sample(size)
 
+    def attribute_counts(self, by_target: bool = False) -> torch.Tensor:
+        """Returns the number of data points per attribute value (per target value if `by_target` is set)."""
+        targets = self.anno_table['Blond_Hair'] == 1 if by_target else None
+        return count_attributes(self._attributes, self.nr_attr_values(), targets)
+
     def datapoint_shape(self) -> torch.Tensor:
         """Return the amount of elements in each x value
 
@@ -273,12 +374,12 @@ class CelebADataset(data.Dataset):
         return self[0][0].shape
 
     def nr_attr_values(self) -> int:
-        """Returns the number of possible values for the attribute of this dataset.
+        """Returns the number of groups, the number of combinations of the values of the attributes.
 
         Returns:
-            int: the number of attributes
+            int: the number of groups
         """
-        return len(self.attribute['values'])
+        return len(self.attribute['values']) ** len(self.attribute['columns'])
 
     def __len__(self):
         return len(self.anno_table)
@@ -291,17 +392,17 @@ class CelebADataset(data.Dataset):
 
         # Get the image from the training or test data
         filename = df_split.iloc[i]["image"]
+        from PIL import Image
         img = Image.open(os.path.join(self._datapath, "img_align_celeba", filename)) 
 
-        # Resize the image to the dimension required by the Resnet50
-
+        # Resize the image to the current resolution (224 by default, as the Resnet50 was pretrained on)
         x = self.transform(img)
         t = torch.Tensor([int(df.iloc[i]['Blond_Hair'] == 1)])
-        d = torch.Tensor([int(df.iloc[i]['Male'] == 1)])
+        d = torch.Tensor([self._attributes[i]])
         return x, t.squeeze(), d.squeeze()
 
 class CivilDataset(data.Dataset):
-    def __init__(self, root, split="train"):
+    def __init__(self, root, split="train", attribute="christian"):
         self._datapath = os.path.join(root, "civil")
         assert os.path.exists(self._datapath), "Civil dataset not found! Did you run 'get_data.sh'?"
 
@@ -310,36 +411,39 @@ class CivilDataset(data.Dataset):
         self._partition_table = pd.read_csv(os.path.join(self._datapath, self._filename))
         self._alldata_table = pd.read_csv(os.path.join(self._datapath, self._alldata_filename))
 
-        self.attribute = {'column' : 'christian', 'values' : [0, 1]}
+        self.attribute = {'columns' : parse_attributes(attribute, 'christian'), 'values' : [0, 1]}
         index_list = list(self._partition_table.index.values)
         self._alldata_table = self._alldata_table.iloc[index_list]
-        # Remove all columns where the attribute Christian is not defined
-        self._alldata_table = self._alldata_table[self._alldata_table['christian'].notna()]
+        # Remove all columns where the attributes (e.g. christian) are not defined
+        self._alldata_table = self._alldata_table[self._alldata_table[self.attribute['columns']].notna().all(axis=1)]
         self._alldata_table.sort_values(by="comment_text", key=lambda x: x.str.len())
+        self._attributes = encode_binary_attributes(self._alldata_table, self.attribute['columns'])
 
 
-        probs = self._attr_ratio(self._alldata_table)
+        probs = self._attr_ratio()
         self._attr_dist = torch.distributions.Categorical(probs = probs)
 
+        from torchvision import transforms
         self._transform = transforms.ToTensor()
 
-    def _attr_ratio(self, table: pd.DataFrame) -> torch.Tensor:
-        """Finds the ratio in which the attribute occurs in the data set, such that we can later
+    def _attr_ratio(self) -> torch.Tensor:
+        """Finds the ratio in which the groups occur in the data set, such that we can later
         sample from this distribution. 
 
-        Args:
-            table (pd.DataFrame): the table from which to obtain the attribute ratio.
-
         Returns:
-            torch.Tensor: a tensor with probabilities for the self.attribute['values'] in the same order.
+            torch.Tensor: a tensor with probabilities for the groups 0 up to `nr_attr_values`.
         """
-        counts = table[self.attribute['column']].value_counts()
-        ratios = torch.Tensor([counts[attr_val] for attr_val in self.attribute['values']])
-        return ratios / sum(ratios)
+        counts = self.attribute_counts()
+        return counts / counts.sum()
 
     def sample_d(self, size: tuple) -> torch.Tensor:
         return self._attr_dist.sample(size)
 
+    def attribute_counts(self, by_target: bool = False) -> torch.Tensor:
+        """Returns the number of data points per attribute value (per target value if `by_target` is set)."""
+        targets = self._alldata_table['toxicity'] >= 0.5 if by_target else None
+        return count_attributes(self._attributes, self.nr_attr_values(), targets)
+
     def datapoint_shape(self) -> torch.Tensor:
         """Return the amount of elements in each x value
 
@@ -349,12 +453,12 @@ class CivilDataset(data.Dataset):
         return self[0][0].shape
     
     def nr_attr_values(self) -> int:
-        """Returns the number of possible values for the attribute of this dataset.
+        """Returns the number of groups, the number of combinations of the values of the attributes.
 
         Returns:
-            int: the number of attributes
+            int: the number of groups
         """
-        return len(self.attribute['values'])
+        return len(self.attribute['values']) ** len(self.attribute['columns'])
 
     def __len__(self):
         return len(self._alldata_table)
@@ -368,40 +472,244 @@ class CivilDataset(data.Dataset):
         # at 0.5. All values below 0.5 were classified as 0 (not toxic) and all values above 0.5 were classified as 1
         x = df.iloc[i]['comment_text']
         t = int(df.iloc[i]['toxicity'] >= 0.5)
-        d = int(df.iloc[i]['christian'] == 1)
+        d = int(self._attributes[i])
         # x = self.tokenizer.encode(x, padding='max_length', max_length=512, return_tensors='pt')
         return x, torch.Tensor([t]), torch.Tensor([d])
 
-def get_train_validation_set(dataset:str, root="data/", attribute=""):
+# One hot blocks of the synthetic tabular data, which together with the continuous columns give the 98 input
+# features of the Adult featurizer
+SYNTHETIC_ONEHOT_BLOCKS = [7, 16, 7, 14, 6, 5, 38]
+SYNTHETIC_VOCABULARY_SIZE = 1000
+
+class SyntheticDataset(data.Dataset):
+    """Base class of the synthetic datasets, which stand in for the real datasets when benchmarking. The targets
+    and attributes are drawn once, the data points are generated on the fly from a generator seeded with their
+    index, such that the data is the same in every epoch and in every worker process.
+
+    Args:
+        size (int): the number of data points.
+        imbalance (float): the fraction of the data points in group 0, the rest is divided evenly over the
+            other groups.
+        nr_attr_values (int): the number of groups.
+        seed (int): the seed from which the whole dataset is generated.
+    """
+    def __init__(self, size: int = 1024, imbalance: float = 0.5, nr_attr_values: int = 2, seed: int = 0):
+        if not 0 < imbalance < 1:
+            raise ValueError("The group imbalance should be between 0 and 1, got {}".format(imbalance))
+        if nr_attr_values < 2:
+            raise ValueError("A synthetic dataset needs at least two groups")
+        self._size = size
+        self._seed = seed
+        self._nr_attr_values = nr_attr_values
+
+        generator = torch.Generator().manual_seed(seed)
+        probs = torch.full((nr_attr_values,), (1 - imbalance) / (nr_attr_values - 1))
+        probs[0] = imbalance
+        self.attributes = torch.multinomial(probs, size, replacement=True, generator=generator)
+
+        # Every group has a different base rate of positive targets
+        positive_rates = torch.linspace(0.3, 0.6, nr_attr_values)
+        self.targets = (torch.rand(size, generator=generator) < positive_rates[self.attributes]).float()
+
+        counts = torch.bincount(self.attributes, minlength=nr_attr_values).float()
+        self._attr_dist = torch.distributions.Categorical(probs=counts / counts.sum())
+
+    def _generator(self, i: int) -> torch.Generator:
+        return torch.Generator().manual_seed(self._seed * self._size + i)
+
+    def sample_d(self, size: tuple) -> torch.Tensor:
+        return self._attr_dist.sample(size)
+
+    def attribute_counts(self, by_target: bool = False) -> torch.Tensor:
+        """Returns the number of data points per attribute value (per target value if `by_target` is set)."""
+        return count_attributes(self.attributes, self._nr_attr_values, self.targets if by_target else None)
+
+    def datapoint_shape(self) -> torch.Tensor:
+        """Return the amount of elements in each x value
+
+        Returns:
+            int: the amount of elements in x
+        """
+        return self[0][0].shape
+
+    def nr_attr_values(self) -> int:
+        """Returns the number of possible values for the attribute of this dataset.
+
+        Returns:
+            int: the number of attributes
+        """
+        return self._nr_attr_values
+
+    def __len__(self) -> int:
+        return self._size
+
+class SyntheticTabularDataset(SyntheticDataset):
+    """Synthetic stand-in for the Adult dataset: 5 normalized continuous features followed by one hot encoded
+    categorical features (98 features in total), with exactly one 1 per categorical feature like the real data. The
+    target shifts the continuous features, and makes category `t` of the first categorical feature more likely."""
+    def __getitem__(self, i: int) -> tuple:
+        generator = self._generator(i)
+        t, d = self.targets[i], self.attributes[i]
+
+        continuous = torch.randn(len(ADULT_CONTINOUS), generator=generator) + t - 0.5
+        onehots = []
+        for block, block_size in enumerate(SYNTHETIC_ONEHOT_BLOCKS):
+            probs = torch.ones(block_size)
+            if block == 0:
+                # Category t is drawn about half of the time
+                probs[int(t)] += block_size - 2
+            onehot = torch.zeros(block_size)
+            onehot[torch.multinomial(probs, 1, generator=generator)] = 1
+            onehots.append(onehot)
+        x = torch.cat([continuous] + onehots)
+        return x, t, d.float().unsqueeze(0)
+
+class SyntheticImageDataset(SyntheticDataset):
+    """Synthetic stand-in for CelebA and CheXpert: normalized noise images of which the brightness of the center 
+    depends on the target. With `grayscale` the images have one channel, which like the CheXpert images is 
+    repeated three times unless `single_channel` is set."""
+    def __init__(self, size: int = 1024, imbalance: float = 0.5, nr_attr_values: int = 2, seed: int = 0,
+                 image_size: int = 224, grayscale: bool = False, single_channel: bool = False):
+        super(SyntheticImageDataset, self).__init__(size, imbalance, nr_attr_values, seed)
+        self._image_size = image_size
+        self._grayscale = grayscale
+        self._single_channel = single_channel
+
+    def set_resolution(self, size: int):
+        self._image_size = size
+
+    def __getitem__(self, i: int) -> tuple:
+        generator = self._generator(i)
+        t, d = self.targets[i], self.attributes[i]
+
+        x = torch.randn(1 if self._grayscale else 3, self._image_size, self._image_size, generator=generator) * 0.5
+        center = slice(self._image_size // 4, 3 * self._image_size // 4)
+        x[:, center, center] += 0.5 * (t - 0.5)
+        if self._grayscale and not self._single_channel:
+            x = x.repeat(3, 1, 1)
+        return x, t, d.float()
+
+class SyntheticTextDataset(SyntheticDataset):
+    """Synthetic stand-in for the Civil Comments dataset: comments of a variable number of random words, of which
+    toxic comments contain more words from the first part of the vocabulary."""
+    def __init__(self, size: int = 1024, imbalance: float = 0.5, nr_attr_values: int = 2, seed: int = 0,
+                 min_length: int = 5, max_length: int = 200):
+        super(SyntheticTextDataset, self).__init__(size, imbalance, nr_attr_values, seed)
+        self._min_length = min_length
+        self._max_length = max_length
+
+    def __getitem__(self, i: int) -> tuple:
+        generator = self._generator(i)
+        t, d = self.targets[i], self.attributes[i]
+
+        length = int(torch.randint(self._min_length, self._max_length + 1, (1,), generator=generator))
+        vocabulary_size = SYNTHETIC_VOCABULARY_SIZE // 10 if t and i % 2 else SYNTHETIC_VOCABULARY_SIZE
+        words = torch.randint(vocabulary_size, (length,), generator=generator)
+        x = " ".join("word{}".format(word) for word in words.tolist())
+        return x, torch.Tensor([t]), torch.Tensor([d])
+
+class DatasetSubset(data.Subset):
+    """A subset of one of the datasets above, which still provides the dataset specific methods (e.g. `sample_d`)."""
+    def __getattr__(self, name: str):
+        # Guard against recursion while the object is unpickled in a worker, before `dataset` is set
+        if name == "dataset" or name.startswith("__"):
+            raise AttributeError(name)
+        return getattr(self.dataset, name)
+
+def split_validation_set(dataset: data.Dataset, fraction: float, seed: int = 0) -> tuple:
+    """Splits a random part off a training set to validate on, for the datasets without a validation split. The 
+    split only depends on `seed`, such that runs with different training seeds are validated on the same data.
+
+    Args:
+        dataset (data.Dataset): the training set to split.
+        fraction (float): the fraction of the data to use for validation.
+        seed (int): the seed of the random split.
+
+    Returns:
+        tuple: the remaining training set and the validation set.
+    """
+    nr_val = int(round(fraction * len(dataset)))
+    indices = torch.randperm(len(dataset), generator=torch.Generator().manual_seed(seed)).tolist()
+    return DatasetSubset(dataset, indices[nr_val:]), DatasetSubset(dataset, indices[:nr_val])
+
+class ResumableSampler(data.DistributedSampler):
+    """Sampler of which the order only depends on the seed and the epoch (also with a single process), and that 
+    can start partway through an epoch, such that a resumed run sees exactly the same data order."""
+    def __init__(self, dataset: data.Dataset, num_replicas: int = 1, rank: int = 0, shuffle: bool = True, seed: int = 0,
+                 drop_last: bool = False):
+        super(ResumableSampler, self).__init__(dataset, num_replicas=num_replicas, rank=rank, shuffle=shuffle, seed=seed,
+                                               drop_last=drop_last)
+        self.start_index = 0
+
+    def set_start(self, start_index: int):
+        """Skips the first `start_index` samples (of this process) in the next pass only."""
+        self.start_index = start_index
+
+    def __iter__(self):
+        indices = list(super(ResumableSampler, self).__iter__())
+        start, self.start_index = self.start_index, 0
+        return iter(indices[start:])
+
+    def __len__(self) -> int:
+        return self.num_samples - self.start_index
+
+def get_streaming_set(root: str, split: str, attribute: str = "", seed: int = 0):
+    """Returns the split of the sharded Adult data in `<root>/adult_stream/<split>`. The statistics of the training
+    split are computed in a streaming pass the first time, and are used to normalize all splits."""
+    # Imported here, since the streaming module imports this module itself
+    from streaming import StreamingTabularDataset, list_shards, load_statistics
+
+    datapath = os.path.join(root, "adult_stream")
+    columns = parse_attributes(attribute, "sex")
+    statistics = load_statistics(os.path.join(datapath, "statistics_{}.json".format("-".join(columns))),
+                                 list_shards(os.path.join(datapath, "train")), columns)
+    if split == "train":
+        return StreamingTabularDataset(os.path.join(datapath, split), statistics, shuffle_buffer=2**16, seed=seed)
+    return StreamingTabularDataset(os.path.join(datapath, split), statistics, split_processes=False)
+
+def get_train_validation_set(dataset:str, root="data/", attribute="", compact_tabular=False, seed=0, single_channel=False):
     # TODO add docstring
-    # TODO add attribute passthrough to dataset objects
+    # An empty attribute selects the default attribute of the dataset, multiple attributes are comma separated
+    if compact_tabular and dataset != "adult":
+        raise ValueError("The compact representation is only available for the adult dataset")
+    if single_channel and dataset != "chexpert":
+        raise ValueError("Single channel images are only available for the chexpert dataset")
     if dataset == "adult":
-        train = AdultDataset(root, split="train")
+        train = AdultDataset(root, split="train", attribute=attribute, compact=compact_tabular)
         val = None
     elif dataset == "chexpert":
-        train = CheXpertDataset(root, split="train")
+        train = CheXpertDataset(root, split="train", attribute=attribute, single_channel=single_channel)
         val = None
     elif dataset == "celeba":
-        train = CelebADataset(root, split="train")
-        val = CelebADataset(root, split = "valid")
+        train = CelebADataset(root, split="train", attribute=attribute)
+        val = CelebADataset(root, split = "valid", attribute=attribute)
     elif dataset == "civil":
-        train = CivilDataset(root, split="train")
+        train = CivilDataset(root, split="train", attribute=attribute)
+        val = None
+    elif dataset == "adult_stream":
+        train = get_streaming_set(root, "train", attribute, seed)
         val = None
     else:
         raise ValueError("This dataset is not implemented") 
     return train, val
 
-def get_test_set(dataset:str, root="data/"):
+def get_test_set(dataset:str, root="data/", compact_tabular=False, attribute="", single_channel=False):
     # TODO add docstring
     # TODO add civil comments, chexpert, celeba
+    if compact_tabular and dataset != "adult":
+        raise ValueError("The compact representation is only available for the adult dataset")
+    if single_channel and dataset != "chexpert":
+        raise ValueError("Single channel images are only available for the chexpert dataset")
     if dataset == "adult":
-        test = AdultDataset(root, split="test")
+        test = AdultDataset(root, split="test", attribute=attribute, compact=compact_tabular)
     elif dataset == "chexpert":
-        test = CheXpertDataset(root, split="test")
+        test = CheXpertDataset(root, split="test", attribute=attribute, single_channel=single_channel)
     elif dataset == "celeba":
-        test = CelebADataset(root, split="test")
+        test = CelebADataset(root, split="test", attribute=attribute)
     elif dataset == "civil":
-        test = CivilDataset(root, split="test")
+        test = CivilDataset(root, split="test", attribute=attribute)
+    elif dataset == "adult_stream":
+        test = get_streaming_set(root, "test", attribute)
     else:
         raise ValueError("This dataset is not implemented")
     return test
@@ -0,0 +1,245 @@
+import os
+import copy
+import json
+import time
+import argparse
+import statistics
+import torch
+import numpy as np
+import torch.nn.functional as F
+import torch.utils.data as data
+from tqdm import tqdm
+
+from data import get_train_validation_set, get_test_set
+from model import FairClassifier, checkpoint_nr_attr_values
+from checkpointing import checkpoint_fingerprint
+from feature_cache import attribute_key
+from weights import set_weights_dir
+from results import ResultsStore, DEFAULT_RESULTS_DB
+
+
+def model_logits(model: FairClassifier, x: torch.Tensor) -> torch.Tensor:
+    """Returns the logits of the joint classifier followed by those of the group specific models of all groups,
+    with shape (batch size, 1 + nr_attr_values)."""
+    features = model.featurizer(x).reshape(len(x), -1)
+    heads = model.group_specific_models
+    return torch.cat([model.joint_classifier(features), F.linear(features, heads.weight, heads.bias)], dim=-1)
+
+def cache_teacher_logits(teacher: FairClassifier, dataset: data.Dataset, path: str, batch_size: int, num_workers: int,
+                         device: torch.device, progress_bar: bool = True) -> np.ndarray:
+    """Runs the teacher once over the dataset and stores its logits (see `model_logits`) in `path`, such that the
+    (expensive) teacher is not needed while the student trains. Returns the stored logits if they already exist.
+
+    Args:
+        teacher (FairClassifier): the trained model to distill.
+        dataset (data.Dataset): the training set.
+        path (str): the `.npy` file to store the logits in.
+        batch_size (int): the batch size to run the teacher with.
+        num_workers (int): the amount of workers for the data loader.
+        device (torch.device): the device to run the teacher on.
+        progress_bar (bool): turns the progress bar off (in line with the `--progress_bar` flag).
+
+    Returns:
+        np.ndarray: the logits of every data point, memory-mapped from `path`.
+    """
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        loader = data.DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers)
+        teacher = teacher.to(device).eval()
+        with torch.no_grad():
+            logits = [model_logits(teacher, x.to(device)).cpu() for x, _, _ in tqdm(loader, desc="teacher", leave=False, disable=progress_bar)]
+        tmp_path = "{}.{}.tmp.npy".format(path[:-4], os.getpid())
+        np.save(tmp_path, torch.cat(logits).numpy())
+        os.replace(tmp_path, path)
+    return np.load(path, mmap_mode='r')
+
+
+class DistillationDataset(data.Dataset):
+    """Pairs the data points of a dataset with the cached logits of the teacher."""
+    def __init__(self, dataset: data.Dataset, logits: np.ndarray):
+        if len(dataset) != len(logits):
+            raise ValueError("The cached teacher logits do not match the dataset ({} vs {} data points)".format(len(logits), len(dataset)))
+        self.dataset = dataset
+        self._logits = logits
+
+    def __len__(self) -> int:
+        return len(self.dataset)
+
+    def __getitem__(self, i: int) -> tuple:
+        x, t, d = self.dataset[i]
+        return x, t, d, torch.from_numpy(np.array(self._logits[i]))
+
+
+def distillation_loss(student_logits: torch.Tensor, teacher_logits: torch.Tensor, targets: torch.Tensor,
+                      temperature: float = 2.0, alpha: float = 0.1) -> torch.Tensor:
+    """The loss of the student: the binary cross entropy with the (softened) predictions of the teacher for the joint
+    classifier and all group specific models, and a fraction `alpha` of the cross entropy of the joint classifier
+    with the targets. The soft term is scaled by the squared temperature, such that its gradients do not shrink
+    with the temperature."""
+    soft_targets = torch.sigmoid(teacher_logits / temperature)
+    soft = F.binary_cross_entropy_with_logits(student_logits / temperature, soft_targets) * temperature ** 2
+    hard = F.binary_cross_entropy_with_logits(student_logits[:, 0], targets.reshape(-1).float())
+    return (1 - alpha) * soft + alpha * hard
+
+def distill(student: FairClassifier, loader: data.DataLoader, epochs: int, lr: float, temperature: float, alpha: float,
+            device: torch.device, progress_bar: bool = True) -> FairClassifier:
+    """Trains the student on the cached teacher logits.
+
+    Args:
+        student (FairClassifier): the model with the small backbone.
+        loader (data.DataLoader): the loader of a `DistillationDataset`.
+        epochs (int): the number of passes over the data.
+        lr (float): the learning rate of the Adam optimizer.
+        temperature (float): the temperature of the soft targets.
+        alpha (float): the weight of the loss with the true targets.
+        device (torch.device): the device to train on.
+        progress_bar (bool): turns the progress bar off (in line with the `--progress_bar` flag).
+
+    Returns:
+        FairClassifier: the trained student.
+    """
+    student = student.to(device).train()
+    optimizer = torch.optim.Adam(student.parameters(), lr=lr)
+    for epoch in tqdm(range(epochs), position=0, desc="epoch", disable=progress_bar):
+        losses = []
+        for x, t, _, teacher_logits in tqdm(loader, position=1, desc="distill", leave=False, disable=progress_bar):
+            loss = distillation_loss(model_logits(student, x.to(device)), teacher_logits.to(device), t.to(device), temperature, alpha)
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            losses.append(loss.item())
+        print("Epoch {}: distillation loss {:.4f}".format(epoch, np.mean(losses)))
+    return student
+
+def cpu_latency(model: FairClassifier, x: torch.Tensor, repeats: int = 20) -> float:
+    """Returns the median time in milliseconds of a prediction for a batch `x` on the CPU."""
+    model = copy.deepcopy(model).cpu().eval()
+    durations = []
+    with torch.no_grad():
+        model(x)
+        for _ in range(repeats):
+            start = time.perf_counter()
+            model(x)
+            durations.append(time.perf_counter() - start)
+    return 1000 * statistics.median(durations)
+
+
+def main(dataset: str, teacher: str, backbone: str, epochs: int, batch_size: int, lr: float, temperature: float, alpha: float,
+         num_workers: int, dataset_root: str, logits_cache: str, output: str, seed: int, progress_bar: bool, pretrained: bool = True,
+         weights_dir: str = "", results_db: str = DEFAULT_RESULTS_DB, report: str = "", attribute: str = "",
+         single_channel: bool = False):
+    """
+    Distills a trained image model (e.g. models/celeba/0.7/42.pt) into a model with a small backbone, and compares
+    the test accuracy, AUC, ABC and CPU latency of both. The student is saved in the format of the teacher, such
+    that it can be evaluated with `evaluation.evaluate(dataset, lmbda, checkpoint=<output directory>, backbone=backbone)`.
+    The `attribute` and `single_channel` settings should be those the teacher was trained with.
+    """
+    # Imported here, since train_model imports all of its dependencies
+    from train_model import test_model
+
+    if weights_dir:
+        set_weights_dir(weights_dir)
+    device = torch.device("cuda:0") if torch.cuda.is_available() else torch.device("cpu")
+    torch.manual_seed(seed)
+
+    # The teacher is stored as models/<dataset>/<lambda>/<seed>.pt, and the student next to it by default
+    teacher_dir, teacher_file = os.path.split(os.path.normpath(teacher))
+    output = output or os.path.join("{}_{}".format(teacher_dir, backbone), teacher_file)
+    state_dict = torch.load(teacher, map_location=device)
+    nr_attr_values = checkpoint_nr_attr_values(state_dict)
+    teacher_model = FairClassifier(dataset, nr_attr_values=nr_attr_values, pretrained=False, single_channel=single_channel).to(device)
+    try:
+        teacher_model.load_state_dict(state_dict)
+    except RuntimeError as error:
+        # Models trained on cached backbone features do not contain the backbone to distill
+        raise ValueError("{} does not fit a {} model (single channel: {}). Models trained with --freeze_featurizer cannot be "
+                         "distilled, and --single_channel should match the teacher".format(teacher, dataset, single_channel)) from error
+
+    train_set, _ = get_train_validation_set(dataset, root=dataset_root, attribute=attribute, single_channel=single_channel)
+    if train_set.nr_attr_values() != nr_attr_values:
+        raise ValueError("The data has {} groups, the teacher {}, give the --attribute the teacher was trained with".format(
+            train_set.nr_attr_values(), nr_attr_values))
+    # The logits are of a version of the teacher, for the data points of the groups of the attributes
+    logits_name = "{}_{}_{}.npy".format(os.path.splitext(os.path.relpath(teacher))[0].replace(os.sep, "_"),
+                                        checkpoint_fingerprint(teacher), attribute_key(train_set))
+    logits_path = os.path.join(logits_cache, dataset, logits_name)
+    logits = cache_teacher_logits(teacher_model, train_set, logits_path, batch_size, num_workers, device, progress_bar)
+    loader = data.DataLoader(DistillationDataset(train_set, logits), batch_size=batch_size, shuffle=True, num_workers=num_workers,
+                             drop_last=True, generator=torch.Generator().manual_seed(seed))
+
+    student = FairClassifier(dataset, nr_attr_values=nr_attr_values, pretrained=pretrained, single_channel=single_channel,
+                             backbone=backbone)
+    student = distill(student, loader, epochs, lr, temperature, alpha, device, progress_bar)
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    torch.save(student.state_dict(), output)
+    print("Student saved to", output)
+
+    # Compare the student to the teacher on the test set
+    test_set = get_test_set(dataset, dataset_root, attribute=attribute, single_channel=single_channel)
+    test_loader = data.DataLoader(test_set, batch_size=batch_size, num_workers=num_workers)
+    x = test_set[0][0].unsqueeze(0)
+    results = {}
+    for name, model in [("teacher", teacher_model), ("student", student)]:
+        acc, auc, abc, curves, _ = test_model(model, test_loader, device, seed, progress_bar)
+        results[name] = {"acc": acc, "auc": auc, "abc": abc, "cpu_latency_ms": cpu_latency(model, x),
+                         "parameters": sum(p.numel() for p in model.parameters())}
+        results[name + "_curves"] = curves
+    results["retention"] = {"acc": results["student"]["acc"] / results["teacher"]["acc"],
+                            "auc": results["student"]["auc"] / results["teacher"]["auc"],
+                            # The ABC is a gap between groups, so an increase is the fairness the student lost
+                            "abc_increase": results["student"]["abc"] - results["teacher"]["abc"],
+                            "speedup": results["teacher"]["cpu_latency_ms"] / results["student"]["cpu_latency_ms"]}
+    for name in ["teacher", "student", "retention"]:
+        print(name + ":", ", ".join("{}: {:.4f}".format(k, v) for k, v in results[name].items()))
+
+    if results_db:
+        lmbda = os.path.basename(teacher_dir)
+        hparams = {"data": dataset, "attr": attribute, "lambda": float(lmbda) if lmbda.replace(".", "", 1).isdigit() else None,
+                   "seed": seed, "single_channel": single_channel, "backbone": backbone, "teacher": teacher, "epochs": epochs,
+                   "lr": lr, "temperature": temperature, "alpha": alpha}
+        with ResultsStore(results_db) as store:
+            store.append("distill", output, hparams, results["student"], curves=results["student_curves"])
+    if report:
+        with open(report, 'w') as f:
+            json.dump({key: value for key, value in results.items() if not key.endswith("_curves")}, f, indent=2)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Distills a trained image model into a model with a small backbone.")
+    parser.add_argument('--dataset', default='celeba', type=str, choices=['celeba', 'chexpert'])
+    parser.add_argument('--teacher', required=True, type=str,
+                        help="The checkpoint of the model to distill, e.g. models/celeba/0.7/42.pt.")
+    parser.add_argument('--backbone', default='resnet18', type=str, choices=['resnet18', 'mobilenet_v2', 'mobilenet_v3_small'],
+                        help="The backbone of the student.")
+    parser.add_argument('--attribute', default="", type=str,
+                        help="The sensitive attribute(s) the teacher was trained with.")
+    parser.add_argument('--single_channel', action="store_true",
+                        help="The teacher was trained with --single_channel (CheXpert).")
+    parser.add_argument('--output', default="", type=str,
+                        help="The checkpoint of the student. Defaults to the seed of the teacher in a directory next to the \
+                            one of the teacher, e.g. models/celeba/0.7_resnet18/42.pt.")
+    parser.add_argument('--epochs', default=5, type=int)
+    parser.add_argument('--batch_size', default=32, type=int)
+    parser.add_argument('--lr', default=1e-3, type=float)
+    parser.add_argument('--temperature', default=2.0, type=float,
+                        help="The temperature of the soft targets of the teacher.")
+    parser.add_argument('--alpha', default=0.1, type=float,
+                        help="The weight of the loss with the true targets (the rest is the loss with the teacher).")
+    parser.add_argument('--num_workers', default=3, type=int)
+    parser.add_argument('--seed', default=42, type=int)
+    parser.add_argument('--dataset_root', default="data", type=str)
+    parser.add_argument('--logits_cache', default="cache/teacher_logits", type=str,
+                        help="The directory to cache the logits of the teacher on the training set in.")
+    parser.add_argument('--no_pretrained', dest='pretrained', action="store_false",
+                        help="Start the student from random weights instead of the pretrained ImageNet weights.")
+    parser.add_argument('--weights_dir', default="", type=str,
+                        help="The directory with the pretrained backbone weights (see weights.py).")
+    parser.add_argument('--results_db', default=DEFAULT_RESULTS_DB, type=str,
+                        help="The SQLite file the results of the student are added to (empty to disable).")
+    parser.add_argument('--report', default="", type=str,
+                        help="A json file to write the comparison of the teacher and the student to.")
+    parser.add_argument('--progress_bar', action="store_true",
+                        help="Turn progress bar on.")
+    args = parser.parse_args()
+    main(**vars(args))
@@ -0,0 +1,97 @@
+import os
+import socket
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.nn.parallel import DistributedDataParallel
+
+
+def is_distributed() -> bool:
+    """Returns whether this process is part of an initialized process group."""
+    return dist.is_available() and dist.is_initialized()
+
+def get_rank() -> int:
+    return dist.get_rank() if is_distributed() else 0
+
+def get_world_size() -> int:
+    return dist.get_world_size() if is_distributed() else 1
+
+def is_main_process() -> bool:
+    """Only the main process saves checkpoints and writes logs."""
+    return get_rank() == 0
+
+def barrier():
+    if is_distributed():
+        dist.barrier()
+
+def broadcast_object(obj):
+    """Returns the object of the main process on all processes (e.g. the run name, which contains the time)."""
+    if not is_distributed():
+        return obj
+    objects = [obj]
+    dist.broadcast_object_list(objects, src=0)
+    return objects[0]
+
+def gather_object(obj) -> list:
+    """Returns the objects of all processes (in the order of their rank)."""
+    if not is_distributed():
+        return [obj]
+    objects = [None] * get_world_size()
+    dist.all_gather_object(objects, obj)
+    return objects
+
+def all_reduce_max(tensor: torch.Tensor) -> torch.Tensor:
+    """Returns the elementwise maximum of a tensor over all processes (in place)."""
+    if is_distributed():
+        dist.all_reduce(tensor, op=dist.ReduceOp.MAX)
+    return tensor
+
+def unwrap(model: torch.nn.Module) -> torch.nn.Module:
+    """Returns the FairClassifier inside a DistributedDataParallel wrapper (or the model itself)."""
+    return model.module if isinstance(model, DistributedDataParallel) else model
+
+def wrap(model: torch.nn.Module) -> torch.nn.Module:
+    """Wraps the model for data parallel training. Unused parameters have to be searched for, since the joint
+    classifier does not contribute to L_D in the group specific phase, and batches can miss some of the groups."""
+    return DistributedDataParallel(model, find_unused_parameters=True)
+
+def init_from_env() -> bool:
+    """Joins the process group when this process was started by `torchrun`. Returns whether it did."""
+    if int(os.environ.get("WORLD_SIZE", 1)) > 1 and not is_distributed():
+        dist.init_process_group("gloo")
+        _set_threads(dist.get_world_size())
+        return True
+    return False
+
+def _set_threads(world_size: int):
+    # Divide the cores over the processes, instead of every process using all of them
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // world_size))
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _worker(rank: int, fn, world_size: int, port: int, kwargs: dict):
+    dist.init_process_group("gloo", init_method="tcp://127.0.0.1:{}".format(port), rank=rank, world_size=world_size)
+    _set_threads(world_size)
+    try:
+        fn(**kwargs)
+    finally:
+        dist.destroy_process_group()
+
+def launch(fn, world_size: int, kwargs: dict):
+    """Starts `world_size` processes on this machine that each call `fn(**kwargs)` within a gloo process group.
+
+    Args:
+        fn: the function to run in every process (has to be picklable, i.e. defined at module level).
+        world_size (int): the number of processes.
+        kwargs (dict): the keyword arguments for `fn`.
+    """
+    mp.spawn(_worker, args=(fn, world_size, _free_port(), kwargs), nprocs=world_size, join=True)
+
+
+class NullWriter:
+    """Stands in for the SummaryWriter on the processes that do not log."""
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
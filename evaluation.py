@@ -1,21 +1,16 @@
-import matplotlib
 import torch
 import numpy as np
-import matplotlib.pyplot as plt
-from sklearn.metrics import auc
 
 import os 
-from train_model import test_model, set_seed, get_test_set
-from model import FairClassifier
+from model import FairClassifier, checkpoint_nr_attr_values
+from results import ResultsStore, DEFAULT_RESULTS_DB
 
-def confidence_score(x: torch.Tensor) -> torch.Tensor:
-    return 0.5 * np.log(x / (1 - x))
+# The data loader settings of `evaluate` (the defaults of train_model.py)
+BATCH_SIZE = 32
+NUM_WORKERS = 3
 
-def split(x: torch.Tensor, d: torch.Tensor):
-    # Groups x samples based on d-values
-    sorter = torch.argsort(d, dim=0)
-    _, counts = torch.unique(d, return_counts=True)
-    return torch.split(x[sorter, :], counts.tolist()), torch.split(d[sorter], counts.tolist())
+def confidence_score(x: torch.Tensor) -> torch.Tensor:
+    return 0.5 * torch.log(x / (1 - x))
 
 def margin(prediction: torch.Tensor, target: torch.Tensor) -> torch.Tensor:
     """
@@ -27,35 +22,96 @@ def margin(prediction: torch.Tensor, target: torch.Tensor) -> torch.Tensor:
     Returns:
         margin: The margin values for the corresponding samples.
     """
-    pred = prediction.clone()
-    correct = (torch.round(pred) == target).type(torch.int) * 2 - 1
-    pred[pred<0.5] = 1 - pred[pred<0.5]
-    margin = correct * confidence_score(pred)
+    correct = torch.round(prediction) == target
+    # The confidence in the predicted class, positive if that class is correct
+    confidence = confidence_score(torch.where(prediction < 0.5, 1 - prediction, prediction))
     # Cap large values to 20
-    margin[margin > 20] = 20
-    margin[margin < - 20] = -20
-    return margin
-
-def margin_group(predictictions: torch.Tensor, targets: torch.Tensor, attributes: torch.Tensor) -> dict:
-    """This function splits the predictions and targets on group assignment and calculates the corresponding
-        group specific margin. """
-    pred_split, d_split = split(predictictions, attributes)
-    tar_split, _ = split(targets, attributes)
-    margins = {int(d[0]):margin(p, t) for p, t, d in zip(pred_split, tar_split, d_split)}
-    return margins
-
-def precision_group(predictictions: torch.Tensor, targets: torch.Tensor, attributes: torch.Tensor) -> dict:
-    """Calculate the group specific precisions."""
-    pred_split, d_split = split(predictictions, attributes)
-    tar_split, _ = split(targets, attributes)
-    margin_precision = {}
-    for group_pred, group_tar, group_attr in zip(pred_split, tar_split, d_split):
-        pred_round = torch.round(group_pred)
-        zero_index = (pred_round == 0).nonzero()[:,0]
-        group_pred_y_hat_1 = group_pred[~zero_index,:]
-        group_tar_y_hat_1 = group_tar[~zero_index,:]
-        margin_precision[group_attr[0].item()] = margin(group_pred_y_hat_1, group_tar_y_hat_1)
-    return margin_precision
+    return torch.where(correct, confidence, -confidence).clamp(-20, 20)
+
+def group_margins(predictions: torch.Tensor, targets: torch.Tensor, attributes: torch.Tensor) -> tuple:
+    """
+    Computes the margins of all samples in one pass, together with the group of every sample and which samples are
+    predicted positive (Y_hat = 1, the samples of the precision-coverage curves). The groups and the precision
+    subset are selected with masks on these flat arrays (e.g. `margins[positive]`), instead of splitting the samples
+    per group.
+    Args:
+        predictions: The predictions of the samples.
+        targets: The corresponding targets for the predictions.
+        attributes: The corresponding attributes (groups) for the predictions.
+    Returns:
+        margins: The margin values of the samples.
+        groups: The group of every sample.
+        positive: Whether every sample is predicted positive.
+    """
+    predictions = predictions.reshape(-1)
+    margins = margin(predictions, targets.reshape(-1)).numpy().astype(np.float64)
+    positive = (torch.round(predictions) == 1).numpy()
+    return margins, attributes.reshape(-1).numpy().astype(np.int64), positive
+
+def margins_per_group(margins: np.ndarray, groups: np.ndarray) -> dict:
+    """Splits the margins returned by `group_margins` into a dictionary with the margins of every group (e.g. to plot them)."""
+    order = np.argsort(groups, kind='stable')
+    present, starts = np.unique(groups[order], return_index=True)
+    return {group: torch.from_numpy(values) for group, values in zip(present.tolist(), np.split(margins[order], starts[1:]))}
+
+def cdf(margins: np.ndarray, taus: np.ndarray) -> np.ndarray:
+    """Vectorized CDF of the margins: the fraction of margins <= tau for all values of tau at once."""
+    return np.searchsorted(np.sort(margins), taus, side='right') / len(margins)
+
+def accuracy_coverage_curve(margins: np.ndarray, taus: np.ndarray) -> tuple:
+    """
+    Computes the accuracy and the coverage of selective classification for all thresholds tau at once.
+    Args:
+        margins: The margin values of the samples.
+        taus: The thresholds on the margin.
+    Returns:
+        accuracies: The accuracies for the values of tau (1 where nothing is covered).
+        coverages: The corresponding coverages.
+    """
+    correct = 1 - cdf(margins, taus)
+    covered = cdf(margins, -taus) + 1 - cdf(margins, taus)
+    accuracies = np.divide(correct, covered, out=np.ones_like(correct), where=covered > 0)
+    return accuracies, covered
+
+# Larger than the range of the (capped) margins, such that the margins of all groups can be searched as one array
+GROUP_OFFSET = 64
+
+def group_accuracy_coverage_curves(margins: np.ndarray, groups: np.ndarray, taus: np.ndarray) -> tuple:
+    """
+    Computes the accuracy-coverage curves of all groups at once. The margins of every group are offset by a 
+    multiple of `GROUP_OFFSET` and sorted together, such that the CDFs of all groups at all thresholds are a single
+    search, and the cost hardly grows with the number of groups.
+    Args:
+        margins: The margin values of the samples (see `group_margins`).
+        groups: The group of every sample.
+        taus: The thresholds on the margin.
+    Returns:
+        accuracies: The accuracies for the values of tau per group (groups without samples are left out).
+        coverages: The corresponding coverages per group.
+    """
+    if len(margins) == 0:
+        return {}, {}
+    present, codes = np.unique(groups, return_inverse=True)
+    codes = codes.reshape(-1)
+    sizes = np.bincount(codes)[:, None]
+    starts = np.cumsum(sizes) - sizes[:, 0]
+    offsets = np.arange(len(present))[:, None] * GROUP_OFFSET
+    keys = np.sort(margins + offsets[codes, 0])
+
+    # The fraction of the margins of every group (rows) that are <= each threshold (columns)
+    group_cdf = lambda thresholds: (np.searchsorted(keys, offsets + thresholds[None, :], side='right') - starts[:, None]) / sizes
+    correct = 1 - group_cdf(taus)
+    covered = group_cdf(-taus) + correct
+    accuracies = np.divide(correct, covered, out=np.ones_like(correct), where=covered > 0)
+    return dict(zip(present.tolist(), accuracies)), dict(zip(present.tolist(), covered))
+
+def accuracy_coverage_auc(predictions: torch.Tensor, targets: torch.Tensor) -> float:
+    """Fast path for the area under the accuracy-coverage curve, without the group specific statistics."""
+    from sklearn.metrics import auc
+    M = margin(predictions, targets).numpy().flatten()
+    taus = np.arange(0, np.abs(M).max(), step=0.001)
+    accuracies, coverages = accuracy_coverage_curve(M, taus)
+    return auc(coverages, accuracies)
 
 def evalutaion_statistics(predictions: torch.Tensor, targets: torch.Tensor, attributes: torch.Tensor):
     """
@@ -73,86 +129,101 @@ def evalutaion_statistics(predictions: torch.Tensor, targets: torch.Tensor, attr
         P_A_group: The precision values for different values of tau per group.
         P_C_group: The corresponding coverages for different values of tau per group.
         """
-    M = margin(predictions, targets) 
-    max_tau = torch.max(torch.abs(M)).item()
-    taus = np.arange(0, max_tau, step=0.001)
+    from sklearn.metrics import auc
 
-    # Compute overal margin and AUC statistics
-    CDF = lambda margin, tau: (len(margin[margin <= tau]) / len(margin))
-    CDF_correct = lambda margin, tau: 1 - CDF(margin, tau)
-    CDF_covered = lambda margin, tau: CDF(margin, -tau) + 1 - CDF(margin, tau)
+    margins, groups, positive = group_margins(predictions, targets, attributes)
+    taus = np.arange(0, np.abs(margins).max(), step=0.001)
 
-    A = [CDF_correct(M, tau) / CDF_covered(M, tau) if CDF_covered(M, tau) > 0 else 1 for tau in taus]
-    C = [CDF_covered(M, tau) for tau in taus]
+    # Compute overal margin and AUC statistics
+    A, C = accuracy_coverage_curve(margins, taus)
     area_under_curve = auc(C, A)
 
     # Compute group specific margins and accuracies
-    M_group = margin_group(predictions, targets, attributes)
-    A_group = {group_key: [CDF_correct(group_margin, tau) / CDF_covered(group_margin, tau) if CDF_covered(group_margin, tau) > 0 else 1 for tau in taus] for group_key, group_margin in M_group.items()}
-    C_group = {group_key: [CDF_covered(group_margin, tau) for tau in taus] for group_key, group_margin in M_group.items()}
+    M_group = margins_per_group(margins, groups)
+    A_group, C_group = group_accuracy_coverage_curves(margins, groups, taus)
 
     # Compute the group specific precisions for Y_hat = 1
-    P_M_group = precision_group(predictions, targets, attributes)
-    P_A_group = {group_key: [CDF_correct(group_margin, tau) / CDF_covered(group_margin, tau) if CDF_covered(group_margin, tau) > 0 else 1 for tau in taus] for group_key, group_margin in P_M_group.items()}
-    P_C_group = {group_key: [CDF_covered(group_margin, tau) for tau in taus] for group_key, group_margin in P_M_group.items()}
+    P_A_group, P_C_group = group_accuracy_coverage_curves(margins[positive], groups[positive], taus)
 
     area_between_curves = abc(P_A_group, P_C_group)
     
     return area_under_curve, area_between_curves, M_group, A_group, C_group, P_A_group, P_C_group
 
-def plot_margin_group(margins: dict) -> matplotlib.figure.Figure:
+def downsample_curve(x: list, y: list, points: int = 200) -> tuple:
+    """Keeps `points` evenly spaced points of a curve (and always its end points), which is enough to plot it."""
+    indices = np.unique(np.linspace(0, len(x) - 1, num=min(points, len(x))).round().astype(int))
+    return np.asarray(x)[indices], np.asarray(y)[indices]
+
+def margin_histograms(margins: dict, bins: int = 50) -> dict:
+    """
+    Bins the margins of every group into the same bins.
+    Args:
+        margins: A dictionary containing the margins for all groups.
+        bins: The number of bins.
+    Returns:
+        A dictionary with the densities and the bin edges per group.
+    """
+    values = {g: m.numpy().flatten() for g, m in margins.items()}
+    low = min(v.min() for v in values.values())
+    high = max(v.max() for v in values.values())
+    edges = np.linspace(low, high, bins + 1) if high > low else np.linspace(low - 0.5, high + 0.5, bins + 1)
+    return {g: (np.histogram(v, bins=edges, density=True)[0], edges) for g, v in values.items()}
+
+def plot_margin_group(margins: dict, bins: int = 50) -> "matplotlib.figure.Figure":
     """
     Plots the margin distributions for two groups.
     Args:
         margins: A dictionary containing the margins for all groups with label `g` and margins `m`.
+        bins: The number of bins of the histograms.
     Returns: 
         A matplotlib histogram figure with the margin for each group.
     """
+    import matplotlib.pyplot as plt
     fig, ax = plt.subplots(1, 1, tight_layout=True)
-    for g, m in margins.items():
-        ax.hist(m.numpy().flatten(), bins='auto', density=True, alpha=0.5, label='Group ' + str(g))
+    for g, (density, edges) in margin_histograms(margins, bins).items():
+        # The margins are binned already, so every bin is drawn from a single (weighted) value
+        ax.hist(edges[:-1], bins=edges, weights=density, alpha=0.5, label='Group ' + str(g))
     ax.set_xlabel('k (x)')
     ax.legend(loc="upper left")
     return fig
 
 def abc(precisions: dict, coverages:dict) -> float:
     """
-    Calculates the area between two curves.
+    Calculates the area between the curves of two groups, averaged over all pairs of groups.
     Args:
-        precisions: The precision values for the two curves.
+        precisions: The precision values for the curves of the groups.
+        coverages: The corresponding coverages.
     Returns:
-        area: The area between the two curves.
+        area: The mean area between the curves of two groups (0 with less than two groups).
     """
-    for group in coverages:
-        coverages[group] = [round(i,3) for i in coverages[group]]
-    
-    final_coverages, final_precisions0, final_precisions1 = [], [], []
-    for value in coverages[0]:
-        if value in coverages[1] and value not in final_coverages:
-            final_coverages.append(value)
-            index_0 = coverages[0].index(value)
-            index_1 = coverages[1].index(value)
-            final_precisions0.append(precisions[0][index_0])
-            final_precisions1.append(precisions[1][index_1])
-   
-    area = 0
-    for x, y in zip(final_precisions0, final_precisions1):
-        area += abs(x - y)
-    return area/len(final_precisions0)
-
-
-def accuracy_coverage_plot(accuracies: dict, coverages: dict, ylabel: str) -> matplotlib.figure.Figure:
+    # The curves are compared at the coverages (rounded to 3 decimals) that both reach, using the first value of
+    # each curve at such a coverage
+    grid = np.full((len(precisions), 1001), np.nan)
+    for row, group in zip(grid, precisions):
+        steps, first = np.unique(np.round(np.asarray(coverages[group]) * 1000).astype(int), return_index=True)
+        row[steps] = np.asarray(precisions[group])[first]
+
+    first_group, second_group = np.triu_indices(len(grid), k=1)
+    gaps = np.abs(grid[first_group] - grid[second_group])
+    shared = ~np.isnan(gaps)
+    nr_shared = shared.sum(axis=1)
+    areas = np.where(shared, gaps, 0).sum(axis=1)[nr_shared > 0] / nr_shared[nr_shared > 0]
+    return float(areas.mean()) if len(areas) else 0.0
+
+
+def accuracy_coverage_plot(accuracies: dict, coverages: dict, ylabel: str, points: int = 200) -> "matplotlib.figure.Figure":
     """
     Plots the accuracy vs. the coverage.
     Args:
         accuracies: Dict of accuracies split on group/attribute and depending on different values of tau.
         coverages: The corresponding coverages for the accuracies.
+        points: The number of points to plot per curve.
     """
+    import matplotlib.pyplot as plt
     fig = plt.figure()
     for group in accuracies.keys():
-        coverages[group].reverse()
-        accuracies[group].reverse()
-        plt.plot(coverages[group], accuracies[group], label="Group " + str(int(group)))
+        group_coverages, group_accuracies = downsample_curve(coverages[group][::-1], accuracies[group][::-1], points)
+        plt.plot(group_coverages, group_accuracies, label="Group " + str(int(group)))
     plt.xlabel('coverage')
     plt.ylabel(ylabel)
     plt.ylim([0.4, 1.01])
@@ -161,14 +232,46 @@ def accuracy_coverage_plot(accuracies: dict, coverages: dict, ylabel: str) -> ma
     plt.title("Group-specific "+ ylabel+"-coverage curves.")
     return fig
 
-def evaluate(dataset, lmbda, checkpoint="", verbose=False):
+def summarize_curves(A_group: dict, C_group: dict, P_A_group: dict, P_C_group: dict, points: int = 20) -> dict:
+    """
+    Summarizes the group specific curves returned by `evalutaion_statistics` to store them with the results.
+    Returns:
+        A dictionary with per group the coverages and accuracies (and precisions) of `points` points of the curves.
+    """
+    summary = {}
+    for name, values, coverages in [("accuracy", A_group, C_group), ("precision", P_A_group, P_C_group)]:
+        summary[name] = {}
+        for group in values:
+            group_coverages, group_values = downsample_curve(coverages[group][::-1], values[group][::-1], points)
+            summary[name][str(int(group))] = {"coverage": group_coverages.tolist(), name: group_values.tolist()}
+    return summary
+
+def plot_statistics(M_group: dict, A_group: dict, C_group: dict, P_A_group: dict, P_C_group: dict) -> dict:
+    """
+    Plots the group specific statistics returned by `evalutaion_statistics`.
+    Returns:
+        A dictionary with the margin histograms, and the precision-coverage and accuracy-coverage curves.
+    """
+    return {"margin": plot_margin_group(M_group),
+            "precision": accuracy_coverage_plot(P_A_group, P_C_group, 'precision'),
+            "accuracy": accuracy_coverage_plot(A_group, C_group, 'accuracy')}
+
+def evaluate(dataset, lmbda, checkpoint="", verbose=False, results_db=DEFAULT_RESULTS_DB, attribute="", backbone=""):
     """
     Runs tests for a dataset and given lambda for all present seeds
 
     :params:
     lmbda: specify lambda value used during training (directory has to be present)
+    attribute: the (comma separated) attributes the models were trained with, empty for the default attribute
+    backbone: the small backbone of distilled models (see distill.py), empty for the default backbone
     verbose: specify if results, including images, should be outputted per seed
+    results_db: the results store to add the results of every seed to (empty to not store them)
     """
+    # Imported here, since train_model imports this module itself
+    import time
+    import matplotlib.pyplot as plt
+    from train_model import test_model, get_test_set
+
     device = torch.device("cuda:0") if torch.cuda.is_available() else torch.device("cpu")
     acc_scores, auc_scores, abc_scores = [], [], []
     if checkpoint != "":
@@ -178,14 +281,25 @@ def evaluate(dataset, lmbda, checkpoint="", verbose=False):
 
     for model_name in os.listdir(path):
         seed = int(os.path.splitext(model_name)[0])
-        model = FairClassifier(dataset).to(device)
-        model.load_state_dict(torch.load(os.path.join(path, model_name), map_location=device), strict=False)
+        # The trained weights are loaded right after, so the pretrained weights are not needed
+        state_dict = torch.load(os.path.join(path, model_name), map_location=device)
+        model = FairClassifier(dataset, nr_attr_values=checkpoint_nr_attr_values(state_dict), pretrained=False,
+                               backbone=backbone).to(device)
+        model.load_state_dict(state_dict, strict=False)
 
-        test_set = get_test_set(dataset)
+        test_set = get_test_set(dataset, attribute=attribute)
         test_loader = torch.utils.data.DataLoader(test_set, batch_size=BATCH_SIZE, num_workers=NUM_WORKERS)
 
-        test_acc_score, area_under_curve, area_between_curves_val, \
-        margin_plot, precision_plot, ac_plot = test_model(model, test_loader, device, seed, progress_bar=True)
+        # The figures are only made to show them
+        start = time.perf_counter()
+        test_acc_score, area_under_curve, area_between_curves_val, curves, _ = test_model(model, test_loader, device, seed,
+                                                                                          progress_bar=True, plots=verbose)
+        if results_db:
+            with ResultsStore(results_db) as store:
+                hparams = {"data": dataset, "attr": attribute, "lambda": lmbda, "seed": seed, "backbone": backbone}
+                store.append("evaluate", os.path.join(path, model_name), hparams,
+                             {"acc": test_acc_score, "auc": area_under_curve, "abc": area_between_curves_val},
+                             {"test_seconds": time.perf_counter() - start}, curves)
 
         acc_scores.append(test_acc_score)
         auc_scores.append(area_under_curve)
@@ -207,4 +321,3 @@ def evaluate(dataset, lmbda, checkpoint="", verbose=False):
     print("Mean Test Accuracy:", acc_scores.mean(), "std:", acc_scores.std())
     print("Mean Area Under Curve:", auc_scores.mean(), "std:", auc_scores.std())
     print("Mean Area Between Curve:", abc_scores.mean(), "std:", abc_scores.std())
-
@@ -0,0 +1,178 @@
+import os
+import json
+import hashlib
+import torch
+import numpy as np
+import torch.utils.data as data
+
+from data import count_attributes, attribute_columns
+from featurizers import get_featurizer, BACKBONE_FEATURE_SIZE, BACKBONE_NAME
+from checkpointing import checkpoint_fingerprint
+from weights import local_weights
+
+FEATURES_FILENAME = "features.npy"
+TARGETS_FILENAME = "targets.npy"
+ATTRIBUTES_FILENAME = "attributes.npy"
+META_FILENAME = "meta.json"
+
+
+class CachedFeatureDataset(data.Dataset):
+    def __init__(self, path: str, attributes: list = None):
+        """Dataset over backbone features that were cached to disk by `cache_features`. The arrays are
+        memory-mapped, so only the rows that are used are read from disk.
+
+        Args:
+            path (str): the directory containing the cached arrays.
+            attributes (list): the attribute columns the groups of the cache should be of (not checked if None).
+        """
+        with open(os.path.join(path, META_FILENAME)) as f:
+            self._meta = json.load(f)
+        # The cached groups only fit the attribute columns they were computed for
+        if attributes is not None and self._meta.get("attributes") != list(attributes):
+            raise ValueError("The features cached in {} are of the groups of attributes {}, not of {}".format(
+                path, self._meta.get("attributes"), list(attributes)))
+
+        self._features = np.load(os.path.join(path, FEATURES_FILENAME), mmap_mode='r')
+        self._targets = np.load(os.path.join(path, TARGETS_FILENAME), mmap_mode='r')
+        self._attributes = np.load(os.path.join(path, ATTRIBUTES_FILENAME), mmap_mode='r')
+
+        # Find the ratio for the attribute to be able to sample from this distribution
+        probs = self._attr_ratio()
+        self._attr_dist = torch.distributions.Categorical(probs=probs)
+
+    def _attr_ratio(self) -> torch.Tensor:
+        """Finds the ratio in which the attribute occurs in the cached data, such that we can later
+        sample from this distribution.
+
+        Returns:
+            torch.Tensor: a tensor with probabilities for the attribute values 0 up to `nr_attr_values`.
+        """
+        counts = np.bincount(self._attributes.reshape(-1).astype(np.int64), minlength=self.nr_attr_values())
+        return torch.Tensor(counts / counts.sum())
+
+    def sample_d(self, size: tuple) -> torch.Tensor:
+        return self._attr_dist.sample(size)
+
+    def attribute_counts(self, by_target: bool = False) -> torch.Tensor:
+        """Returns the number of data points per attribute value (per target value if `by_target` is set)."""
+        return count_attributes(self._attributes, self.nr_attr_values(), self._targets if by_target else None)
+
+    def datapoint_shape(self) -> torch.Tensor:
+        """Return the amount of elements in each x value
+
+        Returns:
+            int: the amount of elements in x
+        """
+        return self[0][0].shape
+
+    def nr_attr_values(self) -> int:
+        """Returns the number of possible values for the attribute of the cached dataset.
+
+        Returns:
+            int: the number of attributes
+        """
+        return self._meta["nr_attr_values"]
+
+    def __len__(self) -> int:
+        return len(self._features)
+
+    def __getitem__(self, i: int) -> tuple:
+        # Copy the rows out of the memory map, such that the tensors own their memory
+        x = torch.from_numpy(np.array(self._features[i]))
+        t = torch.from_numpy(np.array(self._targets[i]))
+        d = torch.from_numpy(np.array(self._attributes[i]))
+        return x, t, d
+
+
+def cache_features(featurizer: torch.nn.Module, dataset: data.Dataset, path: str, batch_size: int, num_workers: int,
+                   device: torch.device, collate_fn=None, progress_bar: bool = True):
+    """Runs the featurizer once over the whole dataset and stores the flattened outputs, together with the
+    targets and attributes, as `.npy` files in `path`. The meta file is written last, so an interrupted
+    run never leaves a cache that looks complete.
+
+    Args:
+        featurizer (torch.nn.Module): the (pretrained) backbone to extract the features with.
+        dataset (data.Dataset): the dataset to extract the features for.
+        path (str): the directory to write the cache to.
+        batch_size (int): the batch size to use for the extraction.
+        num_workers (int): the amount of workers for the data loader.
+        device (torch.device): the device to run the featurizer on.
+        collate_fn: an optional collate function for the data loader.
+        progress_bar (bool): turns the progress bar off (in line with the `--progress_bar` flag).
+    """
+    from tqdm import tqdm
+
+    os.makedirs(path, exist_ok=True)
+    loader = data.DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers, collate_fn=collate_fn)
+    featurizer = featurizer.to(device).eval()
+
+    features, targets, attributes = None, None, None
+    tmp_paths = {name: os.path.join(path, "." + name + ".tmp") for name in [FEATURES_FILENAME, TARGETS_FILENAME, ATTRIBUTES_FILENAME]}
+    start = 0
+    with torch.no_grad():
+        for x, t, d in tqdm(loader, desc="caching", leave=False, disable=progress_bar):
+            f = featurizer(x.to(device)).flatten(start_dim=1).cpu().numpy()
+
+            # The shapes are only known after the first batch
+            if features is None:
+                open_memmap = np.lib.format.open_memmap
+                features = open_memmap(tmp_paths[FEATURES_FILENAME], mode='w+', dtype=np.float32, shape=(len(dataset), f.shape[1]))
+                targets = open_memmap(tmp_paths[TARGETS_FILENAME], mode='w+', dtype=np.float32, shape=(len(dataset), *t.shape[1:]))
+                attributes = open_memmap(tmp_paths[ATTRIBUTES_FILENAME], mode='w+', dtype=np.float32, shape=(len(dataset), *d.shape[1:]))
+
+            end = start + len(f)
+            features[start:end] = f
+            targets[start:end] = t.numpy()
+            attributes[start:end] = d.numpy()
+            start = end
+
+    for name, array in [(FEATURES_FILENAME, features), (TARGETS_FILENAME, targets), (ATTRIBUTES_FILENAME, attributes)]:
+        array.flush()
+        os.replace(tmp_paths[name], os.path.join(path, name))
+
+    meta = {"nr_attr_values": dataset.nr_attr_values(), "attributes": attribute_columns(dataset), "len": len(dataset)}
+    tmp_meta = os.path.join(path, "." + META_FILENAME + ".tmp")
+    with open(tmp_meta, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_meta, os.path.join(path, META_FILENAME))
+
+
+def attribute_key(dataset: data.Dataset) -> str:
+    """Identifies the attribute columns of a dataset in the path of a cache, since the cached groups depend on them."""
+    return hashlib.sha1(",".join(attribute_columns(dataset)).encode()).hexdigest()[:10]
+
+
+def backbone_key(dataset_name: str) -> str:
+    """Identifies the pretrained weights of the backbone of a dataset in the path of a cache: the version of the weights
+    file in the weights directory (see weights.py), or "download" for the torchvision weights that are used without it."""
+    path = local_weights(BACKBONE_NAME[dataset_name])
+    return checkpoint_fingerprint(path) if path else "download"
+
+
+def get_cached_set(dataset_name: str, split: str, dataset: data.Dataset, cache_root: str, batch_size: int, num_workers: int,
+                   device: torch.device, collate_fn=None, progress_bar: bool = True, single_channel: bool = False) -> CachedFeatureDataset:
+    """Returns the cached backbone features of a dataset split, and computes them first if they are not on disk yet.
+    The backbone is only built when the cache has to be computed.
+
+    Args:
+        dataset_name (str): the name of the dataset, which determines the backbone.
+        split (str): the name of the split (used in the path of the cache, together with the attribute columns and
+            the version of the backbone weights).
+        dataset (data.Dataset): the dataset object of the split.
+        cache_root (str): the root directory of the feature caches.
+        single_channel (bool): the dataset has single channel images (the features are the same, so the cache is
+            shared with the three channel images).
+
+    Returns:
+        CachedFeatureDataset: the dataset with the cached features.
+    """
+    if dataset_name not in BACKBONE_FEATURE_SIZE:
+        raise ValueError("Features can only be cached for datasets with a pretrained backbone: {}".format(list(BACKBONE_FEATURE_SIZE)))
+
+    # Features of other backbone weights (e.g. of another weights directory) are never taken from the cache
+    path = os.path.join(cache_root, dataset_name, "{}_{}_{}".format(split, attribute_key(dataset), backbone_key(dataset_name)))
+    if not os.path.exists(os.path.join(path, META_FILENAME)):
+        print("Caching {} features for the {} split to {}".format(dataset_name, split, path))
+        _, backbone = get_featurizer(dataset_name, single_channel=single_channel)
+        cache_features(backbone, dataset, path, batch_size, num_workers, device, collate_fn, progress_bar)
+    return CachedFeatureDataset(path, attribute_columns(dataset))
@@ -1,29 +1,71 @@
+import inspect
 import torch
 import torch.nn as nn
-import torchvision.models as models
+from torch.utils.checkpoint import checkpoint_sequential
+
+from weights import torchvision_backbone, bert_classifier
 
 ADULT_DATASET_FEATURE_SIZE = 98
 NODE_SIZE = 80
 
+# Output sizes of the pretrained backbones whose features can be cached to disk
+BACKBONE_FEATURE_SIZE = {'celeba': 2048, 'chexpert': 1024}
+# The torchvision models of those backbones, whose pretrained weights are resolved by weights.py
+BACKBONE_NAME = {'celeba': 'resnet50', 'chexpert': 'densenet121'}
+
+# Small torchvision backbones to distill the image featurizers into (see distill.py), with the size of their features
+STUDENT_BACKBONES = {'resnet18': 512, 'mobilenet_v2': 1280, 'mobilenet_v3_small': 576}
+
+# The first convolution of the DenseNet121 backbone of `CheXPertFeaturizer` in the state dict
+CHEXPERT_CONV0_WEIGHT = 'model.0.0.conv0.weight'
 
-def get_featurizer(dataset_name: str):
+# Newer PyTorch versions recommend the non-reentrant checkpoint implementation (and warn if it is not chosen)
+CHECKPOINT_KWARGS = {'use_reentrant': False} if 'use_reentrant' in inspect.signature(checkpoint_sequential).parameters else {}
+
+
+def get_featurizer(dataset_name: str, frozen: bool = False, adapter: bool = False, checkpoint_segments: int = 0,
+                   compact: bool = False, pretrained: bool = True, single_channel: bool = False, backbone: str = ""):
     """
-    Returns the model architecture for the provided dataset_name. 
+    Returns the model architecture for the provided dataset_name. If `frozen` is set, the backbone is 
+    left out and a (optionally trainable) adapter on top of the cached backbone features is returned instead.
+    For the image featurizers `checkpoint_segments` > 0 enables activation checkpointing with that many segments.
+    With `compact` the Adult featurizer takes the compact (sparse) representation of the tabular data.
+    Without `pretrained` the backbones are not initialized with pretrained weights (see `weights.py`), for
+    models into which a trained checkpoint is loaded anyway. With `single_channel` the CheXpert featurizer
+    takes the grayscale images as a single channel instead of repeated three times. `backbone` replaces the
+    backbone of the image featurizers by one of the small `STUDENT_BACKBONES`.
     """
-    if dataset_name == 'adult':
-        model = AdultFeaturizer()
+    if compact and dataset_name != 'adult':
+        raise ValueError(f'No compact representation for \"{dataset_name}\"')
+    if single_channel and dataset_name != 'chexpert':
+        raise ValueError(f'No single channel input for \"{dataset_name}\"')
+    if backbone and (dataset_name not in ('celeba', 'chexpert') or backbone not in STUDENT_BACKBONES):
+        raise ValueError(f'No \"{backbone}\" backbone for \"{dataset_name}\", choose from {list(STUDENT_BACKBONES)} for celeba or chexpert')
+
+    if frozen:
+        if dataset_name not in BACKBONE_FEATURE_SIZE:
+            raise ValueError(f'No pretrained backbone to freeze for \"{dataset_name}\"')
+        model = CachedFeaturizer(BACKBONE_FEATURE_SIZE[dataset_name], adapter)
+        return model.out_features, model
+
+    if backbone:
+        model = StudentFeaturizer(backbone, checkpoint_segments, pretrained, single_channel)
+        out_features = STUDENT_BACKBONES[backbone]
+
+    elif dataset_name in ('adult', 'adult_stream'):
+        model = AdultEmbeddingBagFeaturizer() if compact else AdultFeaturizer()
         out_features = NODE_SIZE
 
     elif dataset_name == 'celeba':
-        model = CelebAFeaturizer()
+        model = CelebAFeaturizer(checkpoint_segments, pretrained)
         out_features = 2048
 
     elif dataset_name == 'civil':
-        model = CivilFeaturizer()
+        model = CivilFeaturizer(pretrained)
         out_features = 80
 
     elif dataset_name == 'chexpert':
-        model = CheXPertFeaturizer()
+        model = CheXPertFeaturizer(checkpoint_segments, pretrained, single_channel)
         out_features = 1024
     else:
         assert False, f'Unknown network architecture \"{dataset_name}\"'
@@ -36,6 +78,37 @@ def rename_attribute(obj, old_name, new_name):
 def drop_classification_layer(model):
     return torch.nn.Sequential(*(list(model.children())[:-1]))
 
+def single_channel_conv(conv: nn.Conv2d) -> nn.Conv2d:
+    """Converts a convolution on RGB images to one on grayscale images. Summing the filters over the input channels
+    gives the same output for a single channel as the original convolution for that channel repeated three times."""
+    single = nn.Conv2d(1, conv.out_channels, conv.kernel_size, conv.stride, conv.padding, conv.dilation, conv.groups,
+                       conv.bias is not None)
+    with torch.no_grad():
+        single.weight.copy_(conv.weight.sum(dim=1, keepdim=True))
+        if conv.bias is not None:
+            single.bias.copy_(conv.bias)
+    return single
+
+def flatten_sequential(model: nn.Sequential) -> list:
+    """Returns the modules of (nested) sequential containers as one flat list, which allows for a finer 
+    partitioning into checkpoint segments without changing the names in the state dict."""
+    layers = []
+    for module in model.children():
+        layers += flatten_sequential(module) if isinstance(module, nn.Sequential) else [module]
+    return layers
+
+def checkpointed_forward(model: nn.Sequential, segments: int, x: torch.Tensor) -> torch.Tensor:
+    """Runs a sequential model, and if `segments` > 0 while training only stores the activations at the segment
+    boundaries. The activations within a segment are recomputed during the backward pass, trading compute for memory.
+    Note that batch norm layers update their running statistics again when they are recomputed."""
+    if segments and model.training and torch.is_grad_enabled():
+        layers = flatten_sequential(model)
+        if not CHECKPOINT_KWARGS:
+            # The reentrant implementation only computes parameter gradients of a segment if its input requires grad
+            x = x.detach().requires_grad_()
+        return checkpoint_sequential(layers, min(segments, len(layers)), x, **CHECKPOINT_KWARGS)
+    return model(x)
+
 
 class AdultFeaturizer(nn.Module):
     def __init__(self):
@@ -50,20 +123,47 @@ class AdultFeaturizer(nn.Module):
         return output
 
 
+class AdultEmbeddingBagFeaturizer(nn.Module):
+    """Featurizer for the compact representation of the Adult data (see `AdultDataset`), in which a data point is
+    given by the column indices of its non-zero features followed by their values. The sum of the embeddings of 
+    these columns weighted by their values equals the linear layer of `AdultFeaturizer` on the dense features, 
+    without multiplying all the zeros of the one hot encodings. Checkpoints of `AdultFeaturizer` can be loaded."""
+    def __init__(self, in_features: int = ADULT_DATASET_FEATURE_SIZE):
+        super(AdultEmbeddingBagFeaturizer, self).__init__()
+        # Initialized from a dense linear layer, which draws the same random numbers as `AdultFeaturizer` (and
+        # nothing else), such that with the same seed both featurizers start from the same weights and train the same
+        dense = nn.Linear(in_features, NODE_SIZE)
+        self.bag = nn.EmbeddingBag.from_pretrained(dense.weight.detach().t().contiguous(), freeze=False, mode='sum')
+        self.bias = nn.Parameter(dense.bias.detach().clone())
+        self.activation = nn.SELU()
+
+    def forward(self, x):
+        indices, values = x.chunk(2, dim=-1)
+        return self.activation(self.bag(indices.long(), per_sample_weights=values) + self.bias)
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        # The embeddings are the columns of the weight matrix of the dense linear layer
+        if prefix + 'model.0.weight' in state_dict:
+            state_dict[prefix + 'bag.weight'] = state_dict.pop(prefix + 'model.0.weight').t().contiguous()
+            state_dict[prefix + 'bias'] = state_dict.pop(prefix + 'model.0.bias')
+        super(AdultEmbeddingBagFeaturizer, self)._load_from_state_dict(state_dict, prefix, *args, **kwargs)
+
+
 class CelebAFeaturizer(nn.Module):
-    def __init__(self):
+    def __init__(self, checkpoint_segments: int = 0, pretrained: bool = True):
         super(CelebAFeaturizer, self).__init__()
-        self.model = models.resnet50(pretrained=True)
+        self.model = torchvision_backbone(BACKBONE_NAME['celeba'], pretrained)
         self.model = drop_classification_layer(self.model)
+        self.checkpoint_segments = checkpoint_segments
 
     def forward(self, x):
-        return self.model(x)
+        return checkpointed_forward(self.model, self.checkpoint_segments, x)
 
 
 class CivilFeaturizer(nn.Module):
-    def __init__(self):
+    def __init__(self, pretrained: bool = True):
         super(CivilFeaturizer, self).__init__()
-        bert = torch.hub.load('huggingface/pytorch-transformers', 'modelForSequenceClassification', 'bert-base-uncased', return_dict=False)    # Download model and configuration from S3 and cache
+        bert = bert_classifier(pretrained)
 
         for param in bert.parameters():
             param.requires_grad = False
@@ -79,15 +179,70 @@ class CivilFeaturizer(nn.Module):
         return output
 
 
+class CachedFeaturizer(nn.Module):
+    """Stand-in for a frozen backbone, which takes the cached backbone features as input. Without an 
+    adapter the features are passed through unchanged, otherwise a small trainable layer is applied."""
+    def __init__(self, in_features: int, adapter: bool = False):
+        super(CachedFeaturizer, self).__init__()
+        if adapter:
+            self.model = nn.Sequential(
+                nn.Linear(in_features, NODE_SIZE),
+                nn.SELU()
+            )
+            self.out_features = NODE_SIZE
+        else:
+            self.model = nn.Flatten()
+            self.out_features = in_features
+
+    def forward(self, x):
+        return self.model(x)
+
+
 class CheXPertFeaturizer(nn.Module):
-    def __init__(self):
+    """DenseNet121 featurizer of the CheXpert X-rays. With `single_channel` the first convolution takes the
+    grayscale images as one channel (see `single_channel_conv`), which gives the same features for a third of the
+    input memory and of the cost of the first convolution. Checkpoints of the three channel featurizer can be loaded."""
+    def __init__(self, checkpoint_segments: int = 0, pretrained: bool = True, single_channel: bool = False):
         super(CheXPertFeaturizer, self).__init__()
-        model = models.densenet121(pretrained=True)
+        model = torchvision_backbone(BACKBONE_NAME['chexpert'], pretrained)
+        if single_channel:
+            model.features.conv0 = single_channel_conv(model.features.conv0)
         model = drop_classification_layer(model)
-        self.model = nn.Sequential(model, nn.AvgPool2d((7, 7)))
+        # Pools the 7x7 feature maps of 224x224 images, and those of any other size (see progressive resizing in train_model.py)
+        self.model = nn.Sequential(model, nn.AdaptiveAvgPool2d(1))
+        self.checkpoint_segments = checkpoint_segments
+        self.single_channel = single_channel
 
     def forward(self, x):
-        return self.model(x)
+        return checkpointed_forward(self.model, self.checkpoint_segments, x)
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        key = prefix + CHEXPERT_CONV0_WEIGHT
+        if self.single_channel and key in state_dict and state_dict[key].shape[1] == 3:
+            state_dict[key] = state_dict[key].sum(dim=1, keepdim=True)
+        super(CheXPertFeaturizer, self)._load_from_state_dict(state_dict, prefix, *args, **kwargs)
+
+
+class StudentFeaturizer(nn.Module):
+    """Image featurizer with a small torchvision backbone (see `STUDENT_BACKBONES`), into which the ResNet50 and
+    DenseNet121 featurizers are distilled for fast inference on a CPU (see distill.py). Any image size is pooled
+    to a single feature vector."""
+    def __init__(self, backbone: str, checkpoint_segments: int = 0, pretrained: bool = True, single_channel: bool = False):
+        super(StudentFeaturizer, self).__init__()
+        model = torchvision_backbone(backbone, pretrained)
+        if hasattr(model, 'features'):
+            # The MobileNets pool in their forward function instead of in a layer
+            if single_channel:
+                model.features[0][0] = single_channel_conv(model.features[0][0])
+            self.model = nn.Sequential(model.features, nn.AdaptiveAvgPool2d(1))
+        else:
+            if single_channel:
+                model.conv1 = single_channel_conv(model.conv1)
+            self.model = drop_classification_layer(model)
+        self.checkpoint_segments = checkpoint_segments
+
+    def forward(self, x):
+        return checkpointed_forward(self.model, self.checkpoint_segments, x)
 
 
 if __name__ == "__main__":
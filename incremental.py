@@ -0,0 +1,206 @@
+import os
+import re
+import json
+import hashlib
+import argparse
+import torch
+import torch.utils.data as data
+
+from data import get_train_validation_set, get_test_set, ResumableSampler, attribute_columns
+from model import FairClassifier, checkpoint_nr_attr_values
+from checkpointing import checkpoint_fingerprint
+from featurizers import CachedFeaturizer
+from feature_cache import CachedFeatureDataset, cache_features, get_cached_set, attribute_key, META_FILENAME
+from weights import set_weights_dir
+from results import ResultsStore, DEFAULT_RESULTS_DB
+
+
+def next_version(checkpoint: str) -> str:
+    """Returns the path of the next version of a checkpoint stored as models/<dataset>/<lambda>/<seed>.pt, in a
+    directory next to it: models/adult/0.7/42.pt becomes models/adult/0.7_v1/42.pt, which becomes models/adult/0.7_v2/42.pt.
+    Existing versions are never overwritten, the first free version is used instead. The versions can be evaluated
+    like the original (`evaluation.evaluate(..., checkpoint=models/adult/0.7_v1)`)."""
+    directory, filename = os.path.split(os.path.normpath(checkpoint))
+    match = re.fullmatch(r"(.*)_v(\d+)", directory)
+    base, version = (match.group(1), int(match.group(2))) if match else (directory, 0)
+    path = os.path.join("{}_v{}".format(base, version + 1), filename)
+    while os.path.exists(path):
+        version += 1
+        path = os.path.join("{}_v{}".format(base, version + 1), filename)
+    return path
+
+def data_fingerprint(root: str) -> str:
+    """Identifies the data in a data root by the paths, sizes and modification times of its files and directories
+    (two levels deep), such that the features of new data that arrives in the same root are not taken from the cache."""
+    entries = []
+    for directory, subdirectories, files in os.walk(os.path.abspath(root)):
+        if os.path.relpath(directory, root).count(os.sep) > 1:
+            continue
+        for name in sorted(subdirectories + files):
+            stat = os.stat(os.path.join(directory, name))
+            entries.append("{} {} {}".format(os.path.join(directory, name), stat.st_size, stat.st_mtime_ns))
+    return hashlib.sha1("\n".join(sorted(entries)).encode()).hexdigest()[:10]
+
+def feature_set(featurizer: torch.nn.Module, dataset: data.Dataset, path: str, batch_size: int, num_workers: int,
+                device: torch.device, collate_fn=None, progress_bar: bool = True) -> CachedFeatureDataset:
+    """Passes a dataset through the (trained) featurizer once and caches the features in `path` (per attribute
+    columns), or returns them from there if they were computed before."""
+    path = "{}_{}".format(path, attribute_key(dataset))
+    if not os.path.exists(os.path.join(path, META_FILENAME)):
+        print("Caching the features of the checkpoint to", path)
+        cache_features(featurizer, dataset, path, batch_size, num_workers, device, collate_fn, progress_bar)
+    return CachedFeatureDataset(path, attribute_columns(dataset))
+
+
+def main(dataset: str, checkpoint: str, new_data_root: str, dataset_root: str, attribute: str, lmbda: float, optimizer: str,
+         lr_f: float, lr_g: float, lr_j: float, epochs: int, batch_size: int, num_workers: int, seed: int, progress_bar: bool,
+         freeze_featurizer: bool = False, adapter: bool = False, compact_tabular: bool = False, single_channel: bool = False,
+         feature_cache: str = "cache", output: str = "", weights_dir: str = "", results_db: str = DEFAULT_RESULTS_DB,
+         report: str = ""):
+    """
+    Updates a trained model (e.g. models/adult/0.7/42.pt) with new labeled data, without training it from scratch.
+    With `lr_f` 0 the featurizer is kept fixed: the new data (the training split in `new_data_root`) is passed
+    through it once, and the joint classifier and group specific models are trained for `epochs` passes on the
+    cached features. With `lr_f` > 0 the featurizer is tuned as well, at that (small) learning rate. The held-out
+    test set in `dataset_root` is evaluated before and after the update, and the update is saved as the next
+    version of the checkpoint (see `next_version`).
+    """
+    # Imported here, since train_model imports all of its dependencies
+    from torch.utils.tensorboard import SummaryWriter
+    from train_model import train_model, test_model, set_seed, bert_collate
+
+    if weights_dir:
+        set_weights_dir(weights_dir)
+    device = torch.device("cuda:0") if torch.cuda.is_available() else torch.device("cpu")
+    collate_fn = bert_collate if dataset == "civil" else None
+    set_seed(seed)
+
+    # The lambda of the checkpoint is the name of its directory, unless it is given
+    lambda_dir = re.sub(r"_v\d+$", "", os.path.basename(os.path.dirname(os.path.normpath(checkpoint))))
+    if lmbda is None:
+        try:
+            lmbda = float(lambda_dir)
+        except ValueError:
+            raise ValueError("Cannot read lambda from the directory of {}, give it with --lmbda".format(checkpoint))
+    output = output or next_version(checkpoint)
+
+    state_dict = torch.load(checkpoint, map_location=device)
+    model = FairClassifier(dataset, nr_attr_values=checkpoint_nr_attr_values(state_dict), frozen_featurizer=freeze_featurizer,
+                           adapter=adapter, compact_tabular=compact_tabular, pretrained=False, single_channel=single_channel).to(device)
+    model.load_state_dict(state_dict)
+
+    new_set, _ = get_train_validation_set(dataset, root=new_data_root, attribute=attribute, compact_tabular=compact_tabular,
+                                          seed=seed, single_channel=single_channel)
+    test_set = get_test_set(dataset, dataset_root, compact_tabular=compact_tabular, attribute=attribute, single_channel=single_channel)
+    if new_set.nr_attr_values() != len(model.group_specific_models):
+        raise ValueError("The new data has {} groups, the checkpoint {}".format(new_set.nr_attr_values(), len(model.group_specific_models)))
+    new_data_name, test_data_name = data_fingerprint(new_data_root), "test_" + data_fingerprint(dataset_root)
+    # A model trained on cached backbone features takes those as input (cached per version of the data, like below)
+    if freeze_featurizer:
+        new_set = get_cached_set(dataset, "new_" + new_data_name, new_set, feature_cache, batch_size, num_workers, device,
+                                 collate_fn, progress_bar, single_channel)
+        test_set = get_cached_set(dataset, test_data_name, test_set, feature_cache, batch_size, num_workers, device, collate_fn,
+                                  progress_bar, single_channel)
+        collate_fn = None
+
+    if lr_f == 0:
+        # The featurizer is fixed, so the data only has to pass through it once, and the heads are trained (and the
+        # model is evaluated) on its features, by a model with the same heads on top of a pass-through featurizer.
+        # The features are cached per version of the checkpoint, so a retrained checkpoint never uses stale features
+        cache_path = os.path.join(feature_cache, "incremental", "{}_{}".format(
+            os.path.splitext(os.path.relpath(checkpoint))[0].replace(os.sep, "_"), checkpoint_fingerprint(checkpoint)))
+        new_set = feature_set(model.featurizer, new_set, os.path.join(cache_path, new_data_name), batch_size, num_workers,
+                              device, collate_fn, progress_bar)
+        test_set = feature_set(model.featurizer, test_set, os.path.join(cache_path, test_data_name), batch_size, num_workers,
+                               device, collate_fn, progress_bar)
+        collate_fn = None
+        featurizer, model.featurizer = model.featurizer, CachedFeaturizer(model.joint_classifier.in_features).to(device)
+
+    test_loader = data.DataLoader(test_set, batch_size=batch_size, num_workers=num_workers, collate_fn=collate_fn)
+    results = {}
+    acc, auc, abc, _, _ = test_model(model, test_loader, device, seed, progress_bar)
+    results["before"] = {"acc": acc, "auc": auc, "abc": abc}
+
+    sampler = ResumableSampler(new_set, num_replicas=1, rank=0, shuffle=True, seed=seed, drop_last=True)
+    new_loader = data.DataLoader(new_set, batch_size=batch_size, sampler=sampler, num_workers=num_workers,
+                                 collate_fn=collate_fn, drop_last=True)
+    run_name = os.path.join("incremental", os.path.splitext(os.path.relpath(output))[0].replace(os.sep, "_"))
+    writer = SummaryWriter(log_dir=os.path.join("runs", run_name))
+    # The final model of train_model is the update (an absolute checkpoint name is not put under runs/)
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    model = train_model(model, new_loader, None, optimizer, lr_f, lr_g, lr_j, lmbda, epochs, os.path.abspath(output), device,
+                        progress_bar, writer)
+    writer.close()
+
+    acc, auc, abc, curves, _ = test_model(model, test_loader, device, seed, progress_bar)
+    results["after"] = {"acc": acc, "auc": auc, "abc": abc}
+    results["difference"] = {metric: results["after"][metric] - results["before"][metric] for metric in results["after"]}
+    for name in ["before", "after", "difference"]:
+        print(name + ":", ", ".join("{}: {:.4f}".format(k, v) for k, v in results[name].items()))
+
+    # train_model saved the heads on top of the pass-through featurizer, the update has the featurizer of the checkpoint
+    if lr_f == 0:
+        model.featurizer = featurizer
+        torch.save(model.state_dict(), output)
+    print("Updated model saved to", output)
+
+    if results_db:
+        hparams = {"data": dataset, "attr": attribute, "lambda": lmbda, "seed": seed, "opt": optimizer, "lr_f": lr_f,
+                   "lr_g": lr_g, "lr_j": lr_j, "epochs": epochs, "checkpoint": checkpoint, "new_data_root": new_data_root,
+                   "new_data_size": len(new_set), "frozen": freeze_featurizer, "adapter": adapter,
+                   "auc_before": results["before"]["auc"], "abc_before": results["before"]["abc"]}
+        with ResultsStore(results_db) as store:
+            store.append("incremental", output, hparams, results["after"], curves=curves)
+    if report:
+        with open(report, 'w') as f:
+            json.dump(dict(results, checkpoint=checkpoint, output=output, new_data_size=len(new_set)), f, indent=2)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Updates a trained model with new labeled data, mainly by retraining its heads.")
+    parser.add_argument('--dataset', default='adult', type=str)
+    parser.add_argument('--checkpoint', required=True, type=str,
+                        help="The checkpoint to update, e.g. models/adult/0.7/42.pt.")
+    parser.add_argument('--new_data_root', required=True, type=str,
+                        help="The root of the data folders with the new data, as the training split of the dataset.")
+    parser.add_argument('--dataset_root', default="data", type=str,
+                        help="The root of the data folders with the held-out test set.")
+    parser.add_argument('--attribute', default="", type=str,
+                        help="The sensitive attribute(s) the checkpoint was trained with.")
+    parser.add_argument('--lmbda', default=None, type=float,
+                        help="The lambda of the update. Defaults to the lambda of the checkpoint (its directory name).")
+    parser.add_argument('--optimizer', default="adam", type=str, choices=["sgd", "adam"])
+    parser.add_argument('--lr_f', default=0.0, type=float,
+                        help="The learning rate of the featurizer. 0 keeps it fixed, which only passes the data through \
+                            it once; a small value (e.g. 1e-5) tunes it lightly.")
+    parser.add_argument('--lr_g', default=0.001, type=float)
+    parser.add_argument('--lr_j', default=0.001, type=float)
+    parser.add_argument('--epochs', default=2, type=int,
+                        help="The number of passes over the new data.")
+    parser.add_argument('--batch_size', default=32, type=int)
+    parser.add_argument('--num_workers', default=3, type=int)
+    parser.add_argument('--seed', default=42, type=int)
+    parser.add_argument('--freeze_featurizer', action="store_true",
+                        help="The checkpoint was trained with --freeze_featurizer.")
+    parser.add_argument('--adapter', action="store_true",
+                        help="The checkpoint was trained with --adapter.")
+    parser.add_argument('--compact_tabular', action="store_true",
+                        help="The checkpoint was trained with --compact_tabular.")
+    parser.add_argument('--single_channel', action="store_true",
+                        help="The checkpoint was trained with --single_channel.")
+    parser.add_argument('--feature_cache', default="cache", type=str,
+                        help="The root directory of the cached features.")
+    parser.add_argument('--output', default="", type=str,
+                        help="The updated checkpoint. Defaults to the next version next to the checkpoint, e.g. \
+                            models/adult/0.7_v1/42.pt.")
+    parser.add_argument('--weights_dir', default="", type=str,
+                        help="The directory with the pretrained backbone weights (see weights.py).")
+    parser.add_argument('--results_db', default=DEFAULT_RESULTS_DB, type=str,
+                        help="The SQLite file the results of the update are added to (empty to disable).")
+    parser.add_argument('--report', default="", type=str,
+                        help="A json file to write the results before and after the update to.")
+    parser.add_argument('--progress_bar', action="store_true",
+                        help="Turn progress bar on.")
+    args = parser.parse_args()
+    main(**vars(args))
@@ -1,46 +1,84 @@
-from tokenize import group
+import math
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
-import torchvision.models as models
-
 from featurizers import get_featurizer
 
 import numpy as np
 
+class GroupSpecificModels(nn.Module):
+    def __init__(self, in_features: int, nr_attr_values: int):
+        """
+        The linear group specific models of all groups, stored as a single weight matrix such that the predictions
+        of a batch are computed by selecting the weights of the group of every data point, instead of a loop over
+        the groups. With many (e.g. intersectional) groups this keeps the cost of a forward pass independent of the
+        number of groups.
+        """
+        super(GroupSpecificModels, self).__init__()
+        self.weight = nn.Parameter(torch.empty(nr_attr_values, in_features))
+        self.bias = nn.Parameter(torch.empty(nr_attr_values))
+
+        # Initialized like a separate nn.Linear(in_features, 1) per group, in the same order
+        bound = 1 / math.sqrt(in_features)
+        with torch.no_grad():
+            for weight, bias in zip(self.weight, self.bias):
+                nn.init.uniform_(weight, -bound, bound)
+                nn.init.uniform_(bias, -bound, bound)
+
+    def __len__(self) -> int:
+        return self.weight.shape[0]
+
+    def forward(self, features: torch.Tensor, d: torch.Tensor) -> torch.Tensor:
+        """Returns the logit of the group specific model of group `d` for every data point."""
+        d = d.reshape(-1).long()
+        return (features.reshape(len(d), -1) * self.weight[d]).sum(dim=-1) + self.bias[d]
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        # Checkpoints from before the models were stacked have a separate linear layer per group
+        if prefix + "weight" not in state_dict and prefix + "0.weight" in state_dict:
+            weights, biases = [], []
+            while prefix + "{}.weight".format(len(weights)) in state_dict:
+                weights.append(state_dict.pop(prefix + "{}.weight".format(len(weights))))
+                biases.append(state_dict.pop(prefix + "{}.bias".format(len(biases))))
+            state_dict[prefix + "weight"] = torch.cat(weights)
+            state_dict[prefix + "bias"] = torch.cat(biases)
+        super(GroupSpecificModels, self)._load_from_state_dict(state_dict, prefix, *args, **kwargs)
+
+def checkpoint_nr_attr_values(state_dict: dict) -> int:
+    """Returns the number of groups of the model in a checkpoint."""
+    if "group_specific_models.bias" in state_dict:
+        return len(state_dict["group_specific_models.bias"])
+    return len([key for key in state_dict if key.startswith("group_specific_models.") and key.endswith(".bias")])
+
 class FairClassifier(nn.Module):
-    def __init__(self, input_model: str, nr_attr_values: int = 2):
+    def __init__(self, input_model: str, nr_attr_values: int = 2, frozen_featurizer: bool = False, adapter: bool = False,
+                 checkpoint_segments: int = 0, compact_tabular: bool = False, pretrained: bool = True,
+                 single_channel: bool = False, backbone: str = ""):
         """
-        FairClassifier Model
+        FairClassifier Model. With `frozen_featurizer` the model expects cached backbone features as input
+        instead of the raw data points (see `feature_cache.py`). `checkpoint_segments` enables activation
+        checkpointing in the image featurizers. With `compact_tabular` the model expects the compact
+        representation of the Adult data. Without `pretrained` the backbone is not initialized with pretrained
+        weights, which is useful when a trained checkpoint is loaded into the model afterwards. With 
+        `single_channel` the CheXpert model expects single channel images. `backbone` replaces the backbone
+        of the image models by a small one (see `featurizers.STUDENT_BACKBONES`), for distilled models.
         """
         super(FairClassifier, self).__init__()
-        in_features, self.featurizer = get_featurizer(input_model)
+        in_features, self.featurizer = get_featurizer(input_model, frozen=frozen_featurizer, adapter=adapter,
+                                                      checkpoint_segments=checkpoint_segments, compact=compact_tabular,
+                                                      pretrained=pretrained, single_channel=single_channel, backbone=backbone)
 
-        # Fully Connected models for binary classes
-        self.group_specific_models = nn.ModuleList([nn.Linear(in_features, 1) for key in range(nr_attr_values)])
+        # Fully Connected models for binary classes, one for every group
+        self.group_specific_models = GroupSpecificModels(in_features, nr_attr_values)
 
         # Join Classifier T
         self.joint_classifier = nn.Linear(in_features, 1)
 
-    def split(self, x: torch.Tensor, d: torch.Tensor):
-        # Groups x samples based on d-values
-        sorter = torch.argsort(d, dim=0)
-        _, counts = torch.unique(d, return_counts=True)
-        return sorter.unsqueeze(dim=-1), torch.split(x[sorter, :], counts.tolist())
-
     def group_forward(self, x: torch.Tensor, d: torch.Tensor):
         """ The forward pass of the group specific models. """
-        batch_size = x.shape[0]
-
         features = self.featurizer(x).squeeze()
-
-        # Sort the inputs on the value of d
-        group_indices, group_splits = self.split(features, d)
-        group_pred = torch.zeros(batch_size, device=self.device())
-        group_pred[group_indices] = torch.cat([self.group_specific_models[i](group_split) for i, group_split in enumerate(group_splits)])
-
-        return torch.sigmoid(group_pred)
+        return torch.sigmoid(self.group_specific_models(features, d))
 
     def forward(self, x: torch.Tensor, d: torch.Tensor = None, d_tilde: torch.Tensor = None):
         """Returns the model prediction by the joint classifier, and the group specific and 
@@ -61,21 +99,13 @@ class FairClassifier(nn.Module):
 
         # Group specific
         if type(d) == torch.Tensor:
-            group_spe_indices, group_spe_splits = self.split(features, d)
-
-            group_spe_pred = torch.zeros(features.shape[0], device=self.device())
-            group_spe_pred[group_spe_indices] = torch.cat([self.group_specific_models[i](group_split) for i, group_split in enumerate(group_spe_splits)])
-            group_spe_pred = torch.sigmoid(group_spe_pred).squeeze()
+            group_spe_pred = torch.sigmoid(self.group_specific_models(features, d)).squeeze()
         else:
             group_spe_pred = None
 
         # Group agnostic
         if type(d_tilde) == torch.Tensor:
-            group_agn_indices, group_agn_splits = self.split(features, d_tilde)
-
-            group_agn_pred = torch.zeros(features.shape[0], device=self.device())
-            group_agn_pred[group_agn_indices] = torch.cat([self.group_specific_models[i](group_split) for i, group_split in enumerate(group_agn_splits)])
-            group_agn_pred = torch.sigmoid(group_agn_pred).squeeze()
+            group_agn_pred = torch.sigmoid(self.group_specific_models(features, d_tilde)).squeeze()
         else:
             group_agn_pred = None
 
@@ -0,0 +1,107 @@
+import time
+import torch
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+
+_NULL_CONTEXT = nullcontext()
+
+
+class NullProfiler:
+    """Profiler that does nothing, used when profiling is off. Every call returns immediately."""
+    def phase(self, name: str):
+        return _NULL_CONTEXT
+
+    def wrap_loader(self, batches):
+        return batches
+
+    def end_step(self, prefix: str, step: int):
+        pass
+
+    def end_epoch(self, epoch: int):
+        pass
+
+    def close(self):
+        pass
+
+
+class StepProfiler(NullProfiler):
+    def __init__(self, writer, device: torch.device, trace_dir: str = "", trace_start: int = 0, trace_steps: int = 0):
+        """Times the phases of every training step (waiting for data, forward, backward, optimizer steps, logging)
+        and writes them to the SummaryWriter under `profile/<pass>/<phase>` in milliseconds per step, and under
+        `profile/epoch/<pass>/<phase>` in seconds per epoch.
+
+        Args:
+            writer (SummaryWriter): the writer to log the timings to.
+            device (torch.device): the training device (CUDA is synchronized before every measurement).
+            trace_dir (str): the directory to write a torch.profiler trace to (viewable in TensorBoard).
+            trace_start (int): the step at which the trace starts.
+            trace_steps (int): the number of steps to trace (0 disables the trace).
+        """
+        self._writer = writer
+        self._synchronize = device.type == "cuda"
+        self._step_times = defaultdict(float)
+        self._epoch_times = defaultdict(float)
+        self._total_times = defaultdict(float)
+
+        self._trace = None
+        if trace_steps:
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if self._synchronize:
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            # The step before the traced window is used to warm up the profiler
+            schedule = torch.profiler.schedule(wait=max(trace_start - 1, 0), warmup=min(trace_start, 1), active=trace_steps, repeat=1)
+            self._trace = torch.profiler.profile(activities=activities, schedule=schedule,
+                                                 on_trace_ready=torch.profiler.tensorboard_trace_handler(trace_dir))
+            self._trace.start()
+
+    def _time(self) -> float:
+        if self._synchronize:
+            torch.cuda.synchronize()
+        return time.perf_counter()
+
+    @contextmanager
+    def phase(self, name: str):
+        """Adds the time spent in the context to the phase `name` of the current step."""
+        start = self._time()
+        with torch.profiler.record_function(name) if self._trace else _NULL_CONTEXT:
+            yield
+        self._step_times[name] += self._time() - start
+
+    def wrap_loader(self, batches):
+        """Yields the batches, and counts the time spent waiting for each batch as the phase `data_wait`."""
+        iterator = iter(batches)
+        while True:
+            start = self._time()
+            try:
+                batch = next(iterator)
+            except StopIteration:
+                return
+            self._step_times["data_wait"] += self._time() - start
+            yield batch
+
+    def end_step(self, prefix: str, step: int):
+        """Writes the phase timings of the step that ended to the SummaryWriter."""
+        for name, duration in self._step_times.items():
+            self._writer.add_scalar("profile/{}/{}".format(prefix, name), duration * 1000, step)
+            self._epoch_times[prefix + "/" + name] += duration
+        self._step_times.clear()
+        if self._trace:
+            self._trace.step()
+
+    def end_epoch(self, epoch: int):
+        for name, duration in self._epoch_times.items():
+            self._writer.add_scalar("profile/epoch/" + name, duration, epoch)
+            self._total_times[name] += duration
+        self._epoch_times.clear()
+
+    def close(self):
+        """Stops the trace and prints the time per phase over the whole training."""
+        if self._trace:
+            self._trace.stop()
+            self._trace = None
+
+        total = sum(self._total_times.values())
+        if total:
+            print("Time per training phase:")
+            for name, duration in sorted(self._total_times.items(), key=lambda item: -item[1]):
+                print("  {:<24} {:10.2f}s {:6.1f}%".format(name, duration, 100 * duration / total))
@@ -0,0 +1,123 @@
+import json
+import time
+import sqlite3
+import numpy as np
+import pandas as pd
+
+DEFAULT_RESULTS_DB = "results.db"
+
+# The columns that can be grouped on and aggregated in `ResultsStore.aggregate`
+GROUP_COLUMNS = ["source", "dataset", "attribute", "lambda", "seed", "optimizer", "run_name"]
+METRIC_COLUMNS = ["acc", "auc", "abc", "train_seconds", "test_seconds"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created TEXT NOT NULL,
+    source TEXT NOT NULL,
+    run_name TEXT NOT NULL,
+    dataset TEXT NOT NULL,
+    attribute TEXT,
+    lambda REAL,
+    seed INTEGER,
+    optimizer TEXT,
+    acc REAL,
+    auc REAL,
+    abc REAL,
+    train_seconds REAL,
+    test_seconds REAL,
+    hparams TEXT,
+    curves TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_dataset_lambda_seed ON runs (dataset, lambda, seed);
+CREATE INDEX IF NOT EXISTS runs_lambda ON runs (lambda);
+CREATE INDEX IF NOT EXISTS runs_seed ON runs (seed);
+"""
+
+
+class ResultsStore:
+    def __init__(self, path: str = DEFAULT_RESULTS_DB):
+        """SQLite store with a row per trained or evaluated model: the hyperparameters, the test metrics, the
+        timings and a summary of the group specific curves. Tables over thousands of runs are a single query,
+        instead of a scan over all TensorBoard event files.
+
+        Args:
+            path (str): the database file (created if it does not exist).
+        """
+        # Runs of a sweep can finish at the same time, so wait for the lock of another writer
+        self._connection = sqlite3.connect(path, timeout=60)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(SCHEMA)
+
+    def append(self, source: str, run_name: str, hparams: dict, metrics: dict, timings: dict = None, curves: dict = None):
+        """Adds the results of a run.
+
+        Args:
+            source (str): what produced the results ("train" for train_model.py, "evaluate" for evaluation.py).
+            run_name (str): the name of the run (or the checkpoint it was evaluated from).
+            hparams (dict): the hyperparameters, with at least "data", and where known "attr", "lambda", "seed"
+                and "opt" (the keys of the TensorBoard hparams).
+            metrics (dict): the test accuracy ("acc"), AUC ("auc") and ABC ("abc").
+            timings (dict): the seconds spent on training ("train_seconds") and testing ("test_seconds").
+            curves (dict): the summary of the group specific curves (see `evaluation.summarize_curves`).
+        """
+        timings = timings or {}
+        row = {"created": time.strftime("%Y-%m-%d %H:%M:%S"), "source": source, "run_name": run_name,
+               "dataset": hparams["data"], "attribute": hparams.get("attr"), "lambda": hparams.get("lambda"),
+               "seed": hparams.get("seed"), "optimizer": hparams.get("opt"),
+               "acc": metrics.get("acc"), "auc": metrics.get("auc"), "abc": metrics.get("abc"),
+               "train_seconds": timings.get("train_seconds"), "test_seconds": timings.get("test_seconds"),
+               "hparams": json.dumps(hparams, default=str), "curves": json.dumps(curves) if curves else None}
+        with self._connection:
+            self._connection.execute("INSERT INTO runs ({}) VALUES ({})".format(
+                ", ".join('"{}"'.format(column) for column in row), ", ".join("?" * len(row))), list(row.values()))
+
+    def runs(self, dataset: str = None, source: str = None) -> pd.DataFrame:
+        """Returns all runs (of a dataset and/or source) as a table."""
+        where, parameters = self._where(dataset, source)
+        return pd.read_sql_query("SELECT * FROM runs" + where + " ORDER BY id", self._connection, params=parameters)
+
+    def aggregate(self, dataset: str = None, source: str = None, group_by: tuple = ("dataset", "lambda"),
+                  metrics: tuple = ("acc", "auc", "abc")) -> pd.DataFrame:
+        """Returns the mean and (population) standard deviation of the metrics over the runs of every group,
+        e.g. over the seeds of every dataset and lambda, computed by SQLite.
+
+        Args:
+            dataset (str): only the runs of this dataset.
+            source (str): only the runs of this source ("train" or "evaluate").
+            group_by (tuple): the columns that define a group (see `GROUP_COLUMNS`).
+            metrics (tuple): the metrics to aggregate (see `METRIC_COLUMNS`).
+
+        Returns:
+            pd.DataFrame: a row per group, with the number of runs and the mean and std of every metric.
+        """
+        unknown = set(group_by) - set(GROUP_COLUMNS) | set(metrics) - set(METRIC_COLUMNS)
+        if unknown:
+            raise ValueError("Cannot aggregate over {}".format(", ".join(sorted(unknown))))
+
+        columns = ['"{}"'.format(column) for column in group_by] + ["COUNT(*) AS runs"]
+        for metric in metrics:
+            columns += ['AVG("{0}") AS {0}_mean'.format(metric), 'AVG("{0}" * "{0}") AS {0}_sq'.format(metric)]
+        where, parameters = self._where(dataset, source)
+        group = ", ".join('"{}"'.format(column) for column in group_by)
+        table = pd.read_sql_query("SELECT {} FROM runs{} GROUP BY {} ORDER BY {}".format(", ".join(columns), where, group, group),
+                                  self._connection, params=parameters)
+
+        for metric in metrics:
+            variance = table.pop(metric + "_sq") - table[metric + "_mean"] ** 2
+            table[metric + "_std"] = np.sqrt(variance.clip(lower=0))
+        return table
+
+    def _where(self, dataset: str, source: str) -> tuple:
+        conditions = [(column, value) for column, value in [("dataset", dataset), ("source", source)] if value is not None]
+        where = " WHERE " + " AND ".join("{} = ?".format(column) for column, _ in conditions) if conditions else ""
+        return where, [value for _, value in conditions]
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,196 @@
+import torch
+import torch.multiprocessing as mp
+import torch.utils.data as data
+
+# Every tensor of a sample starts at a multiple of 8 bytes in its slot, such that it can be viewed as any dtype
+ALIGNMENT = 8
+
+# The counters of the statistics, in the shared `_counters` tensor
+HITS, MISSES, EVICTIONS = 0, 1, 2
+# The rows of `_counters`: every process (the main process and each data loader worker) counts in its own row, such
+# that the counters need no lock
+COUNTER_ROWS = 64
+# The number of slots after the eviction cursor that are searched for a sample to evict
+EVICTION_WINDOW = 64
+
+
+def _aligned(nbytes: int) -> int:
+    return (nbytes + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+class SharedSampleCache(data.Dataset):
+    def __init__(self, dataset: data.Dataset, budget_bytes: int):
+        """Cache of the fully transformed samples of a dataset in shared memory, such that the data loader workers of
+        all later passes and epochs read a sample that any worker loaded before, instead of loading it again (e.g.
+        reading, decoding and resizing an image). The cache holds as many samples as fit in `budget_bytes`. When it is
+        full, a new sample evicts one that was read from the cache since it was cached, while the samples that were not
+        read yet are kept. Every pass reads all samples once in a random order, so this keeps the hit rate at the
+        fraction of the data that fits, where evicting the least recently used sample would evict most samples before
+        they are read again. Random transforms should not be cached, since every pass would see the same result.
+
+        Only misses take a lock, to write a sample. Hits copy the sample without it: the version of a slot is odd
+        while the slot is written and changes with every write, so a copy is used only if the version was even and
+        did not change during the copy. Evictions search a small window after a shared cursor, instead of all slots.
+
+        The samples should be tuples of tensors of which the shapes and dtypes do not change, like those of the first
+        sample (e.g. images of one size); other samples are loaded as usual. The dataset specific methods (e.g.
+        `sample_d`) are those of the dataset.
+
+        Args:
+            dataset (data.Dataset): the dataset to cache the samples of.
+            budget_bytes (int): the size of the cache in bytes.
+        """
+        self.dataset = dataset
+        self._layout = self._sample_layout(dataset[0])
+        self._resolution = None
+        self._slot_bytes = sum(_aligned(nbytes) for _, _, nbytes in self._layout)
+        capacity = budget_bytes // self._slot_bytes
+        if capacity == 0:
+            raise ValueError("A sample takes {} bytes, more than the budget of the sample cache ({} bytes)".format(self._slot_bytes, budget_bytes))
+
+        # Shared with the workers, either inherited or passed along when the dataset is sent to them
+        self._slots = torch.zeros(capacity, self._slot_bytes, dtype=torch.uint8).share_memory_()
+        self._slot_of = torch.full((len(dataset),), -1, dtype=torch.int64).share_memory_()
+        self._owner = torch.full((capacity,), -1, dtype=torch.int64).share_memory_()
+        self._read_since_write = torch.zeros(capacity, dtype=torch.bool).share_memory_()
+        self._version = torch.zeros(capacity, dtype=torch.int64).share_memory_()
+        # The number of used slots, the eviction cursor, and the counters of the statistics
+        self._used = torch.zeros(1, dtype=torch.int64).share_memory_()
+        self._cursor = torch.zeros(1, dtype=torch.int64).share_memory_()
+        self._counters = torch.zeros(COUNTER_ROWS, 3, dtype=torch.int64).share_memory_()
+        self._lock = mp.get_context().Lock()
+
+    @staticmethod
+    def _sample_layout(sample: tuple) -> list:
+        if not isinstance(sample, tuple) or not all(isinstance(tensor, torch.Tensor) for tensor in sample):
+            raise ValueError("Only samples that are tuples of tensors can be cached")
+        return [(tensor.dtype, tensor.shape, tensor.nelement() * tensor.element_size()) for tensor in sample]
+
+    def __getattr__(self, name: str):
+        # Guard against recursion while the object is unpickled in a worker, before `dataset` is set
+        if name == "dataset" or name.startswith("__"):
+            raise AttributeError(name)
+        return getattr(self.dataset, name)
+
+    def __len__(self) -> int:
+        return len(self.dataset)
+
+    def __getitem__(self, i: int) -> tuple:
+        sample = self._lookup(i)
+        if sample is not None:
+            self._count(HITS)
+            return sample
+        self._count(MISSES)
+
+        # Loaded outside of the lock, such that the other workers can use the cache in the meantime
+        sample = self.dataset[i]
+        if [(tensor.dtype, tensor.shape) for tensor in sample] == [(dtype, shape) for dtype, shape, _ in self._layout]:
+            with self._lock:
+                # Another worker may have loaded the same sample in the meantime
+                slot = self._free_slot() if self._slot_of[i].item() < 0 else -1
+                if slot >= 0:
+                    self._write(slot, i, sample)
+        return sample
+
+    def _count(self, counter: int):
+        worker = data.get_worker_info()
+        self._counters[(worker.id + 1 if worker else 0) % COUNTER_ROWS, counter] += 1
+
+    def _lookup(self, i: int):
+        """Returns a copy of the cached sample `i` (without the lock), or None if it is not cached or was written
+        during the copy."""
+        slot = self._slot_of[i].item()
+        if slot < 0:
+            return None
+        version = self._version[slot].item()
+        if version % 2 == 1 or self._owner[slot].item() != i:
+            return None
+        sample = self._read(slot)
+        if self._version[slot].item() != version:
+            return None
+        self._read_since_write[slot] = True
+        # A writer that reused the slot after the check would find the flag set for its new sample (the writer clears
+        # it while the version is odd, so a writer that starts after this check clears it itself)
+        if self._version[slot].item() != version:
+            self._read_since_write[slot] = False
+        return sample
+
+    def _read(self, slot: int) -> tuple:
+        sample, offset = [], 0
+        for dtype, shape, nbytes in self._layout:
+            sample.append(self._slots[slot, offset:offset + nbytes].view(dtype).reshape(shape).clone())
+            offset += _aligned(nbytes)
+        return tuple(sample)
+
+    def _write(self, slot: int, i: int, sample: tuple):
+        # Odd while the slot changes, such that the workers that are reading it discard their copy
+        self._version[slot] += 1
+        previous = self._owner[slot].item()
+        if previous >= 0:
+            self._slot_of[previous] = -1
+        offset = 0
+        for tensor, (_, _, nbytes) in zip(sample, self._layout):
+            self._slots[slot, offset:offset + nbytes] = tensor.detach().contiguous().reshape(-1).view(torch.uint8)
+            offset += _aligned(nbytes)
+        self._owner[slot] = i
+        self._slot_of[i] = slot
+        self._read_since_write[slot] = False
+        self._version[slot] += 1
+
+    def _free_slot(self) -> int:
+        """Returns an unused slot, or when the cache is full the slot of a sample that was read since it was cached
+        (which is evicted). Returns -1 when the cached samples in the searched window still have to be read."""
+        if self._used[0] < len(self._owner):
+            self._used[0] += 1
+            return self._used[0].item() - 1
+        # Search the window after the cursor, which moves past the slots it searched, such that every miss costs
+        # the same whatever the size of the cache
+        capacity = len(self._owner)
+        window = (self._cursor[0] + torch.arange(min(EVICTION_WINDOW, capacity))) % capacity
+        read = window[self._read_since_write[window]]
+        if len(read) == 0:
+            self._cursor[0] = (window[-1] + 1) % capacity
+            return -1
+        slot = read[0].item()
+        self._cursor[0] = (slot + 1) % capacity
+        self._count(EVICTIONS)
+        return slot
+
+    def clear(self):
+        """Empties the cache (e.g. when the transforms change)."""
+        with self._lock:
+            self._slot_of.fill_(-1)
+            self._owner.fill_(-1)
+            self._read_since_write.fill_(False)
+            # Discards the copies that are being made
+            self._version += 2
+            self._used.zero_()
+            self._cursor.zero_()
+
+    def set_resolution(self, size: int):
+        """Changes the size of the images (see `data.IMAGE_RESOLUTION`), and empties the cache if that changes the samples.
+        The slots keep their size, so the cache should be created at the largest size."""
+        # Always passed on, since the dataset can be shared with a validation set that is resized separately
+        self.dataset.set_resolution(size)
+        if size == self._resolution:
+            return
+        layout = self._sample_layout(self.dataset[0])
+        if sum(_aligned(nbytes) for _, _, nbytes in layout) > self._slot_bytes:
+            raise ValueError("The samples grew larger than the slots of the sample cache, create it at the largest size")
+        if layout != self._layout:
+            self.clear()
+            self._layout = layout
+        self._resolution = size
+
+    def statistics(self, reset: bool = True) -> dict:
+        """Returns the hits, misses, hit rate and evictions since the last reset, and the number and size of the cached samples.
+
+        Args:
+            reset (bool): start counting the hits, misses and evictions from zero again.
+        """
+        hits, misses, evictions = self._counters.sum(dim=0).tolist()
+        entries = (self._owner >= 0).sum().item()
+        if reset:
+            self._counters.zero_()
+        return {"hits": hits, "misses": misses, "hit_rate": hits / max(hits + misses, 1), "evictions": evictions,
+                "entries": entries, "mb": entries * self._slot_bytes / 2**20}
@@ -0,0 +1,85 @@
+import math
+import torch
+
+
+class AttributeSampler:
+    def __init__(self, counts: torch.Tensor, device: torch.device, seed: int = 0, block_size: int = 2**16):
+        """Samples the random attributes d_tilde for the group agnostic model on the training device. Uniform
+        random numbers are drawn in large blocks with a generator that is seeded per epoch, and are turned into
+        attributes with a search in the cumulative distribution, so a training step does no work on the host.
+
+        Args:
+            counts (torch.Tensor): the number of data points per attribute value, with shape (nr_attr_values,).
+                For sampling conditioned on another variable (e.g. the target), the counts per value of that
+                variable, with shape (nr_condition_values, nr_attr_values).
+            device (torch.device): the device to sample on.
+            seed (int): the seed from which the generator of every epoch is seeded.
+            block_size (int): the amount of random numbers drawn at once.
+        """
+        counts = torch.as_tensor(counts, dtype=torch.float64)
+        self.conditional = counts.dim() == 2
+        if not self.conditional:
+            counts = counts.unsqueeze(0)
+        if counts.sum() == 0:
+            raise ValueError("Cannot sample attributes without any counts")
+
+        # Condition values that do not occur in the data fall back to the marginal distribution
+        empty = counts.sum(dim=-1) == 0
+        counts[empty] = counts.sum(dim=0)
+        cdf = (counts / counts.sum(dim=-1, keepdim=True)).cumsum(dim=-1)
+        cdf[:, -1] = 1
+        self._cdf = cdf.float().to(device)
+
+        self._device = device
+        self._seed = seed
+        self._block_size = block_size
+        self._generator = torch.Generator(device=device)
+        self.set_epoch(0)
+
+    def set_epoch(self, epoch: int):
+        """Reseeds the generator, such that the attributes of an epoch only depend on the seed and the epoch."""
+        self._epoch = epoch
+        self._generator.manual_seed(hash((self._seed, epoch)) % 2**63)
+        self._block = torch.empty(0, device=self._device)
+        self._position = 0
+        self._consumed = 0
+
+    def _uniforms(self, n: int) -> torch.Tensor:
+        # The random numbers are always drawn in blocks of the same size, so the stream of numbers does not depend
+        # on the batch sizes that were requested (which allows resuming partway through an epoch)
+        while self._position + n > len(self._block):
+            new_block = torch.rand(self._block_size, generator=self._generator, device=self._device)
+            self._block = torch.cat([self._block[self._position:], new_block])
+            self._position = 0
+        uniforms = self._block[self._position:self._position + n]
+        self._position += n
+        self._consumed += n
+        return uniforms
+
+    def sample(self, n: int, condition: torch.Tensor = None) -> torch.Tensor:
+        """Samples `n` attributes.
+
+        Args:
+            n (int): the number of attributes to sample.
+            condition (torch.Tensor): for a conditional sampler, the value of the conditioning variable for each
+                sample (e.g. the targets of the batch). Ignored otherwise.
+
+        Returns:
+            torch.Tensor: the attributes, with shape (n,).
+        """
+        uniforms = self._uniforms(n)
+        if self.conditional:
+            cdf = self._cdf[condition.reshape(-1).long()]
+            attributes = torch.searchsorted(cdf, uniforms.unsqueeze(dim=-1), right=True).squeeze(dim=-1)
+        else:
+            attributes = torch.searchsorted(self._cdf[0], uniforms, right=True)
+        return attributes.clamp_(max=self._cdf.shape[-1] - 1)
+
+    def state_dict(self) -> dict:
+        return {"epoch": self._epoch, "consumed": self._consumed}
+
+    def load_state_dict(self, state: dict):
+        """Continues at the position in the epoch where the state was saved."""
+        self.set_epoch(state["epoch"])
+        for _ in range(math.ceil(state["consumed"] / self._block_size)):
+            self._uniforms(min(self._block_size, state["consumed"] - self._consumed))
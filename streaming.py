@@ -0,0 +1,235 @@
+import os
+import glob
+import json
+import argparse
+import torch
+import numpy as np
+import torch.utils.data as data
+
+from data import ADULT_CONTINOUS, encode_attributes
+from distributed import get_rank, get_world_size
+
+ADULT_TARGET = "income-per-year"
+
+
+def list_shards(path: str) -> list:
+    """Returns the parquet files in a directory, in a fixed order."""
+    shards = sorted(glob.glob(os.path.join(path, "*.parquet")))
+    if not shards:
+        raise ValueError("No parquet shards found in {}".format(path))
+    return shards
+
+def compute_statistics(shards: list, attributes: list, target: str = ADULT_TARGET, continuous: list = ADULT_CONTINOUS,
+                       batch_rows: int = 2**16) -> dict:
+    """Computes the statistics of a sharded table in one streaming pass, reading only the columns it needs: the
+    mean and variance of the continuous columns (merged per batch, which is numerically stable) and the number of
+    rows per group (combination of attribute values) and target.
+
+    Args:
+        shards (list): the parquet files of the table.
+        attributes (list): the columns of the sensitive attributes (with values 0 up to the number of values).
+        target (str): the column of the binary target.
+        continuous (list): the continuous columns to normalize.
+        batch_rows (int): the number of rows read at once.
+
+    Returns:
+        dict: the feature columns, the mean and variance per continuous column, the number of values of every
+            attribute and the group counts per target.
+    """
+    import pyarrow.parquet as pq
+
+    columns = [column for column in pq.read_schema(shards[0]).names if column != target]
+    n, mean, m2 = 0, np.zeros(len(continuous)), np.zeros(len(continuous))
+    # The counts per target and value of every attribute, which grow when new values are found
+    counts = np.zeros((2,) + (0,) * len(attributes), dtype=np.int64)
+    for shard in shards:
+        for batch in pq.ParquetFile(shard).iter_batches(batch_size=batch_rows, columns=continuous + attributes + [target]):
+            x = np.stack([batch.column(column).to_numpy(zero_copy_only=False) for column in continuous], axis=1).astype(np.float64)
+            batch_n, batch_mean = len(x), x.mean(axis=0)
+            delta = batch_mean - mean
+            mean = mean + delta * batch_n / (n + batch_n)
+            m2 = m2 + ((x - batch_mean) ** 2).sum(axis=0) + delta ** 2 * n * batch_n / (n + batch_n)
+            n += batch_n
+
+            d = [batch.column(column).to_numpy(zero_copy_only=False).astype(np.int64) for column in attributes]
+            t = batch.column(target).to_numpy(zero_copy_only=False).astype(np.int64)
+            nr_values = [max(size, int(values.max()) + 1) for size, values in zip(counts.shape[1:], d)]
+            counts = np.pad(counts, [(0, 0)] + [(0, new - size) for size, new in zip(counts.shape[1:], nr_values)])
+            np.add.at(counts, (t, *d), 1)
+
+    # The sample variance, like pandas uses for the Adult dataset
+    var = m2 / max(n - 1, 1)
+    return {"columns": columns, "attribute": attributes, "attribute_values": list(counts.shape[1:]), "target": target,
+            "rows": n, "mean": dict(zip(continuous, mean.tolist())), "var": dict(zip(continuous, var.tolist())),
+            "attribute_counts": counts.reshape(2, -1).tolist()}
+
+def load_statistics(path: str, shards: list, attributes: list) -> dict:
+    """Loads the statistics from `path`, or computes them from the shards and saves them there first."""
+    if not os.path.exists(path):
+        statistics = compute_statistics(shards, attributes)
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(statistics, f)
+        os.replace(tmp_path, path)
+    with open(path) as f:
+        return json.load(f)
+
+
+class StreamingTabularDataset(data.IterableDataset):
+    def __init__(self, path: str, statistics: dict, shuffle_buffer: int = 0, seed: int = 0, split_processes: bool = True):
+        """Tabular dataset that is streamed from parquet shards, for tables that do not fit in memory. The data
+        points are the same as those of `AdultDataset`: the continuous columns are normalized with precomputed
+        statistics (see `compute_statistics`), and the attribute ratios of these statistics are used for `sample_d`.
+
+        The row groups of the shards are divided over the data loader workers, and with multiple processes every
+        process keeps an equal share of the rows of each row group. The order is randomized by shuffling the row
+        groups and a buffer of rows, with a seed that only depends on `seed` and the epoch (see `set_epoch`).
+
+        Args:
+            path (str): the directory containing the parquet shards.
+            statistics (dict): the statistics of the training data.
+            shuffle_buffer (int): the number of rows to shuffle the incoming rows with (0 keeps the order).
+            seed (int): the seed of the shuffling.
+            split_processes (bool): divide the rows over the distributed processes (otherwise all processes
+                see all rows).
+        """
+        import pyarrow.parquet as pq
+
+        self._shards = list_shards(path)
+        self._statistics = statistics
+        self._columns = statistics["columns"]
+        self._continuous = [self._columns.index(column) for column in statistics["mean"]]
+        self._mean = np.array(list(statistics["mean"].values()), dtype=np.float32)
+        self._var = np.array(list(statistics["var"].values()), dtype=np.float32)
+        # Statistics of a single attribute column from before the attributes could be combined
+        self.attribute_columns = statistics["attribute"] if isinstance(statistics["attribute"], list) else [statistics["attribute"]]
+        self.attribute = ",".join(self.attribute_columns)
+        self._attr_values = statistics.get("attribute_values", [len(statistics["attribute_counts"][0])])
+
+        # Every row group is a unit of work, such that the data can be divided over more workers than there are shards
+        self._units = []
+        for shard in self._shards:
+            metadata = pq.ParquetFile(shard).metadata
+            self._units += [(shard, i, metadata.row_group(i).num_rows) for i in range(metadata.num_row_groups)]
+        self._rows = sum(rows for _, _, rows in self._units)
+
+        self._counts = torch.Tensor(statistics["attribute_counts"])
+        counts = self._counts.sum(dim=0)
+        self._attr_dist = torch.distributions.Categorical(probs=counts / counts.sum())
+
+        self._shuffle_buffer = shuffle_buffer
+        self._seed = seed
+        self._split_processes = split_processes
+        self._epoch = 0
+
+    def set_epoch(self, epoch: int):
+        self._epoch = epoch
+
+    def sample_d(self, size: tuple) -> torch.Tensor:
+        return self._attr_dist.sample(size)
+
+    def attribute_counts(self, by_target: bool = False) -> torch.Tensor:
+        """Returns the number of data points per attribute value (per target value if `by_target` is set)."""
+        return self._counts.clone() if by_target else self._counts.sum(dim=0)
+
+    def datapoint_shape(self) -> torch.Tensor:
+        """Return the amount of elements in each x value
+
+        Returns:
+            int: the amount of elements in x
+        """
+        return torch.Size([len(self._columns)])
+
+    def nr_attr_values(self) -> int:
+        """Returns the number of possible values for the attribute of this dataset.
+
+        Returns:
+            int: the number of attributes
+        """
+        return self._counts.shape[1]
+
+    def _processes(self) -> tuple:
+        return (get_rank(), get_world_size()) if self._split_processes else (0, 1)
+
+    def __len__(self) -> int:
+        """Returns the (approximate) amount of datapoints of this process."""
+        return self._rows // self._processes()[1]
+
+    def _read(self, shard: str, row_group: int) -> tuple:
+        import pyarrow.parquet as pq
+
+        table = pq.ParquetFile(shard).read_row_group(row_group, columns=self._columns + [self._statistics["target"]])
+        x = np.stack([table.column(column).to_numpy() for column in self._columns], axis=1).astype(np.float32)
+        t = table.column(self._statistics["target"]).to_numpy().astype(np.float32)
+        d = encode_attributes(np.stack([table.column(column).to_numpy() for column in self.attribute_columns], axis=1),
+                              self._attr_values).astype(np.float32)
+        x[:, self._continuous] = (x[:, self._continuous] - self._mean) / self._var
+        return x, t, d
+
+    def __iter__(self):
+        worker = data.get_worker_info()
+        worker_id, nr_workers = (worker.id, worker.num_workers) if worker else (0, 1)
+        rank, world_size = self._processes()
+
+        # The row groups are shuffled the same way in all workers and processes, and then divided over the workers
+        units = self._units
+        if self._shuffle_buffer:
+            order = np.random.default_rng((self._seed, self._epoch)).permutation(len(units))
+            units = [units[i] for i in order]
+        units = units[worker_id::nr_workers]
+
+        # Every process keeps every world_size-th row, and at most the number of rows the other processes get
+        remaining = sum(rows for _, _, rows in units) // world_size
+        generator = np.random.default_rng((self._seed, self._epoch, rank, worker_id))
+        offset = 0
+        buffer = None
+        for shard, row_group, rows in units:
+            x, t, d = self._read(shard, row_group)
+            keep = (offset + np.arange(rows)) % world_size == rank
+            offset += rows
+            block = (x[keep], t[keep], d[keep])
+            buffer = block if buffer is None else tuple(np.concatenate([b, n]) for b, n in zip(buffer, block))
+
+            # Yield a random selection of the buffered rows, keeping `shuffle_buffer` rows to mix with the next row group
+            if len(buffer[0]) > self._shuffle_buffer:
+                order = generator.permutation(len(buffer[0])) if self._shuffle_buffer else np.arange(len(buffer[0]))
+                out, kept = order[:len(order) - self._shuffle_buffer], order[len(order) - self._shuffle_buffer:]
+                for i in out[:remaining]:
+                    yield torch.from_numpy(buffer[0][i]), torch.tensor(buffer[1][i]), torch.from_numpy(buffer[2][i:i + 1])
+                remaining -= min(len(out), remaining)
+                buffer = tuple(b[kept] for b in buffer)
+
+        if buffer is not None:
+            for i in generator.permutation(len(buffer[0]))[:remaining]:
+                yield torch.from_numpy(buffer[0][i]), torch.tensor(buffer[1][i]), torch.from_numpy(buffer[2][i:i + 1])
+
+
+def convert_csv(csv_path: str, output: str, rows_per_shard: int = 2**20, row_group_rows: int = 2**16):
+    """Converts a (preprocessed) csv file like those of the Adult dataset to parquet shards, reading it in chunks.
+
+    Args:
+        csv_path (str): the csv file, with the row index as the first column.
+        output (str): the directory to write the shards to.
+        rows_per_shard (int): the number of rows per shard.
+        row_group_rows (int): the number of rows per row group, the unit of work of the data loader workers.
+    """
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    os.makedirs(output, exist_ok=True)
+    for i, chunk in enumerate(pd.read_csv(csv_path, index_col=0, chunksize=rows_per_shard)):
+        pq.write_table(pa.Table.from_pandas(chunk, preserve_index=False), os.path.join(output, "part-{:05d}.parquet".format(i)),
+                       row_group_size=row_group_rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Converts a csv file of the Adult dataset to parquet shards.")
+    parser.add_argument('csv', type=str,
+                        help="The csv file to convert, e.g. data/adult/adult.data.")
+    parser.add_argument('output', type=str,
+                        help="The directory to write the shards to, e.g. data/adult_stream/train.")
+    parser.add_argument('--rows_per_shard', default=2**20, type=int)
+    parser.add_argument('--row_group_rows', default=2**16, type=int)
+    args = parser.parse_args()
+    convert_csv(args.csv, args.output, args.rows_per_shard, args.row_group_rows)
@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+import torch
+
+from evaluation import evalutaion_statistics, group_margins, abc
+
+
+def reference_statistics(predictions: torch.Tensor, targets: torch.Tensor, attributes: torch.Tensor, taus: np.ndarray) -> tuple:
+    """Straightforward implementation of the group specific accuracy-coverage and precision-coverage curves, one
+    group and one threshold at a time. Returns A_group, C_group, P_A_group and P_C_group like `evalutaion_statistics`."""
+    predictions = predictions.reshape(-1).double().numpy()
+    targets = targets.reshape(-1).double().numpy()
+    attributes = attributes.reshape(-1).numpy()
+    curves = ({}, {}, {}, {})
+    for group in np.unique(attributes):
+        in_group = attributes == group
+        for accuracies, coverages, selected in [(curves[0], curves[1], in_group),
+                                                (curves[2], curves[3], in_group & (np.round(predictions) == 1))]:
+            if not selected.any():
+                continue
+            p, t = predictions[selected], targets[selected]
+            confidence = np.maximum(p, 1 - p)
+            # A confidence of 1 gives an infinite margin, which is capped like in `margin`
+            with np.errstate(divide='ignore'):
+                margins = np.where(np.round(p) == t, 1, -1) * 0.5 * np.log(confidence / (1 - confidence))
+            margins = np.clip(margins, -20, 20)
+            accuracies[int(group)], coverages[int(group)] = [], []
+            for tau in taus:
+                correct = np.mean(margins > tau)
+                covered = np.mean(margins <= -tau) + correct
+                accuracies[int(group)].append(correct / covered if covered > 0 else 1.0)
+                coverages[int(group)].append(covered)
+    return curves
+
+
+def random_predictions(samples: int, groups: int, seed: int) -> tuple:
+    """Random predictions, including predictions of exactly 0, 0.5 and 1, with a last group without positive
+    predictions (if there is more than one group)."""
+    generator = torch.Generator().manual_seed(seed)
+    predictions = torch.rand(samples, 1, generator=generator, dtype=torch.float64)
+    predictions[:3, 0] = torch.tensor([0.0, 0.5, 1.0], dtype=torch.float64)
+    targets = torch.randint(0, 2, (samples, 1), generator=generator).double()
+    attributes = torch.randint(0, groups, (samples,), generator=generator)
+    if groups > 1:
+        predictions[attributes == groups - 1] *= 0.5
+    return predictions, targets, attributes
+
+
+@pytest.mark.parametrize("groups", [1, 2, 5])
+@pytest.mark.parametrize("seed", [0, 42])
+def test_statistics_match_reference(groups, seed):
+    predictions, targets, attributes = random_predictions(600, groups, seed)
+    _, abc_value, _, *curves = evalutaion_statistics(predictions, targets, attributes)
+
+    max_tau = np.abs(group_margins(predictions, targets, attributes)[0]).max()
+    expected = reference_statistics(predictions, targets, attributes, np.arange(0, max_tau, step=0.001))
+    for values, expected_values in zip(curves, expected):
+        assert values.keys() == expected_values.keys()
+        for group in values:
+            np.testing.assert_allclose(values[group], expected_values[group], rtol=0, atol=1e-9)
+    assert abc_value == pytest.approx(abc(expected[2], expected[3]), abs=1e-9)
+
+
+def test_precision_uses_positive_predictions():
+    # Group 0: two correct positive predictions (margins 0.5 ln 9) and a negative prediction that is left out of
+    # the precision. Group 1: a correct positive prediction (0.5 ln 9) and a wrong one (margin -0.5 ln 1.5).
+    # Group 2: a single correct positive prediction (margin 0.5 ln 7/3).
+    predictions = torch.tensor([[0.9], [0.9], [0.2], [0.9], [0.6], [0.7]])
+    targets = torch.tensor([[1.], [1.], [1.], [1.], [0.], [1.]])
+    attributes = torch.tensor([0, 0, 0, 1, 1, 2])
+
+    _, positive = group_margins(predictions, targets, attributes)[1:]
+    np.testing.assert_array_equal(positive, [True, True, False, True, True, True])
+
+    _, abc_value, _, _, _, P_A_group, P_C_group = evalutaion_statistics(predictions, targets, attributes)
+    # All thresholds are below the largest margin (0.5 ln 9), so group 0 has precision 1 at coverage 1 throughout.
+    # Group 1 has precision 0.5 at coverage 1 up to 0.5 ln 1.5, then precision 1 at coverage 0.5. Group 2 has
+    # precision 1 at coverage 1 up to 0.5 ln 7/3, then nothing is covered (precision 1 at coverage 0).
+    assert set(np.round(P_C_group[0], 6)) == {1.0} and set(P_A_group[0]) == {1.0}
+    assert set(np.round(P_C_group[1], 6)) == {1.0, 0.5} and P_A_group[1][0] == 0.5
+    assert set(np.round(P_C_group[2], 6)) == {1.0, 0.0}
+    # The curves only share coverage 1, where the gaps are |1 - 0.5|, |1 - 1| and |0.5 - 1|
+    assert abc_value == pytest.approx(1 / 3)
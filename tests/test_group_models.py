@@ -0,0 +1,32 @@
+import pytest
+import torch
+from torch import nn
+
+from model import GroupSpecificModels
+from train_model import get_optimizer, step_present_groups
+
+
+@pytest.mark.parametrize("optimizer", ["adam", "sgd"])
+def test_absent_groups_are_not_updated(optimizer):
+    torch.manual_seed(0)
+    models = GroupSpecificModels(8, 3)
+    group_optimizer = get_optimizer(models.parameters(), lr=0.1, optimizer=optimizer)
+    loss_module = nn.BCEWithLogitsLoss()
+
+    def step(d):
+        features, targets = torch.randn(len(d), 8), torch.randint(0, 2, (len(d),)).float()
+        group_optimizer.zero_grad()
+        loss_module(models(features, d), targets).backward()
+        step_present_groups(group_optimizer, models, d)
+
+    # A first step with all groups builds up momentum for all of them
+    step(torch.tensor([0, 1, 2, 0]))
+    weight, bias = models.weight.detach().clone(), models.bias.detach().clone()
+    state = {key: value.clone() for key, value in group_optimizer.state[models.weight].items()}
+
+    step(torch.tensor([0, 0, 2, 2]))
+    assert torch.equal(models.weight[1], weight[1]) and models.bias[1] == bias[1]
+    assert not torch.equal(models.weight[0], weight[0]) and not torch.equal(models.weight[2], weight[2])
+    for key, value in state.items():
+        if value.dim() > 0:
+            assert torch.equal(group_optimizer.state[models.weight][key][1], value[1])
@@ -4,15 +4,33 @@ import numpy as np
 from datetime import datetime
 
 import os
-from tqdm import tqdm
+import time
 import argparse
 
-from data import get_train_validation_set, get_test_set
-from model import FairClassifier
-from evaluation import *
-from torch.utils.tensorboard import SummaryWriter
+from data import get_train_validation_set, get_test_set, split_validation_set, ResumableSampler, IMAGE_RESOLUTION
+from model import FairClassifier, checkpoint_nr_attr_values
+from feature_cache import get_cached_set
+from distributed import is_distributed, is_main_process, get_rank, get_world_size, barrier, broadcast_object, gather_object, \
+    all_reduce_max, init_from_env, launch, wrap, unwrap, NullWriter
+from profiling import NullProfiler, StepProfiler
+from sampling import AttributeSampler
+from weights import set_weights_dir, bert_tokenizer
+from results import ResultsStore, DEFAULT_RESULTS_DB
+from autotune import tune, AUTOTUNE_CACHE
+from sample_cache import SharedSampleCache
+from checkpointing import training_state_path, best_model_path, get_rng_state, set_rng_state, save_training_state, load_training_state, \
+    warm_start_name, warm_start_path
+from evaluation import accuracy_coverage_auc, evalutaion_statistics, summarize_curves, plot_statistics
+
+_tokenizer = None
+
+def get_tokenizer():
+    """Loads the BERT tokenizer the first time it is needed, instead of whenever this module is imported."""
+    global _tokenizer
+    if _tokenizer is None:
+        _tokenizer = bert_tokenizer()
+    return _tokenizer
 
-# tokenizer = torch.hub.load('huggingface/pytorch-transformers', 'tokenizer', 'bert-base-uncased', return_dict=False)    # Download vocabulary from S3 and cache.
 def bert_collate(data_batch):
     x, t, d = [], [], []
     for modality, target, attribute in data_batch:
@@ -20,7 +38,7 @@ def bert_collate(data_batch):
         t.append(target)
         d.append(attribute)
 
-    bert_input = tokenizer(x, padding=True, truncation=True, return_tensors='pt')
+    bert_input = get_tokenizer()(x, padding=True, truncation=True, return_tensors='pt')
     return bert_input, torch.Tensor([t]).T, torch.Tensor([d]).T
 
 def set_seed(seed: int):
@@ -55,7 +73,38 @@ def get_optimizer(parameters, lr: float, optimizer: str) -> torch.optim.Optimize
         ValueError("The optimizer {} is not implemented.".format(optimizer))
     return opt
 
-def name_model(dataset: str, attribute: str, lr_f: float, lr_g: float, lr_j: float, lmbda: float, optim: str, seed: int) -> str:
+def step_present_groups(optimizer: torch.optim.Optimizer, group_specific_models: nn.Module, d: torch.Tensor):
+    """Steps the optimizer of the group specific models, but only changes the models of the groups in the batch (of
+    any process). The models are stacked in one weight matrix, so the rows of the other groups get a zero gradient
+    instead of none, with which Adam would still move them on their momentum. Their weights and optimizer state
+    (e.g. the moments of Adam) are restored after the step, like separate models without a gradient are skipped.
+
+    Args:
+        optimizer (torch.optim.Optimizer): the optimizer of the group specific models.
+        group_specific_models (nn.Module): the stacked group specific models.
+        d (torch.Tensor): the groups of the data points in the batch.
+    """
+    present = torch.zeros(len(group_specific_models), dtype=torch.int64, device=d.device)
+    present[d.reshape(-1).long()] = 1
+    absent = all_reduce_max(present) == 0
+    if not absent.any():
+        optimizer.step()
+        return
+
+    parameters = list(group_specific_models.parameters())
+    saved = [parameter.detach()[absent].clone() for parameter in parameters]
+    # The per group rows of the optimizer state (not e.g. the step count), which only exists after the first step
+    saved_state = [{key: value[absent].clone() for key, value in optimizer.state[parameter].items()
+                    if torch.is_tensor(value) and value.dim() > 0 and value.shape[0] == len(absent)} for parameter in parameters]
+    optimizer.step()
+    with torch.no_grad():
+        for parameter, values, state in zip(parameters, saved, saved_state):
+            parameter[absent] = values
+            for key, value in state.items():
+                optimizer.state[parameter][key][absent] = value
+
+def name_model(dataset: str, attribute: str, lr_f: float, lr_g: float, lr_j: float, lmbda: float, optim: str, seed: int,
+               frozen: bool = False) -> str:
     """Parse the training arguments into a filename 
     Returns:
         str: The name to use for logging and saving
@@ -63,12 +112,18 @@ def name_model(dataset: str, attribute: str, lr_f: float, lr_g: float, lr_j: flo
     # We are using the log10 to indicate the learning rate for learning rates ending in a 1
     lrs = [str(np.log10(lr))[:2] if int(str(lr)[-1]) == 1 else str(lr)[1:] for lr in [lr_f, lr_g, lr_j]]
     model = "{}_{}_{}{}{}_{}_{}_{}".format(dataset, attribute, *lrs, lmbda, optim, str(seed))
+    if frozen:
+        model += "_frozen"
     date = datetime.now().strftime("%b%d-%H:%M")
     return os.path.join(model, date)
 
 def train_model(model: nn.Module, train_loader: torch.utils.data.DataLoader, val_loader: torch.utils.data.DataLoader,
                 optimizer:str, lr_f: float, lr_g: float, lr_j: float, lmbda: float, epochs: int, checkpoint_name: str, 
-                device: torch.device, progress_bar: bool, writer: torch.utils.tensorboard.SummaryWriter) -> nn.Module:
+                device: torch.device, progress_bar: bool, writer: "SummaryWriter",
+                fused_backward: bool = False, save_every: int = 0, resume_state: dict = None, val_every: int = 2,
+                patience: int = 0, early_stopping_metric: str = "auc", profiler: NullProfiler = None,
+                d_tilde_condition: str = "none", warm_start: dict = None, snapshot_path: str = "",
+                resolution_schedule: list = None) -> nn.Module:
     """
     Trains a given model architecture for the specified hyperparameters.
 
@@ -80,132 +135,349 @@ def train_model(model: nn.Module, train_loader: torch.utils.data.DataLoader, val
         epochs: Number of epochs to train the model for.
         checkpoint_name: Filename to save the best model on validation to.
         device: Device to use for training.
+        fused_backward: Backpropagate L_R and L_0 in a single backward pass, instead of retaining the graph.
+            This is required for a DistributedDataParallel model, which synchronizes the gradients once per backward pass.
+        save_every: Save the training state (model, optimizers, position in the data and random states) every 
+            this many steps. 0 disables the periodic saving.
+        resume_state: A training state saved by an earlier run, from which the training is continued.
+        val_every: Validate every this many epochs (and after the last epoch).
+        patience: Stop when the validation metric has not improved for this many validations (0 never stops early).
+        early_stopping_metric: The validation metric that selects the best model ("acc" or "auc").
+        profiler: A StepProfiler that times the phases of every training step (off by default).
+        d_tilde_condition: Sample the attributes for the group agnostic model from their marginal distribution 
+            ("none"), or conditioned on the target ("target").
+        warm_start: A snapshot of a base model (see `snapshot_path`), from which the training continues at the 
+            epoch after the snapshot.
+        snapshot_path: Save the model and optimizer states after the last epoch there, to warm start other runs
+            (instead of saving the final model to `runs/<checkpoint_name>`).
+        resolution_schedule: The stages of progressive resizing of the images (see `parse_resolution_schedule`).
     Returns:
         model: Model that has performed best on the validation set.
     """
 
-    # Initialize the optimizer and loss function
-    group_specific_params = [param for gsm in model.group_specific_models for param in gsm.parameters()]
-    feature_extractor_params = model.featurizer.parameters()
-    joint_classifier_params = model.joint_classifier.parameters()
+    from tqdm import tqdm
+
+    # Initialize the optimizer and loss function (on the FairClassifier itself if it is wrapped for distributed training)
+    net = unwrap(model)
+    group_specific_params = list(net.group_specific_models.parameters())
+    feature_extractor_params = list(net.featurizer.parameters())
+    joint_classifier_params = net.joint_classifier.parameters()
 
     group_specific_optimizer = get_optimizer(group_specific_params, lr=lr_g, optimizer=optimizer)
-    feature_extractor_optimizer = get_optimizer(feature_extractor_params, lr=lr_f, optimizer=optimizer)
+    # A frozen featurizer without adapter has no parameters to optimize
+    feature_extractor_optimizer = get_optimizer(feature_extractor_params, lr=lr_f, optimizer=optimizer) if feature_extractor_params else None
     joint_classifier_optimizer = get_optimizer(joint_classifier_params, lr=lr_j, optimizer=optimizer)
 
     loss_module = nn.BCELoss()
+    profiler = profiler or NullProfiler()
+
+    # Samples d_tilde on the device, seeded from the seed of this process
+    attribute_sampler = AttributeSampler(train_loader.dataset.attribute_counts(by_target=d_tilde_condition == "target"),
+                                         device, seed=torch.initial_seed())
+
+    optimizers = {"group_specific": group_specific_optimizer, "feature_extractor": feature_extractor_optimizer,
+                  "joint_classifier": joint_classifier_optimizer}
+
+    def save_state(epoch: int, phase: str, batch: int, totals: tuple):
+        # The random states differ per process, so the main process saves those of all processes
+        rng_states = gather_object(get_rng_state())
+        attribute_sampler_states = gather_object(attribute_sampler.state_dict())
+        if is_main_process():
+            save_training_state(training_state_path(checkpoint_name), {
+                "model": net.state_dict(), "optimizers": {name: opt.state_dict() for name, opt in optimizers.items() if opt},
+                "epoch": epoch, "phase": phase, "batch": batch, "totals": totals, "step": step, "rng": rng_states,
+                "attribute_sampler": attribute_sampler_states, "checkpoint_name": checkpoint_name, "early_stopping": dict(early_stopping)})
+
+    # The best validation score so far, the epoch it was reached and the number of validations since then
+    early_stopping = {"best": None, "epoch": None, "bad": 0}
+
+    step, start_epoch = 0, 0
+    if resume_state:
+        net.load_state_dict(resume_state["model"])
+        for name, optimizer_state in resume_state["optimizers"].items():
+            optimizers[name].load_state_dict(optimizer_state)
+        step, start_epoch = resume_state["step"], resume_state["epoch"]
+        early_stopping.update(resume_state.get("early_stopping", {}))
+    elif warm_start:
+        net.load_state_dict(warm_start["model"])
+        for name, optimizer_state in warm_start["optimizers"].items():
+            optimizers[name].load_state_dict(optimizer_state)
+        step, start_epoch = warm_start["step"], warm_start["epoch"]
 
     # Training loop with validation after each epoch. Save the best model, and remember to use the lr scheduler.
-    for epoch in tqdm(range(epochs), position=0, desc="epoch", disable=progress_bar):
+    for epoch in tqdm(range(start_epoch, epochs), position=0, desc="epoch", disable=progress_bar):
         model.train()
+        if resolution_schedule:
+            # Progressive resizing: the images of this epoch are resized to the resolution of its stage, and loaded
+            # in batches of the size of the stage
+            _, size, stage_batch_size = resolution_stage(resolution_schedule, epoch)
+            train_loader.dataset.set_resolution(size)
+            if stage_batch_size != train_loader.batch_size:
+                train_loader = with_batch_size(train_loader, stage_batch_size)
+            writer.add_scalar("train/resolution", size, epoch)
         nr_batches = len(train_loader)
 
+        # In the first epoch after resuming, continue in the phase and at the batch where the state was saved
+        resuming = resume_state is not None and epoch == start_epoch
+        group_resume = resume_state if resuming and resume_state["phase"] == "group" else None
+        joint_resume = resume_state if resuming and resume_state["phase"] == "joint" else None
+
         # Group specific training
-        if lmbda:
-            group_correct, group_total = 0, 0
-            group_loss = 0
-            for i, (x, t, d) in enumerate(tqdm(train_loader, position=1, desc="group", leave=False, disable=progress_bar)):
-                x = x.to(device)
-                t = t.to(device)
-                d = d.to(device)
-                group_specific_optimizer.zero_grad()
-                pred_group_spe = model.group_forward(x, d)
+        if lmbda and not joint_resume:
+            group_correct, group_total, group_loss = group_resume["totals"] if group_resume else (0, 0, 0)
+            batches = start_pass(train_loader, 2 * epoch, group_resume)
+            for i, (x, t, d) in tqdm(profiler.wrap_loader(batches), total=nr_batches, position=1, desc="group", leave=False, disable=progress_bar):
+                with profiler.phase("to_device"):
+                    x = x.to(device)
+                    t = t.to(device)
+                    d = d.to(device)
+                with profiler.phase("optimizer"):
+                    group_specific_optimizer.zero_grad()
+
+                with profiler.phase("forward"):
+                    # Through the forward of the (possibly wrapped) model, such that the gradients are synchronized
+                    _, pred_group_spe, _ = model(x, d)
+                    L_D = loss_module(pred_group_spe, t.squeeze())
 
-                L_D = loss_module(pred_group_spe, t.squeeze())
-                L_D.backward()
+                with profiler.phase("backward_L_D"):
+                    L_D.backward()
 
-                group_specific_optimizer.step()
+                with profiler.phase("optimizer"):
+                    step_present_groups(group_specific_optimizer, net.group_specific_models, d)
 
-                group_correct += num_correct_predictions(pred_group_spe, t)
-                group_total += len(x)
-                group_loss += L_D
+                with profiler.phase("logging"):
+                    group_correct += num_correct_predictions(pred_group_spe, t)
+                    group_total += len(x)
+                    group_loss += L_D
 
-                writer.add_scalar("train/batch/L_D", L_D, i + epoch * nr_batches)
+                    writer.add_scalar("train/batch/L_D", L_D, i + epoch * nr_batches)
+
+                step += 1
+                if save_every and step % save_every == 0:
+                    with profiler.phase("checkpoint"):
+                        save_state(epoch, "group", i + 1, (group_correct, group_total, float(group_loss)))
+                profiler.end_step("group", step)
 
             writer.add_scalar("train/L_D", group_loss, epoch)
             writer.add_scalar("train/group_acc", group_correct / group_total, epoch)
 
         # Feature extractor and joint classifier trainer
-        joint_correct, joint_total = 0, 0
-        L_0_total, L_R_total = 0, 0
-        for i, (x, t, d) in enumerate(tqdm(train_loader, position=1, desc="joint", leave=False, disable=progress_bar)):
-            x = x.to(device)
-            t = t.to(device)
-            d = d.to(device)
-            # Sample d values for the group agnostic model
-            d_tilde = train_loader.dataset.sample_d(d.shape)
-
-            # Get model predictions
-            pred_joint, pred_group_spe, pred_group_agn = model.forward(x, d, d_tilde)
-
-            # Calculate L_0 and L_R (group agnostic and specific are flipped because of the negative sign in BCELoss
-            # and because if this sign goes in front of Eq. 17, the losses should be flipped)
-            L_R = lmbda * (loss_module(pred_group_agn, t) - loss_module(pred_group_spe, t))
-
-            # Add L_R to the feature extractor gradients (but not to the joint classifier)
-            feature_extractor_optimizer.zero_grad()
-            group_specific_optimizer.zero_grad()
-            L_R.backward(retain_graph=True)
-            joint_classifier_optimizer.zero_grad()
-            
-            # Add L_0 to both the feature extractor and joint classifier gradients
-            L_0 = loss_module(pred_joint, t)
-            L_0.backward()
+        joint_correct, joint_total, L_0_total, L_R_total = joint_resume["totals"] if joint_resume else (0, 0, 0, 0)
+        batches = start_pass(train_loader, 2 * epoch + 1, joint_resume)
+        attribute_sampler.set_epoch(epoch)
+        if joint_resume and "attribute_sampler" in joint_resume:
+            attribute_sampler.load_state_dict(joint_resume["attribute_sampler"][get_rank()])
+        for i, (x, t, d) in tqdm(profiler.wrap_loader(batches), total=nr_batches, position=1, desc="joint", leave=False, disable=progress_bar):
+            with profiler.phase("to_device"):
+                x = x.to(device)
+                t = t.to(device)
+                d = d.to(device)
+
+            with profiler.phase("sample_d"):
+                # Sample d values for the group agnostic model
+                d_tilde = attribute_sampler.sample(len(d), condition=t)
+
+            with profiler.phase("forward"):
+                # Get model predictions
+                pred_joint, pred_group_spe, pred_group_agn = model(x, d, d_tilde)
+
+                # Calculate L_0 and L_R (group agnostic and specific are flipped because of the negative sign in BCELoss
+                # and because if this sign goes in front of Eq. 17, the losses should be flipped)
+                L_R = lmbda * (loss_module(pred_group_agn, t) - loss_module(pred_group_spe, t))
+                L_0 = loss_module(pred_joint, t)
+
+            with profiler.phase("optimizer"):
+                if feature_extractor_optimizer:
+                    feature_extractor_optimizer.zero_grad()
+                group_specific_optimizer.zero_grad()
+            if fused_backward:
+                # L_R does not depend on the joint classifier, so a single backward pass of the summed losses gives the
+                # same gradients, without keeping (or with checkpointing, recomputing) the graph for a second pass
+                with profiler.phase("optimizer"):
+                    joint_classifier_optimizer.zero_grad()
+                with profiler.phase("backward_L_R+L_0"):
+                    (L_R + L_0).backward()
+            else:
+                # Add L_R to the feature extractor gradients (but not to the joint classifier)
+                with profiler.phase("backward_L_R"):
+                    L_R.backward(retain_graph=True)
+                with profiler.phase("optimizer"):
+                    joint_classifier_optimizer.zero_grad()
+
+                # Add L_0 to both the feature extractor and joint classifier gradients
+                with profiler.phase("backward_L_0"):
+                    L_0.backward()
 
             # Update the classifier and feature extractor
-            joint_classifier_optimizer.step()
-            feature_extractor_optimizer.step()
-            
-            joint_correct += num_correct_predictions(pred_joint, t)
-            joint_total += len(x)
+            with profiler.phase("optimizer"):
+                joint_classifier_optimizer.step()
+                if feature_extractor_optimizer:
+                    feature_extractor_optimizer.step()
             
-            L_0_total += L_0
-            L_R_total += L_R
+            with profiler.phase("logging"):
+                joint_correct += num_correct_predictions(pred_joint, t)
+                joint_total += len(x)
+
+                L_0_total += L_0
+                L_R_total += L_R
+
+                writer.add_scalar("train/batch/L_0", L_0, i + epoch * nr_batches)
+                writer.add_scalar("train/batch/L_R", L_R, i + epoch * nr_batches)
+
+            step += 1
+            if save_every and step % save_every == 0:
+                with profiler.phase("checkpoint"):
+                    save_state(epoch, "joint", i + 1, (joint_correct, joint_total, float(L_0_total), float(L_R_total)))
+            profiler.end_step("joint", step)
 
-            writer.add_scalar("train/batch/L_0", L_0, i + epoch * nr_batches)
-            writer.add_scalar("train/batch/L_R", L_R, i + epoch * nr_batches)
-        
         writer.add_scalar("train/joint_acc", joint_correct / joint_total, epoch)
         writer.add_scalar("train/L_0", L_0_total, epoch)
         writer.add_scalar("train/L_R", L_R_total, epoch)
+        profiler.end_epoch(epoch)
+        if isinstance(train_loader.dataset, SharedSampleCache):
+            for name, value in train_loader.dataset.statistics().items():
+                writer.add_scalar("sample_cache/" + name, value, epoch)
         
-        if val_loader and epoch % 2 == 0:
-            predictions = []
-            targets = []
-            with torch.no_grad():
-                model.eval()
+        if val_loader and (epoch % val_every == 0 or epoch == epochs - 1):
+            # Only the main process validates and keeps track of the best model
+            stop = False
+            if is_main_process():
+                # The validation set can share the dataset object with the training set, and is validated at full resolution
+                if resolution_schedule:
+                    val_loader.dataset.set_resolution(IMAGE_RESOLUTION)
+                val_acc, val_auc = validate(net, val_loader, device, progress_bar)
+                writer.add_scalar("val/acc", val_acc, epoch)
+                writer.add_scalar("val/auc", val_auc, epoch)
+
+                score = {"acc": val_acc, "auc": val_auc}[early_stopping_metric]
+                if early_stopping["best"] is None or score > early_stopping["best"]:
+                    early_stopping.update(best=score, epoch=epoch, bad=0)
+                    os.makedirs(os.path.dirname(best_model_path(checkpoint_name)), exist_ok=True)
+                    torch.save(net.state_dict(), best_model_path(checkpoint_name))
+                else:
+                    early_stopping["bad"] += 1
+                stop = patience > 0 and early_stopping["bad"] >= patience
+
+            # All processes stop at the same epoch
+            if broadcast_object(stop):
+                if is_main_process():
+                    print("Stopping early after epoch {}, the best {} was reached in epoch {}".format(
+                        epoch, early_stopping_metric, early_stopping["epoch"]))
+                break
+    
+    profiler.close()
 
-                for x, t, d in tqdm(val_loader, desc="val", leave=False, disable=progress_bar):
-                    x = x.to(device)
-                    t = t.to(device)
-                    d = d
+    if snapshot_path and is_main_process():
+        save_training_state(snapshot_path, {"model": net.state_dict(), "epoch": epochs, "step": step,
+                                            "optimizers": {name: opt.state_dict() for name, opt in optimizers.items() if opt}})
+
+    # Save best model and return it.
+    if is_main_process():
+        if early_stopping["best"] is not None:
+            net.load_state_dict(torch.load(best_model_path(checkpoint_name), map_location=device))
+            writer.add_scalar("val/best_" + early_stopping_metric, early_stopping["best"], early_stopping["epoch"])
+        # The model of a snapshot is only used to warm start other runs, from the snapshot itself
+        if not snapshot_path:
+            torch.save(net.state_dict(), os.path.join("runs", checkpoint_name))
+    return net
+
+def validate(model: nn.Module, val_loader: torch.utils.data.DataLoader, device: torch.device, progress_bar: bool) -> tuple:
+    """Computes the accuracy and the area under the accuracy-coverage curve on the validation set.
+
+    Returns:
+        tuple: the validation accuracy and AUC.
+    """
+    from tqdm import tqdm
 
-                    p, _, _ = model.forward(x)
+    predictions = []
+    targets = []
+    with torch.no_grad():
+        model.eval()
+        for x, t, _ in tqdm(val_loader, desc="val", leave=False, disable=progress_bar):
+            p, _, _ = model(x.to(device))
 
-                    p = p.cpu().unsqueeze(dim=-1)
-                    t = t.cpu().unsqueeze(dim=-1)
-                    d = d.cpu()
+            # Save predictions and targets for further evaluation
+            predictions.append(p.cpu().reshape(-1, 1))
+            targets.append(t.reshape(-1, 1))
 
-                    # Save predictions and targets for further evaluation
-                    predictions.append(p)
-                    targets.append(t)
+    predictions = torch.cat(predictions)
+    targets = torch.cat(targets)
 
-            predictions = torch.cat(predictions)
-            targets = torch.cat(targets)
+    val_acc = num_correct_predictions(predictions, targets) / len(predictions)
+    return val_acc, accuracy_coverage_auc(predictions, targets)
 
-            val_acc = num_correct_predictions(predictions, targets) / len(predictions)
-            writer.add_scalar("val/acc", val_acc, epoch)
-    
-    # Save best model and return it.
-    torch.save(model.state_dict(), os.path.join("runs", checkpoint_name))
-    return model
+def parse_resolution_schedule(schedule: str, epochs: int, batch_size: int) -> list:
+    """Parses a progressive resizing schedule like "128:4,176:4,224": the images are resized to 128x128 in the first 
+    4 epochs, to 176x176 in the next 4, and to the full 224x224 in the remaining epochs. The batch size of every stage
+    is scaled with the number of pixels per image, such that a batch takes about as much memory and compute as one of
+    `batch_size` images at full resolution.
+
+    Returns:
+        list: the first epoch, the resolution and the batch size of every stage.
+    """
+    stages, start = [], 0
+    parts = schedule.split(",")
+    for part in parts[:-1]:
+        size, stage_epochs = [int(value) for value in part.split(":")]
+        stages.append((start, size, max(1, int(batch_size * (IMAGE_RESOLUTION / size) ** 2))))
+        start += stage_epochs
+    if int(parts[-1]) != IMAGE_RESOLUTION:
+        raise ValueError("The last stage of the resolution schedule should be the full resolution {}, as the test set".format(IMAGE_RESOLUTION))
+    if start >= epochs:
+        raise ValueError("The resolution schedule leaves no epochs at the full resolution ({} of {} epochs)".format(start, epochs))
+    return stages + [(start, IMAGE_RESOLUTION, batch_size)]
+
+def resolution_stage(schedule: list, epoch: int) -> tuple:
+    """Returns the stage of a resolution schedule (see `parse_resolution_schedule`) that contains the epoch."""
+    return [stage for stage in schedule if stage[0] <= epoch][-1]
+
+def with_batch_size(loader: torch.utils.data.DataLoader, batch_size: int) -> torch.utils.data.DataLoader:
+    """Returns a data loader like `loader`, with another batch size."""
+    prefetch_kwargs = {"prefetch_factor": loader.prefetch_factor} if loader.num_workers else {}
+    return torch.utils.data.DataLoader(loader.dataset, batch_size=batch_size, sampler=loader.sampler, num_workers=loader.num_workers,
+                                       collate_fn=loader.collate_fn, drop_last=loader.drop_last, pin_memory=loader.pin_memory,
+                                       **prefetch_kwargs)
+
+def set_sampler_epoch(loader: torch.utils.data.DataLoader, epoch: int):
+    """Gives a (distributed or resumable) sampler, or a streaming dataset that shuffles itself, a new seed for every
+    pass, such that the order of a pass only depends on the seed and the pass number, and all processes shuffle the
+    same way."""
+    if isinstance(loader.sampler, torch.utils.data.DistributedSampler):
+        loader.sampler.set_epoch(epoch)
+    elif isinstance(loader.dataset, torch.utils.data.IterableDataset) and hasattr(loader.dataset, "set_epoch"):
+        loader.dataset.set_epoch(epoch)
+
+def start_pass(loader: torch.utils.data.DataLoader, pass_nr: int, resume_state: dict = None):
+    """Starts a pass over the training data. When resuming, the batches that were already trained on in this pass
+    are skipped and the random states are restored.
+
+    Returns:
+        enumerate: the batches in this pass with their batch number.
+    """
+    set_sampler_epoch(loader, pass_nr)
+    start_batch = resume_state["batch"] if resume_state else 0
+    streaming = isinstance(loader.dataset, torch.utils.data.IterableDataset)
+    if start_batch and not streaming:
+        loader.sampler.set_start(start_batch * loader.batch_size)
+    iterator = iter(loader)
+
+    # A streaming dataset cannot start partway through, but its order is fixed, so the trained batches are read again
+    if start_batch and streaming:
+        for _ in range(start_batch):
+            next(iterator)
+
+    # Creating the iterator draws from the random number generator, so the saved state is restored afterwards
+    if resume_state:
+        set_rng_state(resume_state["rng"][get_rank()])
+    return enumerate(iterator, start=start_batch)
 
 def num_correct_predictions(predictions: torch.Tensor, targets: torch.Tensor) -> int:
     pred = (predictions > 0.5).long()
     correct = (pred == targets).sum()
     return correct.item()
 
-def test_model(model: nn.Module, test_loader: torch.utils.data.DataLoader, device: torch.device, seed: int, progress_bar: bool) -> float:
+def test_model(model: nn.Module, test_loader: torch.utils.data.DataLoader, device: torch.device, seed: int, progress_bar: bool,
+               plots: bool = False) -> tuple:
     """
     Tests a trained model on the test set.
 
@@ -215,9 +487,13 @@ def test_model(model: nn.Module, test_loader: torch.utils.data.DataLoader, devic
         batch_size: Batch size to use in the test.
         device: Device to use for training.
         seed: The seed to set before testing to ensure a reproducible test.
+        plots: Also plot the margins and the precision-coverage and accuracy-coverage curves of the groups.
     Returns:
-        test_results: The average accuracy on the test set (independent of the attribute).
+        test_results: The average accuracy on the test set (independent of the attribute), the area under the
+            accuracy-coverage curve, the area between the precision-coverage curves, a summary of the group 
+            specific curves, and a dictionary with the figures (empty without `plots`).
     """
+    from tqdm import tqdm
 
     set_seed(seed)
 
@@ -252,14 +528,20 @@ def test_model(model: nn.Module, test_loader: torch.utils.data.DataLoader, devic
     # Compute overal margin and AUC statistics
     area_under_curve, area_between_curves_val, M_group, A_group, C_group, P_A_group, P_C_group = evalutaion_statistics(predictions, targets, attributes)
 
-    margin_plot = plot_margin_group(M_group)
-    precision_plot = accuracy_coverage_plot(P_A_group, P_C_group, 'precision')
-    ac_plot = accuracy_coverage_plot(A_group, C_group, 'accuracy')
+    curves = summarize_curves(A_group, C_group, P_A_group, P_C_group)
+    figures = plot_statistics(M_group, A_group, C_group, P_A_group, P_C_group) if plots else {}
 
-    return test_acc,area_under_curve, area_between_curves_val, margin_plot, precision_plot, ac_plot
+    return test_acc, area_under_curve, area_between_curves_val, curves, figures
 
 def main(checkpoint: str, dataset: str, attribute: str, num_workers: int, optimizer: str,lr_f: float, lr_g: float, lr_j: float, lmbda: float,
-        batch_size: int, epochs: int, seed: int, dataset_root:str, progress_bar: bool):
+        batch_size: int, epochs: int, seed: int, dataset_root:str, progress_bar: bool, freeze_featurizer: bool = False,
+        adapter: bool = False, feature_cache: str = "cache", checkpoint_segments: int = 0, world_size: int = 1,
+        save_every: int = 0, resume: str = "", val_every: int = 2, val_fraction: float = 0.0, patience: int = 0,
+        early_stopping_metric: str = "auc", profile: bool = False, profile_trace_start: int = 0, profile_trace_steps: int = 0,
+        d_tilde_condition: str = "none", compact_tabular: bool = False, weights_dir: str = "",
+        results_db: str = DEFAULT_RESULTS_DB, single_channel: bool = False, warm_start_epochs: int = 0, autotune: bool = False,
+        autotune_batch_sizes: str = "", autotune_cache: str = AUTOTUNE_CACHE, resolution_schedule: str = "",
+        sample_cache_mb: int = 0):
     """
     Function that summarizes the training and testing of a model.
 
@@ -272,53 +554,212 @@ def main(checkpoint: str, dataset: str, attribute: str, num_workers: int, optimi
         test_results: Dictionary containing an overview of the accuracies achieved on the different
                       corruption functions and the plain test set.
     """
-    device = torch.device("cuda:0") if torch.cuda.is_available() else torch.device("cpu")
+    # Resolve the pretrained backbones from a local directory (in the started processes too)
+    if weights_dir:
+        set_weights_dir(weights_dir)
+
+    if resolution_schedule and (dataset not in ("celeba", "chexpert") or freeze_featurizer):
+        raise ValueError("A resolution schedule needs the images of celeba or chexpert (and not cached features)")
+    if autotune and (world_size > 1 or is_distributed()):
+        raise ValueError("--autotune times the data loading and threads of a single process, and cannot be used with distributed training")
+
+    # Data parallel training: either start the processes here, or join the process group when started by torchrun
+    if world_size > 1 and not is_distributed():
+        launch(main, world_size, dict(locals()))
+        return
+    init_from_env()
+    distributed = is_distributed()
+
+    if warm_start_epochs and not 0 < warm_start_epochs < epochs:
+        raise ValueError("The warm start ({} epochs) should be shorter than the training ({} epochs)".format(warm_start_epochs, epochs))
+
+    # Distributed training uses gloo on the CPU
+    device = torch.device("cuda:0") if torch.cuda.is_available() and not distributed else torch.device("cpu")
     torch.multiprocessing.set_sharing_strategy('file_system')
     collate_fn = bert_collate if dataset == "civil" else None
     set_seed(seed)
 
-    print("Training on ", device)
+    from torch.utils.tensorboard import SummaryWriter
+
+    # Only the main process shows progress and logs
+    progress_bar = progress_bar or not is_main_process()
+    make_writer = lambda log_dir: SummaryWriter(log_dir=log_dir) if is_main_process() else NullWriter()
+
+    if is_main_process():
+        print("Training on ", device, "with {} processes".format(world_size) if distributed else "")
 
     # Check if the given configuration has been trained before
-    if checkpoint:
+    resume_state = None
+    if resume:
+        # Continue the interrupted run under its original name
+        resume_state = load_training_state(resume)
+        checkpoint_name = resume_state["checkpoint_name"]
+        checkpoint_path = os.path.join("runs", checkpoint_name)
+    elif checkpoint:
         checkpoint_name = os.path.split(checkpoint)[-1]
         checkpoint_path = checkpoint
     else:
-        checkpoint_name = name_model(dataset, attribute, lr_f, lr_g, lr_j, lmbda, optimizer, seed) + '.pt'
+        checkpoint_name = broadcast_object(name_model(dataset, attribute, lr_f, lr_g, lr_j, lmbda, optimizer, seed, freeze_featurizer) + '.pt')
         checkpoint_path = os.path.join("runs", checkpoint_name)
 
-    writer = SummaryWriter(log_dir=os.path.join("runs", checkpoint_name[:-3]))
-    hparams = {"data": dataset, "attr": attribute, "opt": optimizer, "lr_f": lr_f, "lr_g": lr_g, "lr_j": lr_j, "seed": seed, "lambda": lmbda}
+    hparams = {"data": dataset, "attr": attribute, "opt": optimizer, "lr_f": lr_f, "lr_g": lr_g, "lr_j": lr_j, "seed": seed, "lambda": lmbda,
+               "frozen": freeze_featurizer, "adapter": adapter, "world_size": world_size}
+    timings = {}
+
+    # In the frozen featurizer mode the backbone features of each split are computed once and cached on disk
+    def cached(split, split_set):
+        # With multiple processes the main process computes a missing cache, while the others wait for it
+        if is_main_process():
+            get_cached_set(dataset, split, split_set, feature_cache, batch_size, num_workers, device, collate_fn, progress_bar,
+                           single_channel)
+        barrier()
+        return get_cached_set(dataset, split, split_set, feature_cache, batch_size, num_workers, device, collate_fn, progress_bar,
+                              single_channel)
+
+    # The training state is only used to continue an unfinished run, never silently ignored
+    if resume_state is not None and os.path.exists(checkpoint_path):
+        raise ValueError("The run of {} has already finished, its final model is {}. Remove it to continue training from "
+                         "the training state instead".format(resume, checkpoint_path))
 
     if os.path.exists(checkpoint_path):
         # Create dummy model and load the trained model from disk
-        print("Found model", checkpoint_path)
-        model = FairClassifier(dataset, nr_attr_values=10).to(device)
-        model.load_state_dict(torch.load(checkpoint_path, map_location=device), strict=False)
+        if is_main_process():
+            print("Found model", checkpoint_path)
+        state_dict = torch.load(checkpoint_path, map_location=device)
+        model = FairClassifier(dataset, nr_attr_values=checkpoint_nr_attr_values(state_dict), frozen_featurizer=freeze_featurizer,
+                               adapter=adapter, compact_tabular=compact_tabular, pretrained=False,
+                               single_channel=single_channel).to(device)
+        model.load_state_dict(state_dict, strict=False)
         model.to(device)
     else:
         # Load the dataset with the given parameters, initialize the model and start training
-        writer = SummaryWriter(log_dir=os.path.join("runs", checkpoint_name[:-3]))
-        train_set, val_set = get_train_validation_set(dataset, root=dataset_root, attribute=attribute)
-        train_loader = torch.utils.data.DataLoader(train_set, batch_size=batch_size, shuffle=True, num_workers=num_workers, collate_fn=collate_fn, drop_last=True)
-        val_loader = torch.utils.data.DataLoader(train_set, batch_size=batch_size, shuffle=True, num_workers=num_workers, collate_fn=collate_fn) if val_set else None
-
-        model = FairClassifier(dataset, nr_attr_values=train_set.nr_attr_values()).to(device)
+        writer = make_writer(os.path.join("runs", checkpoint_name[:-3]))
+        train_set, val_set = get_train_validation_set(dataset, root=dataset_root, attribute=attribute, compact_tabular=compact_tabular,
+                                                      seed=seed, single_channel=single_channel)
+        streaming = isinstance(train_set, torch.utils.data.IterableDataset)
+        if freeze_featurizer:
+            train_set = cached("train", train_set)
+            val_set = cached("valid", val_set) if val_set else None
+        if val_set is None and val_fraction > 0 and streaming:
+            raise ValueError("A validation set cannot be split off a streaming dataset")
+        if val_set is None and val_fraction > 0:
+            train_set, val_set = split_validation_set(train_set, val_fraction)
+
+        def make_model(pretrained: bool) -> nn.Module:
+            model = FairClassifier(dataset, nr_attr_values=train_set.nr_attr_values(), frozen_featurizer=freeze_featurizer, adapter=adapter,
+                                   checkpoint_segments=checkpoint_segments, compact_tabular=compact_tabular,
+                                   pretrained=pretrained, single_channel=single_channel).to(device)
+            if distributed:
+                model = wrap(model)
+                # The parameters are synchronized by the wrapper, but every process should sample its own d_tilde values
+                set_seed(seed + get_rank())
+            return model
+
+        # Use the fastest data loading, threading and batch size settings for this machine and model (cached per host)
+        pin_memory, prefetch_kwargs = False, {}
+        if autotune:
+            batch_sizes = [int(size) for size in autotune_batch_sizes.split(",")] if autotune_batch_sizes else [batch_size]
+            # Trials of the training steps of this run, with the group specific pass only if lambda is not 0
+            training = {"optimizer": optimizer, "lr_f": lr_f, "lr_g": lr_g, "lr_j": lr_j, "lmbda": lmbda,
+                        "d_tilde_condition": d_tilde_condition, "fused_backward": checkpoint_segments > 0}
+            key = "{}_{}_frozen{}_adapter{}_compact{}_channels{}_segments{}_{}_{}_grouppass{}".format(
+                dataset, attribute, freeze_featurizer, adapter, compact_tabular, 1 if single_channel else 3, checkpoint_segments,
+                optimizer, device.type, bool(lmbda))
+            tuned = tune(key, make_model(pretrained=False), train_set, collate_fn, device, num_workers, batch_sizes, training,
+                         cache_path=autotune_cache)
+            num_workers, batch_size, pin_memory = tuned["num_workers"], tuned["batch_size"], tuned["pin_memory"]
+            prefetch_kwargs = {"prefetch_factor": tuned["prefetch_factor"]} if num_workers else {}
+            torch.set_num_threads(tuned["num_threads"])
+            hparams.update(batch_size=batch_size, num_workers=num_workers, num_threads=tuned["num_threads"])
+            # The same initialization and data order as without tuning
+            set_seed(seed)
+
+        # Keep the transformed samples of the first pass in shared memory, for the workers of the later passes
+        if sample_cache_mb:
+            if streaming:
+                raise ValueError("The samples of a streaming dataset cannot be cached, it reads every shard once per epoch")
+            train_set = SharedSampleCache(train_set, sample_cache_mb * 2**20)
+
+        # Each process trains on its own part of every (identically shuffled) pass over the data, in an order that 
+        # only depends on the seed, such that an interrupted run can be resumed
+        # (a streaming dataset divides and shuffles the data itself)
+        train_sampler = None if streaming else ResumableSampler(train_set, num_replicas=get_world_size(), rank=get_rank(),
+                                                                shuffle=True, seed=seed, drop_last=True)
+        train_loader = torch.utils.data.DataLoader(train_set, batch_size=batch_size, sampler=train_sampler, num_workers=num_workers,
+                                                   collate_fn=collate_fn, drop_last=True, pin_memory=pin_memory, **prefetch_kwargs)
+        val_loader = torch.utils.data.DataLoader(val_set, batch_size=batch_size, num_workers=num_workers, collate_fn=collate_fn,
+                                                 pin_memory=pin_memory, **prefetch_kwargs) if val_set else None
+
+        resolution_stages = None
+        if resolution_schedule:
+            resolution_stages = parse_resolution_schedule(resolution_schedule, epochs, batch_size)
+            hparams["resolution_schedule"] = resolution_schedule
+
+        # With a warm start, the first epochs (without the fairness regularizer) are trained once for all values of 
+        # lambda: the runs of a sweep continue from a snapshot of this base model after warm_start_epochs epochs
+        warm_start = None
+        if warm_start_epochs:
+            # The schedule of the run: lambda 0 up to warm_start_epochs (in the shared base model), lmbda afterwards
+            base_config = {key: value for key, value in hparams.items() if key not in ["lambda", "num_workers", "num_threads"]}
+            base_config.update(warm_start_epochs=warm_start_epochs, batch_size=batch_size, val_fraction=val_fraction,
+                               compact_tabular=compact_tabular, single_channel=single_channel, dataset_root=dataset_root)
+            hparams.update(warm_start_epochs=warm_start_epochs, warm_start=warm_start_name(base_config))
+        if warm_start_epochs and resume_state is None:
+            base_name = hparams["warm_start"]
+            base_path = warm_start_path(base_name)
+            if not broadcast_object(os.path.exists(base_path)):
+                if is_main_process():
+                    print("Training the warm start base model", base_name)
+                base_writer = make_writer(os.path.dirname(base_path))
+                train_model(make_model(pretrained=True), train_loader, None, optimizer, lr_f, lr_g, lr_j, 0, warm_start_epochs,
+                            os.path.join("warm_start", base_name + ".pt"), device, progress_bar, base_writer,
+                            fused_backward=checkpoint_segments > 0 or distributed, d_tilde_condition=d_tilde_condition,
+                            snapshot_path=base_path, resolution_schedule=resolution_stages)
+                base_writer.close()
+                barrier()
+            elif is_main_process():
+                print("Continuing from the warm start base model", base_name)
+            warm_start = load_training_state(base_path)
+            set_seed(seed + get_rank())
+
+        model = make_model(pretrained=resume_state is None and warm_start is None)
+        # The profiler only runs on the main process
+        profiler = None
+        if profile and is_main_process():
+            profiler = StepProfiler(writer, device, os.path.join("runs", checkpoint_name[:-3], "trace"), profile_trace_start, profile_trace_steps)
+        start = time.perf_counter()
         model = train_model(model, train_loader, val_loader, optimizer, lr_f, lr_g, lr_j, lmbda, epochs,
-                            checkpoint_name, device, progress_bar, writer)
+                            checkpoint_name, device, progress_bar, writer, fused_backward=checkpoint_segments > 0 or distributed,
+                            save_every=save_every, resume_state=resume_state, val_every=val_every, patience=patience,
+                            early_stopping_metric=early_stopping_metric, profiler=profiler,
+                            d_tilde_condition=d_tilde_condition, warm_start=warm_start, resolution_schedule=resolution_stages)
+        timings["train_seconds"] = time.perf_counter() - start
         writer.close()
-    
+
+    test_set = get_test_set(dataset, dataset_root, compact_tabular=compact_tabular, attribute=attribute, single_channel=single_channel)
+    if freeze_featurizer:
+        test_set = cached("test", test_set)
+
+    # The test set is evaluated by the main process only
+    if not is_main_process():
+        return
+
     writer = SummaryWriter(log_dir=os.path.join("runs_eval", checkpoint_name[:-3]))
-    test_set = get_test_set(dataset, dataset_root)
     test_loader = torch.utils.data.DataLoader(test_set, batch_size=batch_size, num_workers=num_workers)
-    test_acc, area_under_curve, area_between_curves_val, margin_plot, precision_plot, ac_plot = test_model(model, test_loader, device, seed, progress_bar)
+    start = time.perf_counter()
+    test_acc, area_under_curve, area_between_curves_val, curves, figures = test_model(model, test_loader, device, seed, progress_bar, plots=True)
+    timings["test_seconds"] = time.perf_counter() - start
 
     writer.add_hparams(hparams, {"acc": test_acc, "auc": area_under_curve, "abc": area_between_curves_val}) 
-    writer.add_figure('margin', margin_plot)
-    writer.add_figure('precision', precision_plot)
-    writer.add_figure('accuracy', ac_plot)
+    for name, figure in figures.items():
+        writer.add_figure(name, figure)
     writer.close()
 
+    if results_db:
+        with ResultsStore(results_db) as store:
+            store.append("train", checkpoint_name[:-3], hparams, {"acc": test_acc, "auc": area_under_curve, "abc": area_between_curves_val},
+                         timings, curves)
+
 if __name__ == '__main__':
     # Command line arguments
     parser = argparse.ArgumentParser()
@@ -331,7 +772,8 @@ if __name__ == '__main__':
                         help='Name of the dataset to evaluate on.')
     parser.add_argument('--attribute', default="", type=str,
                         help='The sensitive attribute to use during training. \
-                            If empty the default dataset specific attribute will be used.')
+                            If empty the default dataset specific attribute will be used. Multiple comma separated \
+                            attributes (e.g. sex,race) give a group for every combination of their values.')
     parser.add_argument('--num_workers', default=3, type=int,
                         help='The amount of threads for the data loader object.')
     
@@ -346,6 +788,9 @@ if __name__ == '__main__':
                         help='Learning rate to use for the joint classifier.')
     parser.add_argument('--lmbda', default=0.7, type=float,
                         help='The factor to multiply the regularization loss with, before backpropagating.')
+    parser.add_argument('--d_tilde_condition', default="none", type=str, choices=["none", "target"],
+                        help='Sample the random attributes of the group agnostic model from their marginal distribution, \
+                            or from their distribution given the target.')
     parser.add_argument('--batch_size', default=32, type=int,
                         help='Minibatch size.')
 
@@ -361,6 +806,97 @@ if __name__ == '__main__':
     parser.add_argument('--progress_bar', action="store_true",
                         help="Turn progress bar on.")
 
+    parser.add_argument('--weights_dir', default="", type=str,
+                        help="The directory with the pretrained backbone weights (see weights.py). Defaults to the \
+                            FSCS_WEIGHTS_DIR environment variable, or weights/. Missing weights are downloaded.")
+
+    parser.add_argument('--results_db', default=DEFAULT_RESULTS_DB, type=str,
+                        help="The SQLite file the test results of the run are added to (see results.py). An empty \
+                            string disables it.")
+
+    # Frozen featurizer arguments
+    parser.add_argument('--freeze_featurizer', action="store_true",
+                        help="Keep the pretrained backbone (celeba, chexpert) fixed, cache its features for each split \
+                            once and only train the heads on the cached features.")
+    parser.add_argument('--adapter', action="store_true",
+                        help="Train a small adapter layer on top of the cached features (only with --freeze_featurizer).")
+    parser.add_argument('--feature_cache', default="cache", type=str,
+                        help="The root directory of the cached backbone features.")
+    parser.add_argument('--compact_tabular', action="store_true",
+                        help="Represent the Adult data by the indices and values of the non-zero features, and use an \
+                            embedding bag featurizer instead of the dense linear layer.")
+    parser.add_argument('--single_channel', action="store_true",
+                        help="Load the CheXpert X-rays as single channel images instead of repeating them as RGB, with \
+                            a first convolution of the featurizer that sums the pretrained RGB filters (same features).")
+
+    # Memory arguments
+    parser.add_argument('--checkpoint_segments', default=0, type=int,
+                        help="The number of activation checkpointing segments in the image featurizers (celeba, chexpert). \
+                            Only the activations at the segment boundaries are stored, the rest is recomputed in the backward \
+                            pass. 0 disables checkpointing.")
+
+    # Distributed arguments
+    parser.add_argument('--world_size', default=1, type=int,
+                        help="The number of data parallel training processes (gloo backend, on the CPU). When started with \
+                            torchrun the world size of torchrun is used instead.")
+
+    # Checkpointing arguments
+    parser.add_argument('--save_every', default=0, type=int,
+                        help="Save the training state (model, optimizers, data position and random states) to \
+                            runs/<run name>/training_state.pt every this many steps. 0 disables periodic saving.")
+    parser.add_argument('--resume', default="", type=str,
+                        help="A training state file to continue an interrupted run from. The other arguments should be \
+                            the same as for the interrupted run.")
+
+    # Sample cache arguments
+    parser.add_argument('--sample_cache_mb', default=0, type=int,
+                        help="Cache the transformed training samples in shared memory of this many MB, such that the data \
+                            loader workers of later passes and epochs do not load them again. When it is full the samples \
+                            that were not read recently are evicted. The hit rate is logged per epoch. 0 disables the cache.")
+
+    # Progressive resizing arguments
+    parser.add_argument('--resolution_schedule', default="", type=str,
+                        help="Progressive resizing of the celeba and chexpert images, as comma separated stages of \
+                            resolution:epochs ending with the full resolution, e.g. 128:4,176:4,224. The batch size of \
+                            a stage is scaled with the number of pixels per image. Empty trains at 224 throughout.")
+
+    # Autotuning arguments
+    parser.add_argument('--autotune', action="store_true",
+                        help="Time short training trials with different numbers of data loader workers and intra-op threads, \
+                            pinned memory and prefetching (and batch sizes, see --autotune_batch_sizes), and train with the \
+                            fastest. The result is cached per host, so later runs start with it.")
+    parser.add_argument('--autotune_batch_sizes', default="", type=str,
+                        help="Comma separated batch sizes to try with --autotune, e.g. 32,64,128. Empty keeps --batch_size.")
+    parser.add_argument('--autotune_cache', default=AUTOTUNE_CACHE, type=str,
+                        help="The json file the autotuned configurations of every host are cached in.")
+
+    # Warm start arguments
+    parser.add_argument('--warm_start_epochs', default=0, type=int,
+                        help="Train the first this many epochs without the fairness regularizer (lambda 0) once, and \
+                            continue every run with the same configuration (apart from lambda) from a snapshot of that \
+                            base model in runs/warm_start. 0 trains every run from scratch.")
+
+    # Validation arguments
+    parser.add_argument('--val_every', default=2, type=int,
+                        help="Validate every this many epochs (and after the last epoch).")
+    parser.add_argument('--val_fraction', default=0.0, type=float,
+                        help="For datasets without a validation split (adult, chexpert, civil), the fraction of the \
+                            training set to validate on.")
+    parser.add_argument('--patience', default=0, type=int,
+                        help="Stop training when the validation metric has not improved for this many validations. \
+                            0 disables early stopping. The best model on the validation set is saved either way.")
+    parser.add_argument('--early_stopping_metric', default="auc", type=str, choices=["auc", "acc"],
+                        help="The validation metric that selects the best model.")
+
+    # Profiling arguments
+    parser.add_argument('--profile', action="store_true",
+                        help="Time the phases of every training step (data loading, forward, backward, optimizer steps, \
+                            logging) and write them to TensorBoard under profile/.")
+    parser.add_argument('--profile_trace_steps', default=0, type=int,
+                        help="With --profile, also record a torch.profiler trace of this many steps to runs/<run name>/trace.")
+    parser.add_argument('--profile_trace_start', default=0, type=int,
+                        help="The step at which the torch.profiler trace starts.")
+
     args = parser.parse_args()
     kwargs = vars(args)
 
@@ -0,0 +1,105 @@
+import os
+import inspect
+import argparse
+import torch
+
+WEIGHTS_DIR_ENV = "FSCS_WEIGHTS_DIR"
+DEFAULT_WEIGHTS_DIR = "weights"
+
+# The pretrained weights of the backbones, as files (or for BERT a directory) in the weights directory
+BACKBONE_WEIGHTS = {
+    "resnet50": "resnet50.pt",
+    "densenet121": "densenet121.pt",
+    "bert-base-uncased": "bert-base-uncased",
+    # The small backbones of distilled models (see distill.py)
+    "resnet18": "resnet18.pt",
+    "mobilenet_v2": "mobilenet_v2.pt",
+    "mobilenet_v3_small": "mobilenet_v3_small.pt",
+}
+
+# Memory-mapping only reads the parts of the file that are used, instead of the whole file before loading
+LOAD_KWARGS = {'mmap': True, 'weights_only': True} if 'mmap' in inspect.signature(torch.load).parameters else {}
+
+
+def set_weights_dir(path: str):
+    """Sets the directory the pretrained weights are resolved from (also for processes started later on)."""
+    os.environ[WEIGHTS_DIR_ENV] = path
+
+def get_weights_dir() -> str:
+    return os.environ.get(WEIGHTS_DIR_ENV, DEFAULT_WEIGHTS_DIR)
+
+def local_weights(name: str) -> str:
+    """Returns the path of the local weights of a backbone, or None if they are not in the weights directory."""
+    path = os.path.join(get_weights_dir(), BACKBONE_WEIGHTS[name])
+    return path if os.path.exists(path) else None
+
+def load_weights(path: str) -> dict:
+    return torch.load(path, map_location="cpu", **LOAD_KWARGS)
+
+def torchvision_backbone(name: str, pretrained: bool = True) -> torch.nn.Module:
+    """Builds a torchvision backbone. The pretrained weights are loaded from the weights directory, and only
+    downloaded when they are not there. Without `pretrained` (e.g. when a trained checkpoint is loaded into the
+    model afterwards) the weights are left randomly initialized.
+
+    Args:
+        name (str): the name of the torchvision model (e.g. resnet50 or densenet121, see `BACKBONE_WEIGHTS`).
+        pretrained (bool): load the pretrained ImageNet weights.
+
+    Returns:
+        torch.nn.Module: the backbone.
+    """
+    import torchvision.models as models
+    constructor = getattr(models, name)
+    # Newer torchvision versions replaced the `pretrained` argument by `weights`
+    new_api = 'weights' in inspect.signature(constructor).parameters
+    path = local_weights(name) if pretrained else None
+
+    if pretrained and path is None:
+        return constructor(weights="DEFAULT") if new_api else constructor(pretrained=True)
+    model = constructor(weights=None) if new_api else constructor(pretrained=False)
+    if path is not None:
+        model.load_state_dict(load_weights(path))
+    return model
+
+def bert_classifier(pretrained: bool = True) -> torch.nn.Module:
+    """Builds BERT for sequence classification, from the weights directory if the weights are there. Without
+    `pretrained` only the (bert-base-uncased) configuration is used, so nothing is downloaded."""
+    path = local_weights("bert-base-uncased") if pretrained else None
+    if pretrained and path is None:
+        return torch.hub.load('huggingface/pytorch-transformers', 'modelForSequenceClassification', 'bert-base-uncased', return_dict=False)    # Download model and configuration from S3 and cache
+
+    from transformers import BertConfig, BertForSequenceClassification
+    if path is None:
+        return BertForSequenceClassification(BertConfig(return_dict=False))
+    return BertForSequenceClassification.from_pretrained(path, return_dict=False)
+
+def bert_tokenizer():
+    """Loads the BERT tokenizer from the weights directory if it is there, and downloads it otherwise."""
+    path = local_weights("bert-base-uncased")
+    if path is None:
+        return torch.hub.load('huggingface/pytorch-transformers', 'tokenizer', 'bert-base-uncased')    # Download vocabulary from S3 and cache.
+
+    from transformers import BertTokenizer
+    return BertTokenizer.from_pretrained(path)
+
+def download_weights(output: str):
+    """Downloads the pretrained weights of all backbones into a weights directory (e.g. on a machine with
+    internet access, after which the directory can be copied to machines without)."""
+    os.makedirs(output, exist_ok=True)
+    set_weights_dir(output)
+    for name in [name for name in BACKBONE_WEIGHTS if name != "bert-base-uncased"]:
+        if local_weights(name) is None:
+            torch.save(torchvision_backbone(name).state_dict(), os.path.join(output, BACKBONE_WEIGHTS[name]))
+    if local_weights("bert-base-uncased") is None:
+        bert, tokenizer = bert_classifier(), bert_tokenizer()
+        path = os.path.join(output, BACKBONE_WEIGHTS["bert-base-uncased"])
+        bert.save_pretrained(path)
+        tokenizer.save_pretrained(path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Downloads the pretrained weights of the backbones.")
+    parser.add_argument('--output', default=DEFAULT_WEIGHTS_DIR, type=str,
+                        help="The weights directory to download the weights to.")
+    args = parser.parse_args()
+    download_weights(args.output)